@@ -0,0 +1,82 @@
+import argparse
+import asyncio
+import pathlib
+import sys
+import time
+import httpx
+from fastapi import FastAPI, Request, Response
+from fastapi.responses import JSONResponse, StreamingResponse
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+from security_headers import SecurityHeadersMiddleware
+
+#SECURITY HEADERS MIDDLEWARE BENCHMARK
+#requests per second of a small json route and a streaming route behind the previous @app.middleware("http")
+#implementation (BaseHTTPMiddleware) and behind SecurityHeadersMiddleware. The apps are driven in process through
+#httpx's ASGI transport, so the numbers are the middleware and framework overhead, without sockets or a server.
+#python benchmarks/security_headers.py --requests 5000 --concurrency 50
+
+def add_routes(app:FastAPI):
+    @app.get('/health')
+    async def health():
+        return JSONResponse(content={'status':'ok'})
+
+    @app.get('/stream')
+    async def stream():
+        async def chunks():
+            for _ in range(20):
+                yield b'x'*1024
+        return StreamingResponse(chunks(), media_type='application/octet-stream')
+    return app
+
+def base_http_middleware_app():
+    app=FastAPI()
+
+    @app.middleware("http")
+    async def add_security_headers(request: Request, call_next):
+        response: Response = await call_next(request)
+        response.headers["X-Frame-Options"] = "DENY"
+        response.headers["X-Content-Type-Options"] = "nosniff"
+        response.headers["Referrer-Policy"] = "no-referrer-when-downgrade"
+        response.headers["Permissions-Policy"] = "geolocation=(), microphone=(), camera=()"
+        return response
+    return add_routes(app)
+
+def asgi_middleware_app():
+    app=FastAPI()
+    app.add_middleware(SecurityHeadersMiddleware)
+    return add_routes(app)
+
+def no_middleware_app():
+    return add_routes(FastAPI())
+
+async def run(app, path:str, requests:int, concurrency:int):
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url='http://benchmark') as client:
+        response=await client.get(path)
+        assert response.headers.get('x-frame-options', 'DENY')=='DENY'
+        remaining=requests
+
+        async def worker():
+            nonlocal remaining
+            while remaining>0:
+                remaining-=1
+                await client.get(path)
+        started=time.perf_counter()
+        await asyncio.gather(*[worker() for _ in range(concurrency)])
+        return requests/(time.perf_counter()-started)
+
+async def main(requests:int, concurrency:int, rounds:int):
+    apps=[('no middleware', no_middleware_app()), ('@app.middleware("http")', base_http_middleware_app()), ('SecurityHeadersMiddleware', asgi_middleware_app())]
+    for path in ('/health', '/stream'):
+        print(f'{path} ({requests} requests, concurrency {concurrency}, best of {rounds})')
+        for name, app in apps:
+            best=max([await run(app, path, requests, concurrency) for _ in range(rounds)])
+            print(f'  {name:<28}{best:>10.0f} req/s')
+
+if __name__=='__main__':
+    parser=argparse.ArgumentParser(description='Security headers middleware benchmark')
+    parser.add_argument('--requests', type=int, default=5000)
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--rounds', type=int, default=3)
+    args=parser.parse_args()
+    asyncio.run(main(args.requests, args.concurrency, args.rounds))
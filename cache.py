@@ -0,0 +1,38 @@
+from config import CACHE_BACKEND, REDIS_URL, REDIS_SOCKET_TIMEOUT, CACHE_LOCAL_TTL_SECONDS, CATALOG_CACHE_TTL_SECONDS, CATALOG_CACHE_MAX_ENTRIES, CATALOG_CACHE_MAX_BYTES, CATEGORY_CACHE_TTL_SECONDS, USER_CACHE_TTL_SECONDS, WEBHOOK_DEDUPE_CACHE_TTL_SECONDS, WEBHOOK_DEDUPE_CACHE_MAX_ENTRIES
+from utils.cache import TTLCache, RedisCache
+
+redis_client=None
+redis_pubsub_client=None
+if CACHE_BACKEND=='redis':
+    import redis
+    import redis.asyncio
+    #the handlers await the asyncio client, the blocking one only serves the invalidation listener threads
+    redis_client=redis.asyncio.Redis.from_url(REDIS_URL, socket_timeout=REDIS_SOCKET_TIMEOUT, socket_connect_timeout=REDIS_SOCKET_TIMEOUT)
+    redis_pubsub_client=redis.Redis.from_url(REDIS_URL, socket_timeout=REDIS_SOCKET_TIMEOUT, socket_connect_timeout=REDIS_SOCKET_TIMEOUT)
+
+def create_cache(name:str, max_entries:int, max_bytes:int, ttl_seconds:float):
+    if redis_client is not None:
+        return RedisCache(name, redis_client, redis_pubsub_client, max_entries, max_bytes, ttl_seconds, CACHE_LOCAL_TTL_SECONDS)
+    return TTLCache(max_entries, max_bytes, ttl_seconds)
+
+#anonymous catalog responses (get_products pages and the shared part of get_product)
+catalog_cache=create_cache('catalog', CATALOG_CACHE_MAX_ENTRIES, CATALOG_CACHE_MAX_BYTES, CATALOG_CACHE_TTL_SECONDS)
+#category title -> id
+category_cache=create_cache('categories', 1024, 1024*1024, CATEGORY_CACHE_TTL_SECONDS)
+#username -> public user fields, used by the authentication dependencies
+user_cache=create_cache('users', 10000, 16*1024*1024, USER_CACHE_TTL_SECONDS)
+#('received', event_id) and ('processed', event_id) -> True, lets stripe redeliveries return before any database work.
+#a miss only costs the indexed lookups on webhook_events and processed_stripe_events, so it stays in memory
+webhook_event_cache=TTLCache(WEBHOOK_DEDUPE_CACHE_MAX_ENTRIES, WEBHOOK_DEDUPE_CACHE_MAX_ENTRIES*64, WEBHOOK_DEDUPE_CACHE_TTL_SECONDS)
+
+caches=[catalog_cache, category_cache, user_cache, webhook_event_cache]
+
+def start_caches():
+    for cache in caches:
+        cache.start()
+
+async def stop_caches():
+    for cache in caches:
+        cache.stop()
+    if redis_client is not None:
+        await redis_client.aclose()
@@ -3,6 +3,23 @@ import os
 #URL_DATABASE=os.getenv("DATABASE_URL") #al desplegar, para q se conecte a la base postgre
 URL_DATABASE=os.getenv("DATABASE_URL")
 
+#CONNECTION POOL (per worker process: pool size + overflow connections at most)
+DB_POOL_SIZE=int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW=int(os.getenv("DB_MAX_OVERFLOW", "10"))
+#seconds a request waits for a free connection before failing
+DB_POOL_TIMEOUT=float(os.getenv("DB_POOL_TIMEOUT", "10"))
+#seconds after which a connection is replaced, keep it below any proxy/server idle timeout
+DB_POOL_RECYCLE=int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING=os.getenv("DB_POOL_PRE_PING", "true").lower()=="true"
+
+#READ REPLICA (optional, read-only catalog and admin listings)
+REPLICA_DATABASE_URL=os.getenv("REPLICA_DATABASE_URL")
+#replica reads fall back to the primary when the replica is further behind than this
+REPLICA_MAX_LAG_SECONDS=float(os.getenv("REPLICA_MAX_LAG_SECONDS", "5"))
+REPLICA_LAG_CHECK_SECONDS=float(os.getenv("REPLICA_LAG_CHECK_SECONDS", "1"))
+#after a write, the reads of the client that wrote (read_primary_until cookie) stay on the primary for this long
+READ_AFTER_WRITE_SECONDS=int(os.getenv("READ_AFTER_WRITE_SECONDS", "10"))
+
 #CSRF_TOKEN
 CSRF_SECRET_KEY=os.getenv("CSRF_SECRET_KEY")
 
@@ -14,6 +31,12 @@ REFRESH_TOKEN_EXPIRE_DAYS=int(os.getenv("REFRESH_TOKEN_EXPIRE_DAYS"))
 
 ALGORITHM="HS256"
 
+#PASSWORD HASHING (bcrypt runs off the event loop, "thread" or "process" pool)
+PASSWORD_HASH_EXECUTOR=os.getenv("PASSWORD_HASH_EXECUTOR", "thread")
+PASSWORD_HASH_WORKERS=int(os.getenv("PASSWORD_HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
+#hash/verify calls allowed to wait for a worker, beyond that logins get a 503 instead of queueing without bound
+PASSWORD_HASH_MAX_PENDING=int(os.getenv("PASSWORD_HASH_MAX_PENDING", "64"))
+
 
 #PROJECT_ID_GOOGLE='sawwwqafvxrrasfwqa-464421-t0'
 
@@ -27,6 +50,12 @@ FIRST_ADMIN_PHONE_NUMBER_REGION=os.getenv("FIRST_ADMIN_PHONE_NUMBER_REGION")
 STRIPE_SECRET_KEY=os.getenv("STRIPE_SECRET_KEY")
 STRIPE_WEBHOOK_SECRET=os.getenv("STRIPE_WEBHOOK_SECRET")
 CURRENCY=os.getenv("CURRENCY")
+#stripe api calls (async client with keep-alive), STRIPE_API_BASE points the client to another server (services/fake_stripe.py in tests)
+STRIPE_API_BASE=os.getenv("STRIPE_API_BASE")
+STRIPE_TIMEOUT_SECONDS=float(os.getenv("STRIPE_TIMEOUT_SECONDS", "10"))
+STRIPE_CONNECT_TIMEOUT_SECONDS=float(os.getenv("STRIPE_CONNECT_TIMEOUT_SECONDS", "3"))
+#retries with exponential backoff on network errors, 409/429 and retryable 5xx, POSTs carry an idempotency key
+STRIPE_MAX_NETWORK_RETRIES=int(os.getenv("STRIPE_MAX_NETWORK_RETRIES", "2"))
 
 #There are some settings in cart_and_payment router about payments that could be changed
 
@@ -38,10 +67,50 @@ CANCEL_URL=os.getenv("CANCEL_URL")
 CREATE_RESERVATION_EXPIRATION_TIME=int(os.getenv("CREATE_RESERVATION_EXPIRATION_TIME"))
 #CHECKOUT_PAYMENT_EXPIRATION_TIME
 CHECKOUT_PAYMENT_EXPIRATION_TIME=int(os.getenv("CHECKOUT_PAYMENT_EXPIRATION_TIME"))
-#RELEASE_EXPIRED_RESERVATIONS_TIME
-#RELEASE_EXPIRED_RESERVATIONS_TIME=int(os.getenv("RELEASE_EXPIRED_RESERVATIONS_TIME"))
-
-
+#STRIPE WEBHOOK QUEUE: verified events are stored in webhook_events and processed by WEBHOOK_CONSUMERS tasks per worker
+#set WEBHOOK_CONSUMERS=0 on the api workers when the consumers run as their own process (python -m services.webhook_queue)
+WEBHOOK_CONSUMERS=int(os.getenv("WEBHOOK_CONSUMERS", "2"))
+WEBHOOK_POLL_SECONDS=float(os.getenv("WEBHOOK_POLL_SECONDS", "1"))
+#a claimed event is given back to the queue if its consumer has not finished after this long
+WEBHOOK_LEASE_SECONDS=float(os.getenv("WEBHOOK_LEASE_SECONDS", "120"))
+#failed events are retried with exponential backoff and dead-lettered after WEBHOOK_MAX_ATTEMPTS attempts
+WEBHOOK_MAX_ATTEMPTS=int(os.getenv("WEBHOOK_MAX_ATTEMPTS", "8"))
+WEBHOOK_RETRY_BASE_SECONDS=float(os.getenv("WEBHOOK_RETRY_BASE_SECONDS", "5"))
+WEBHOOK_RETRY_MAX_SECONDS=float(os.getenv("WEBHOOK_RETRY_MAX_SECONDS", "900"))
+
+#RESERVATION REAPER: releases expired reservations and expires checkout sessions every RESERVATION_REAPER_INTERVAL_SECONDS
+#set RESERVATION_REAPER_ENABLED=false on the api workers when it runs as its own process (python -m services.reservation_reaper)
+RESERVATION_REAPER_ENABLED=os.getenv("RESERVATION_REAPER_ENABLED", "true").lower()=="true"
+RESERVATION_REAPER_INTERVAL_SECONDS=float(os.getenv("RESERVATION_REAPER_INTERVAL_SECONDS", "30"))
+#rows handled per transaction
+RESERVATION_REAPER_BATCH_SIZE=int(os.getenv("RESERVATION_REAPER_BATCH_SIZE", "100"))
+
+#RATING STATS RECONCILER: recomputes product_rating_stats from stars and copies average and total into products
+#set RATING_STATS_RECONCILE_ENABLED=false on the api workers when it runs as its own process (python -m services.rating_stats)
+RATING_STATS_RECONCILE_ENABLED=os.getenv("RATING_STATS_RECONCILE_ENABLED", "true").lower()=="true"
+RATING_STATS_RECONCILE_INTERVAL_SECONDS=float(os.getenv("RATING_STATS_RECONCILE_INTERVAL_SECONDS", "60"))
+#products handled per transaction
+RATING_STATS_RECONCILE_BATCH_SIZE=int(os.getenv("RATING_STATS_RECONCILE_BATCH_SIZE", "500"))
+#passes only recompute the products rated since the previous pass, every FULL_EVERY_RUNS passes (and the first) recompute all of them, 0 for the first only
+RATING_STATS_RECONCILE_FULL_EVERY_RUNS=int(os.getenv("RATING_STATS_RECONCILE_FULL_EVERY_RUNS", "60"))
+
+
+#LOGGING
+LOG_LEVEL=os.getenv("LOG_LEVEL", "INFO")
+#per module levels, "logger=LEVEL" pairs separated by commas. The stripe and httpx clients log every api call at INFO
+LOG_LEVELS=os.getenv("LOG_LEVELS", "stripe=WARNING,httpx=WARNING")
+#"json" (one object per line) or "text"
+LOG_FORMAT=os.getenv("LOG_FORMAT", "json")
+#records waiting for the writer thread, beyond it records are dropped instead of blocking
+LOG_QUEUE_SIZE=int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+
+#REQUEST METRICS (/metrics, prometheus text format)
+#when set, /metrics requires "Authorization: Bearer <METRICS_TOKEN>"
+METRICS_TOKEN=os.getenv("METRICS_TOKEN")
+#adds a Server-Timing header (app and db time, SQL statement count) to every response
+METRICS_SERVER_TIMING=os.getenv("METRICS_SERVER_TIMING", "false").lower()=="true"
+#requests running more SQL statements than this log a warning (N+1 queries)
+METRICS_SQL_WARN_STATEMENTS=int(os.getenv("METRICS_SQL_WARN_STATEMENTS", "50"))
 
 #ORIGINS
 ORIGIN_1=os.getenv("ORIGIN_1")
@@ -53,4 +122,26 @@ ALLOWED_HOST_2=os.getenv("ALLOWED_HOST_2")
 
 
 #STRIPE CHECKOUT SESSIONS EXPIRATION TIME
-CHECKOUT_SESSION_EXPIRATION_TIME=int(os.getenv("CHECKOUT_SESSION_EXPIRATION_TIME"))
\ No newline at end of file
+CHECKOUT_SESSION_EXPIRATION_TIME=int(os.getenv("CHECKOUT_SESSION_EXPIRATION_TIME"))
+
+#CATALOG RESPONSE CACHE (anonymous product reads)
+CATALOG_CACHE_TTL_SECONDS=int(os.getenv("CATALOG_CACHE_TTL_SECONDS", "30"))
+CATALOG_CACHE_MAX_ENTRIES=int(os.getenv("CATALOG_CACHE_MAX_ENTRIES", "2048"))
+CATALOG_CACHE_MAX_BYTES=int(os.getenv("CATALOG_CACHE_MAX_BYTES", str(32*1024*1024)))
+
+#SHARED CACHE BACKEND ("memory": per worker, "redis": shared by every worker and pod)
+CACHE_BACKEND=os.getenv("CACHE_BACKEND", "memory")
+REDIS_URL=os.getenv("REDIS_URL", "redis://localhost:6379/0")
+REDIS_SOCKET_TIMEOUT=float(os.getenv("REDIS_SOCKET_TIMEOUT", "0.25"))
+#local copy kept in front of redis, bounds staleness if an invalidation message is missed
+CACHE_LOCAL_TTL_SECONDS=float(os.getenv("CACHE_LOCAL_TTL_SECONDS", "5"))
+CATEGORY_CACHE_TTL_SECONDS=int(os.getenv("CATEGORY_CACHE_TTL_SECONDS", "300"))
+USER_CACHE_TTL_SECONDS=int(os.getenv("USER_CACHE_TTL_SECONDS", "60"))
+#recently seen stripe event ids, always local to the worker
+WEBHOOK_DEDUPE_CACHE_TTL_SECONDS=int(os.getenv("WEBHOOK_DEDUPE_CACHE_TTL_SECONDS", "86400"))
+WEBHOOK_DEDUPE_CACHE_MAX_ENTRIES=int(os.getenv("WEBHOOK_DEDUPE_CACHE_MAX_ENTRIES", "100000"))
+
+#PRODUCT REVIEWS
+#reviews embedded in get_product, the rest are paged through /reviews/get_product_reviews
+PRODUCT_REVIEWS_PREVIEW=int(os.getenv("PRODUCT_REVIEWS_PREVIEW", "5"))
+PRODUCT_REVIEWS_MAX_LIMIT=int(os.getenv("PRODUCT_REVIEWS_MAX_LIMIT", "100"))
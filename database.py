@@ -1,21 +1,178 @@
-from sqlalchemy import create_engine, event
-from sqlalchemy.orm import sessionmaker
+import threading
+import time
+from sqlalchemy import DateTime, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import SQLAlchemyError, TimeoutError as PoolTimeoutError
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from sqlalchemy.types import TypeDecorator
+from datetime import datetime, timezone
 import os
 #from databases import Database
-from config import URL_DATABASE
+from config import URL_DATABASE, DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT, DB_POOL_RECYCLE, DB_POOL_PRE_PING, REPLICA_DATABASE_URL, REPLICA_MAX_LAG_SECONDS, REPLICA_LAG_CHECK_SECONDS
 
+#async drivers for the urls the deployment already uses (postgres://, postgresql://, postgresql+psycopg2://) and for
+#the sqlite databases of the test suite
+ASYNC_DRIVERS={
+    'postgres':'postgresql+asyncpg',
+    'postgresql':'postgresql+asyncpg',
+    'postgresql+psycopg2':'postgresql+asyncpg',
+    'sqlite':'sqlite+aiosqlite',
+}
 
-engine=create_engine(URL_DATABASE)
+def async_database_url(url:str):
+    url=make_url(url.replace('postgres://', 'postgresql://', 1) if url.startswith('postgres://') else url)
+    return url.set(drivername=ASYNC_DRIVERS.get(url.drivername, url.drivername))
 
-@event.listens_for(engine, "connect")
-def set_timezone(dbapi_connection, connection_record):
-    cursor = dbapi_connection.cursor()
-    cursor.execute("SET timezone = 'UTC';")  # UTC offset
-    cursor.close()
+#POOL METRICS
+#checkouts, time spent waiting for a connection (including opening a new one), checkouts that found the pool
+#exhausted and QueuePool limit timeouts, to see saturation before requests start failing.
+class PoolMetrics:
+    def __init__(self):
+        self._lock=threading.Lock()
+        self.checkouts=0
+        self.exhausted=0
+        self.timeouts=0
+        self.wait_seconds_total=0.0
+        self.wait_seconds_max=0.0
 
-SessionLocal=sessionmaker(autocommit=False,autoflush=False,bind=engine)
+    def record(self, wait_seconds:float, exhausted:bool, timed_out:bool):
+        with self._lock:
+            self.checkouts+=1
+            self.exhausted+=exhausted
+            self.timeouts+=timed_out
+            self.wait_seconds_total+=wait_seconds
+            self.wait_seconds_max=max(self.wait_seconds_max, wait_seconds)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'checkouts':self.checkouts,
+                'exhausted':self.exhausted,
+                'timeouts':self.timeouts,
+                'wait_seconds_total':round(self.wait_seconds_total, 6),
+                'wait_seconds_avg':round(self.wait_seconds_total/self.checkouts, 6) if self.checkouts else 0.0,
+                'wait_seconds_max':round(self.wait_seconds_max, 6)
+            }
+
+class InstrumentedPool(AsyncAdaptedQueuePool):
+    metrics=None
+
+    def _do_get(self):
+        exhausted=self._max_overflow>-1 and self.checkedout()>=self.size()+self._max_overflow
+        started=time.perf_counter()
+        timed_out=False
+        try:
+            return super()._do_get()
+        except PoolTimeoutError:
+            timed_out=True
+            raise
+        finally:
+            self.metrics.record(time.perf_counter()-started, exhausted, timed_out)
+
+def database_connect_args(database_url):
+    #asyncpg sends server_settings in the startup packet, no extra SET round trip per new connection. Other drivers
+    #(sqlite+aiosqlite for local runs) do not accept it and have no session timezone to set
+    return {'server_settings':{'timezone':'UTC'}} if database_url.get_backend_name()=='postgresql' else {}
+
+def create_database_engine(url:str):
+    #every engine gets its own pool class so primary and replica metrics are kept apart (pools are recreated on dispose)
+    metrics=PoolMetrics()
+    pool_class=type('InstrumentedPool', (InstrumentedPool,), {'metrics':metrics})
+    database_url=async_database_url(url)
+    database_engine=create_async_engine(
+        database_url,
+        poolclass=pool_class,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_recycle=DB_POOL_RECYCLE,
+        pool_pre_ping=DB_POOL_PRE_PING,
+        connect_args=database_connect_args(database_url)
+    )
+    return database_engine, metrics
+
+engine, pool_metrics=create_database_engine(URL_DATABASE)
+
+replica_engine, replica_pool_metrics=create_database_engine(REPLICA_DATABASE_URL) if REPLICA_DATABASE_URL else (None, None)
+
+def engine_pool_stats(database_engine, metrics):
+    pool=database_engine.pool
+    return {
+        'size':pool.size(),
+        'max_overflow':DB_MAX_OVERFLOW,
+        'checked_in':pool.checkedin(),
+        'checked_out':pool.checkedout(),
+        'overflow':pool.overflow(),
+        **metrics.stats()
+    }
+
+def pool_stats():
+    return {
+        'primary':engine_pool_stats(engine, pool_metrics),
+        'replica':{**engine_pool_stats(replica_engine, replica_pool_metrics), 'lag_seconds':replica_state['lag_seconds']} if replica_engine is not None else None
+    }
+
+#expire_on_commit=False: attributes stay readable after commit without an implicit (sync) refresh
+SessionLocal=async_sessionmaker(bind=engine, autoflush=False, expire_on_commit=False)
+ReplicaSessionLocal=async_sessionmaker(bind=replica_engine, autoflush=False, expire_on_commit=False) if replica_engine is not None else None
+
+#READ REPLICA ROUTING
+#a read goes to the replica only when it is close enough to the primary. read-after-write is per client: a request
+#that committed sets a cookie sending that client's reads to the primary for a while (see dependencies/database.py),
+#other clients keep reading from the replica.
+#lag is 0 when the replica has replayed everything it received, so an idle primary does not look like lag.
+REPLICA_LAG_QUERY=text(
+    "SELECT CASE WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn()=pg_last_wal_replay_lsn() THEN 0 "
+    "ELSE COALESCE(EXTRACT(EPOCH FROM now()-pg_last_xact_replay_timestamp()), 0) END"
+)
+
+#two local databases (sqlite files in tests and local runs) have no replication to measure, a reachable one is current
+LOCAL_REPLICA_LAG_QUERY=text('SELECT 0')
+
+replica_state={'lag_seconds':None, 'checked_at':0.0}
+
+async def replica_lag():
+    #cached for REPLICA_LAG_CHECK_SECONDS, None when the replica cannot be reached
+    now=time.monotonic()
+    if now-replica_state['checked_at']<REPLICA_LAG_CHECK_SECONDS:
+        return replica_state['lag_seconds']
+    replica_state['checked_at']=now
+    try:
+        async with replica_engine.connect() as connection:
+            lag_query=REPLICA_LAG_QUERY if replica_engine.dialect.name=='postgresql' else LOCAL_REPLICA_LAG_QUERY
+            replica_state['lag_seconds']=float((await connection.execute(lag_query)).scalar())
+    except (SQLAlchemyError, OSError):
+        replica_state['lag_seconds']=None
+    return replica_state['lag_seconds']
+
+async def replica_available():
+    if replica_engine is None:
+        return False
+    lag=await replica_lag()
+    return lag is not None and lag<=REPLICA_MAX_LAG_SECONDS
 
 Base=declarative_base()
 
-#database_db = Database(URL_DATABASE)
\ No newline at end of file
+#timestamps are stored as naive UTC (the session timezone is UTC). asyncpg refuses aware datetimes for
+#TIMESTAMP WITHOUT TIME ZONE parameters, so aware values are normalized to naive UTC before binding.
+class UTCDateTime(TypeDecorator):
+    impl=DateTime
+    cache_ok=True
+
+    def process_bind_param(self, value, dialect):
+        if value is not None and value.tzinfo is not None:
+            value=value.astimezone(timezone.utc).replace(tzinfo=None)
+        return value
+
+    @property
+    def python_type(self):
+        #decode_cursor parses the cursor value of a date sort with it
+        return datetime
+
+#database_db = Database(URL_DATABASE)
+
+def is_fresh_read(session):
+    #a read worth caching: from the primary, or from a replica that had replayed everything at the last check
+    return session.bind is not replica_engine or replica_state['lag_seconds']==0
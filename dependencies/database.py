@@ -1,14 +1,71 @@
-from database import SessionLocal
-from fastapi import Depends
+from database import SessionLocal, ReplicaSessionLocal, replica_available
+from fastapi import Depends, Request
 from typing import Annotated
-from sqlalchemy.orm import Session
+from http.cookies import SimpleCookie
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncSession
+from config import READ_AFTER_WRITE_SECONDS
+import time
 
-def get_db():
-    db=SessionLocal()
-    try:
+#cookie holding the unix time until which the client reads from the primary (read-after-write)
+READ_PRIMARY_COOKIE='read_primary_until'
+
+def mark_request_write(request:Request):
+    #only this client is sent to the primary after its write, see ReadAfterWriteMiddleware
+    def after_commit(session):
+        request.state.primary_write=True
+    return after_commit
+
+async def get_db(request:Request):
+    async with SessionLocal() as db:
+        event.listen(db.sync_session, 'after_commit', mark_request_write(request))
         yield db
-    finally:
-        db.close()
-        
+
+def read_primary_requested(request:Request):
+    try:
+        return float(request.cookies.get(READ_PRIMARY_COOKIE, 0))>time.time()
+    except ValueError:
+        return False
+
+async def get_read_db(request:Request):
+    #read-only routes: the replica when it is available and fresh enough for this client, the primary otherwise
+    if ReplicaSessionLocal is not None and not read_primary_requested(request) and await replica_available():
+        async with ReplicaSessionLocal() as db:
+            yield db
+    else:
+        async with SessionLocal() as db:
+            yield db
+
+def read_primary_cookie_header():
+    cookie=SimpleCookie()
+    cookie[READ_PRIMARY_COOKIE]=str(int(time.time())+READ_AFTER_WRITE_SECONDS)
+    cookie[READ_PRIMARY_COOKIE]['max-age']=READ_AFTER_WRITE_SECONDS
+    cookie[READ_PRIMARY_COOKIE]['path']='/'
+    cookie[READ_PRIMARY_COOKIE]['httponly']=True
+    cookie[READ_PRIMARY_COOKIE]['secure']=True
+    cookie[READ_PRIMARY_COOKIE]['samesite']='lax'
+    return (b'set-cookie', cookie.output(header='').strip().encode('latin-1'))
+
+#READ AFTER WRITE
+#pure ASGI like SecurityHeadersMiddleware: when the request committed (request.state.primary_write, set by get_db)
+#the cookie is added to the http.response.start message. request.state lives in scope['state'], so it is created
+#here first and the route sees the same dict.
+class ReadAfterWriteMiddleware:
+    def __init__(self, app):
+        self.app=app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type']!='http':
+            return await self.app(scope, receive, send)
+        state=scope.setdefault('state', {})
+
+        async def send_with_cookie(message):
+            if message['type']=='http.response.start' and state.get('primary_write', False):
+                message['headers']=list(message.get('headers', []))+[read_primary_cookie_header()]
+            await send(message)
+        await self.app(scope, receive, send_with_cookie)
+
 #DATABASE
-SessionDB=Annotated[Session, Depends(get_db)]
\ No newline at end of file
+SessionDB=Annotated[AsyncSession, Depends(get_db)]
+#READ ONLY (replica when configured)
+ReadOnlySessionDB=Annotated[AsyncSession, Depends(get_read_db)]
@@ -0,0 +1,144 @@
+import json
+import logging
+import queue
+import re
+import sys
+import uuid
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from config import LOG_LEVEL, LOG_LEVELS, LOG_FORMAT, LOG_QUEUE_SIZE
+
+#LOGGING
+#every record goes through a bounded in-memory queue and is written to stdout by a listener thread, so logging never
+#blocks the event loop on I/O (a full queue drops the record and counts it). Records carry the correlation id of
+#the request (the X-Request-ID header or a new one) or of the stripe event being processed, and the fields passed
+#with extra={...}. LOG_FORMAT=json writes one JSON object per line, text is for a terminal. LOG_LEVELS sets per
+#module levels, e.g. "services.webhook_queue=DEBUG,sqlalchemy.engine=WARNING".
+
+correlation_id:ContextVar[str|None]=ContextVar('correlation_id', default=None)
+
+#attributes every LogRecord has, anything else on a record came from extra={...}
+RECORD_ATTRIBUTES=set(logging.LogRecord('', 0, '', 0, '', None, None).__dict__)|{'message', 'asctime', 'correlation_id'}
+
+def record_fields(record:logging.LogRecord):
+    return {key:value for key, value in record.__dict__.items() if key not in RECORD_ATTRIBUTES}
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record:logging.LogRecord):
+        entry={
+            'timestamp':datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            'level':record.levelname,
+            'logger':record.name,
+            'message':record.getMessage(),
+            'correlation_id':getattr(record, 'correlation_id', None),
+            **record_fields(record)
+        }
+        if record.exc_info and not record.exc_text:
+            record.exc_text=self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exception']=record.exc_text
+        return json.dumps(entry, default=str)
+
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__('%(asctime)s %(levelname)s %(name)s [%(correlation_id)s] %(message)s')
+
+    def format(self, record:logging.LogRecord):
+        line=super().format(record)
+        fields=record_fields(record)
+        if fields:
+            line+=' '+' '.join(f'{key}={value}' for key, value in fields.items())
+        return line
+
+class ContextQueueHandler(QueueHandler):
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped=0
+
+    def prepare(self, record:logging.LogRecord):
+        #runs in the caller's task: the correlation id is read, the message rendered and the exception turned into
+        #text here, so the listener thread only formats plain values
+        record=logging.makeLogRecord(record.__dict__)
+        record.correlation_id=correlation_id.get()
+        record.msg=record.getMessage()
+        record.args=None
+        if record.exc_info:
+            record.exc_text=logging.Formatter().formatException(record.exc_info)
+            record.exc_info=None
+        return record
+
+    def enqueue(self, record:logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped+=1
+
+_listener=None
+_handler=None
+
+def parse_levels(levels:str):
+    parsed={}
+    for item in levels.split(','):
+        if '=' in item:
+            name, level=item.split('=', 1)
+            parsed[name.strip()]=level.strip().upper()
+    return parsed
+
+def setup_logging():
+    global _listener, _handler
+    if _listener is not None:
+        return
+    stream_handler=logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(JsonFormatter() if LOG_FORMAT=='json' else TextFormatter())
+    _handler=ContextQueueHandler(queue.Queue(LOG_QUEUE_SIZE))
+    root=logging.getLogger()
+    root.addHandler(_handler)
+    root.setLevel(LOG_LEVEL.upper())
+    for name, level in parse_levels(LOG_LEVELS).items():
+        logging.getLogger(name).setLevel(level)
+    _listener=QueueListener(_handler.queue, stream_handler, respect_handler_level=True)
+    _listener.start()
+
+def stop_logging():
+    #writes out what is still queued
+    global _listener, _handler
+    if _listener is not None:
+        logging.getLogger().removeHandler(_handler)
+        _listener.stop()
+        _listener=None
+        _handler=None
+
+def logging_stats():
+    return {
+        'queued':_handler.queue.qsize() if _handler else 0,
+        'dropped':_handler.dropped if _handler else 0
+    }
+
+REQUEST_ID_PATTERN=re.compile(r'^[A-Za-z0-9._:-]{1,128}$')
+
+class CorrelationIdMiddleware:
+    #pure ASGI, sets the correlation id for everything logged while the request runs and echoes it in X-Request-ID
+    def __init__(self, app):
+        self.app=app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type']!='http':
+            return await self.app(scope, receive, send)
+        request_id=None
+        for name, value in scope['headers']:
+            if name==b'x-request-id':
+                request_id=value.decode('latin-1')
+                break
+        if request_id is None or not REQUEST_ID_PATTERN.match(request_id):
+            request_id=uuid.uuid4().hex
+        token=correlation_id.set(request_id)
+
+        async def send_with_request_id(message):
+            if message['type']=='http.response.start':
+                message['headers']=[*message.get('headers', []), (b'x-request-id', request_id.encode('latin-1'))]
+            await send(message)
+        try:
+            await self.app(scope, receive, send_with_request_id)
+        finally:
+            correlation_id.reset(token)
@@ -1,26 +1,28 @@
 from fastapi import FastAPI, Request, Response, HTTPException, status
-from routers import users, products,cart_and_payment, orders, categories, stars, wishlists, reviews
+from routers import users, products,cart_and_payment, orders, categories, stars, wishlists, reviews, monitoring, metrics
 from contextlib import asynccontextmanager
-from database import engine, Base, SessionLocal
+from database import engine, replica_engine
+from dependencies.database import ReadAfterWriteMiddleware
 from fastapi.middleware.cors import CORSMiddleware
 #from fastapi.middleware.httpsredirect import HTTPSRedirectMiddleware
 from fastapi.middleware.trustedhost import TrustedHostMiddleware
 from starlette.middleware.base import BaseHTTPMiddleware
-from models.users import Users
-from routers.users import get_password_hash, process_phone_number
-from config import FIRST_ADMIN_PASSWORD, FIRST_ADMIN_EMAIL, FIRST_ADMIN_PHONE_NUMBER, FIRST_ADMIN_PHONE_NUMBER_REGION, ORIGIN_1, ORIGIN_2, ALLOWED_HOST_1, ALLOWED_HOST_2, CHECKOUT_SESSION_EXPIRATION_TIME
+from config import ORIGIN_1, ORIGIN_2, ALLOWED_HOST_1, ALLOWED_HOST_2, RESERVATION_REAPER_ENABLED, RATING_STATS_RECONCILE_ENABLED
+from routers.cart_and_payment import process_stripe_event
 from fastapi_csrf_protect import CsrfProtect
 from schemas.security import CsrfSettings
 from fastapi_csrf_protect.exceptions import CsrfProtectError
-from fastapi.responses import JSONResponse
-from apscheduler.schedulers.background import BackgroundScheduler
-from sqlalchemy.orm import Session
-from datetime import datetime, timedelta, timezone
-from models.reservations import Reservations
-from models.products import Products
-from models.payments import CheckOutSessions
-from routers.cart_and_payment import delete_reservation
-from sqlalchemy.exc import SQLAlchemyError
+from utils.responses import ORJSONResponse
+from cache import start_caches, stop_caches
+from services.passwords import password_hasher
+from services.stripe_gateway import close_stripe_client
+from services.reservation_reaper import reservation_reaper
+from services.webhook_queue import webhook_queue
+from services.rating_stats import rating_stats_reconciler
+from migrations.schema import check_schema_version
+from logs import setup_logging, stop_logging, CorrelationIdMiddleware
+from metrics import RequestMetricsMiddleware
+from security_headers import SecurityHeadersMiddleware
 
 
 origins = [
@@ -28,56 +30,36 @@ origins = [
     ORIGIN_2, 
 ]
 
-'''def release_expired_checkout_sessions(): #set them to expired rather than deleting and delete the cart snapshoots associated with expired checkout sessions, and do the reconcilliation process as well, also do not delete nor set to expire if there are transactions ongoing
-    db=SessionLocal()
-    now=datetime.now(timezone.utc)
-    try:
-        expired_checkout_sessions=db.query(CheckOutSessions).filter(CheckOutSessions.expires_at<now).all()
-        for expired in expired_checkout_sessions:
-            db.delete(expired)
-        db.commit()
-        db.close()
-        print('All checkout sessions were deleted')
-    except SQLAlchemyError as e:
-        db.rollback()
-        print(f'An error occurred while deleting the checkout sessions {e}')
-
-scheduler = BackgroundScheduler()
-scheduler.add_job(release_expired_checkout_sessions, 'interval', minutes=CHECKOUT_SESSION_EXPIRATION_TIME)
-'''
-
 @asynccontextmanager
 async def lifespan(app:FastAPI):
-    Base.metadata.create_all(bind=engine)
-    
-    session=SessionLocal()
-    existing_admin=session.query(Users).filter(Users.role=='admin').first()
-    if not existing_admin:
-        phone_number=process_phone_number(FIRST_ADMIN_PHONE_NUMBER, FIRST_ADMIN_PHONE_NUMBER_REGION)
-        password_hashed=get_password_hash(FIRST_ADMIN_PASSWORD)
-        first_admin=Users(username='first_admin', email=FIRST_ADMIN_EMAIL, hashed_password=password_hashed,name='first_admin',lastname='first_admin',disabled=False, verified=True,role='admin',stripe_id='No id', phone_number=phone_number)
-        session.add(first_admin)
-        session.commit()
-        session.refresh(first_admin)  
-    else:
-        session.close()
-    #scheduler.start()
+    setup_logging()
+    #tables are created and migrated by python manage.py migrate and the first admin by python manage.py init-admin
+    await check_schema_version(engine)
+    start_caches()
+    if RESERVATION_REAPER_ENABLED:
+        reservation_reaper.start()
+    if RATING_STATS_RECONCILE_ENABLED:
+        rating_stats_reconciler.start()
+    webhook_queue.start(process_stripe_event)
     yield
-    #scheduler.shutdown()
-
-app=FastAPI(lifespan=lifespan)
+    await webhook_queue.stop()
+    await reservation_reaper.stop()
+    await rating_stats_reconciler.stop()
+    await stop_caches()
+    password_hasher.shutdown()
+    await close_stripe_client()
+    await engine.dispose()
+    if replica_engine is not None:
+        await replica_engine.dispose()
+    stop_logging()
 
-@app.middleware("http")
-async def add_security_headers(request: Request, call_next):
-    response: Response = await call_next(request)
+app=FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
 
-    # Set security headers manually
-    response.headers["X-Frame-Options"] = "DENY"
-    response.headers["X-Content-Type-Options"] = "nosniff"
-    response.headers["Referrer-Policy"] = "no-referrer-when-downgrade"
-    response.headers["Permissions-Policy"] = "geolocation=(), microphone=(), camera=()"
+app.add_middleware(SecurityHeadersMiddleware)
 
-    return response
+#read-after-write: a client that just wrote keeps reading from the primary for a while
+if replica_engine is not None:
+    app.add_middleware(ReadAfterWriteMiddleware)
 
 app.add_middleware(
     CORSMiddleware,
@@ -87,6 +69,12 @@ app.add_middleware(
     allow_headers=["*"], 
 )
 
+#times the whole request and counts its SQL statements, see metrics.py
+app.add_middleware(RequestMetricsMiddleware)
+
+#outermost, everything logged while a request runs carries its X-Request-ID
+app.add_middleware(CorrelationIdMiddleware)
+
 #app.add_middleware(HTTPSRedirectMiddleware)
 
 #app.add_middleware(TrustedHostMiddleware,
@@ -122,7 +110,7 @@ def get_csrf_config():
 
 @app.exception_handler(CsrfProtectError)
 def csrf_protect_exception_handler(request: Request, exc: CsrfProtectError):
-  return JSONResponse(status_code=exc.status_code, content={"detail": exc.message})
+  return ORJSONResponse(status_code=exc.status_code, content={"detail": exc.message})
 
 
 app.include_router(users.router)
@@ -133,3 +121,5 @@ app.include_router(categories.router)
 app.include_router(stars.router)
 app.include_router(wishlists.router)
 app.include_router(reviews.router)
+app.include_router(monitoring.router)
+app.include_router(metrics.router)
@@ -0,0 +1,78 @@
+import argparse
+import asyncio
+from alembic import command
+from sqlalchemy import inspect
+from database import engine, SessionLocal
+from migrations.schema import alembic_config, current_revision
+
+#MANAGEMENT COMMANDS
+#python manage.py migrate          upgrade the database to the latest migration, run it once per deploy before the app
+#python manage.py sql [range]      print the migration SQL without connecting to the database (default: the whole history)
+#python manage.py current          print the schema version of the database
+#python manage.py init-admin       create the first admin from the FIRST_ADMIN_* settings if there is no admin yet
+
+#a database created by create_all before migrations existed has the tables but no alembic_version
+BASELINE_REVISION='0000'
+
+def legacy_schema(connection):
+    return current_revision(connection) is None and inspect(connection).has_table('users')
+
+async def needs_baseline_stamp():
+    try:
+        async with engine.connect() as connection:
+            return await connection.run_sync(legacy_schema)
+    finally:
+        await engine.dispose()
+
+def migrate():
+    config=alembic_config()
+    if asyncio.run(needs_baseline_stamp()):
+        print(f'Existing schema without a version, stamping it at {BASELINE_REVISION}')
+        command.stamp(config, BASELINE_REVISION)
+    command.upgrade(config, 'head')
+
+def sql(revision_range:str):
+    command.upgrade(alembic_config(), revision_range, sql=True)
+
+def current():
+    command.current(alembic_config(), verbose=True)
+
+async def init_admin():
+    from sqlalchemy import select
+    from models.users import Users
+    from routers.users import get_password_hash, process_phone_number
+    from services.passwords import password_hasher
+    from config import FIRST_ADMIN_PASSWORD, FIRST_ADMIN_EMAIL, FIRST_ADMIN_PHONE_NUMBER, FIRST_ADMIN_PHONE_NUMBER_REGION
+    try:
+        async with SessionLocal() as session:
+            existing_admin=(await session.execute(select(Users).filter(Users.role=='admin'))).scalars().first()
+            if existing_admin:
+                print('An admin already exists')
+                return
+            phone_number=process_phone_number(FIRST_ADMIN_PHONE_NUMBER, FIRST_ADMIN_PHONE_NUMBER_REGION)
+            password_hashed=await get_password_hash(FIRST_ADMIN_PASSWORD)
+            first_admin=Users(username='first_admin', email=FIRST_ADMIN_EMAIL, hashed_password=password_hashed,name='first_admin',lastname='first_admin',disabled=False, verified=True,role='admin',stripe_id='No id', phone_number=phone_number)
+            session.add(first_admin)
+            await session.commit()
+            print('The first admin was created')
+    finally:
+        password_hasher.shutdown()
+        await engine.dispose()
+
+if __name__=='__main__':
+    parser=argparse.ArgumentParser(description='Database management commands')
+    subparsers=parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('migrate', help='upgrade the database to the latest migration')
+    sql_parser=subparsers.add_parser('sql', help='print the migration SQL without connecting to the database')
+    sql_parser.add_argument('revision_range', nargs='?', default='head', help='head, or from:to such as 0000:head')
+    subparsers.add_parser('current', help='print the schema version of the database')
+    subparsers.add_parser('init-admin', help='create the first admin if there is no admin yet')
+    args=parser.parse_args()
+    if args.command=='migrate':
+        migrate()
+    elif args.command=='sql':
+        sql(args.revision_range)
+    elif args.command=='current':
+        current()
+    elif args.command=='init-admin':
+        asyncio.run(init_admin())
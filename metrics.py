@@ -0,0 +1,182 @@
+import logging
+import time
+from contextvars import ContextVar
+from sqlalchemy import event
+from database import engine, replica_engine, pool_stats
+from config import METRICS_SERVER_TIMING, METRICS_SQL_WARN_STATEMENTS
+
+logger=logging.getLogger(__name__)
+
+#REQUEST METRICS
+#RequestMetricsMiddleware (pure ASGI) times every request and, through before/after_cursor_execute hooks on the
+#engines, counts the SQL statements it runs and the time spent in them. Per route template it keeps latency, DB time
+#and statement count histograms, rendered in the Prometheus text format by /metrics together with the pool gauges.
+#a request over METRICS_SQL_WARN_STATEMENTS statements logs a warning, it is usually an N+1 query. With
+#METRICS_SERVER_TIMING the response carries a Server-Timing header (app and db time, statement count).
+#metrics are kept per worker process, like the pool stats.
+
+LATENCY_BUCKETS=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+STATEMENT_BUCKETS=(0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+class RequestStats:
+    __slots__=('sql_statements', 'sql_seconds')
+
+    def __init__(self):
+        self.sql_statements=0
+        self.sql_seconds=0.0
+
+request_stats:ContextVar[RequestStats|None]=ContextVar('request_stats', default=None)
+
+def escape_label(value:str):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def render_labels(label_names, label_values, extra:str=''):
+    labels=[f'{name}="{escape_label(str(value))}"' for name, value in zip(label_names, label_values)]
+    if extra:
+        labels.append(extra)
+    return '{'+','.join(labels)+'}' if labels else ''
+
+class Counter:
+    def __init__(self, name:str, description:str, label_names:tuple):
+        self.name=name
+        self.description=description
+        self.label_names=label_names
+        self.values={}
+
+    def inc(self, label_values:tuple, amount:float=1):
+        self.values[label_values]=self.values.get(label_values, 0)+amount
+
+    def render(self):
+        lines=[f'# HELP {self.name} {self.description}', f'# TYPE {self.name} counter']
+        for label_values, value in sorted(self.values.items()):
+            lines.append(f'{self.name}{render_labels(self.label_names, label_values)} {value}')
+        return lines
+
+class Histogram:
+    def __init__(self, name:str, description:str, label_names:tuple, buckets:tuple):
+        self.name=name
+        self.description=description
+        self.label_names=label_names
+        self.buckets=buckets
+        #label values -> [count per bucket (not cumulative), sum, count]
+        self.values={}
+
+    def observe(self, label_values:tuple, value:float):
+        series=self.values.get(label_values)
+        if series is None:
+            series=self.values[label_values]=[[0]*len(self.buckets), 0.0, 0]
+        for index, bound in enumerate(self.buckets):
+            if value<=bound:
+                series[0][index]+=1
+                break
+        series[1]+=value
+        series[2]+=1
+
+    def render(self):
+        lines=[f'# HELP {self.name} {self.description}', f'# TYPE {self.name} histogram']
+        for label_values, (bucket_counts, total, count) in sorted(self.values.items()):
+            cumulative=0
+            for bound, bucket_count in zip(self.buckets, bucket_counts):
+                cumulative+=bucket_count
+                bucket_labels=render_labels(self.label_names, label_values, f'le="{bound}"')
+                lines.append(f'{self.name}_bucket{bucket_labels} {cumulative}')
+            bucket_labels=render_labels(self.label_names, label_values, 'le="+Inf"')
+            lines.append(f'{self.name}_bucket{bucket_labels} {count}')
+            lines.append(f'{self.name}_sum{render_labels(self.label_names, label_values)} {round(total, 6)}')
+            lines.append(f'{self.name}_count{render_labels(self.label_names, label_values)} {count}')
+        return lines
+
+ROUTE_LABELS=('method', 'route')
+
+http_requests=Counter('http_requests_total', 'HTTP requests by route template and status', ('method', 'route', 'status'))
+http_request_seconds=Histogram('http_request_duration_seconds', 'Time until the response was sent', ROUTE_LABELS, LATENCY_BUCKETS)
+http_request_db_seconds=Histogram('http_request_db_seconds', 'Time spent executing SQL per request', ROUTE_LABELS, LATENCY_BUCKETS)
+http_request_sql_statements=Histogram('http_request_sql_statements', 'SQL statements executed per request', ROUTE_LABELS, STATEMENT_BUCKETS)
+
+def before_cursor_execute(connection, cursor, statement, parameters, context, executemany):
+    if request_stats.get() is not None:
+        connection.info.setdefault('statement_started', []).append(time.perf_counter())
+
+def after_cursor_execute(connection, cursor, statement, parameters, context, executemany):
+    stats=request_stats.get()
+    started=connection.info.get('statement_started')
+    if stats is not None and started:
+        stats.sql_statements+=1
+        stats.sql_seconds+=time.perf_counter()-started.pop()
+
+def handle_error(exception_context):
+    #a failed statement never reaches after_cursor_execute
+    started=exception_context.connection.info.get('statement_started') if exception_context.connection is not None else None
+    if started:
+        started.pop()
+
+for database_engine in (engine, replica_engine):
+    if database_engine is not None:
+        event.listen(database_engine.sync_engine, 'before_cursor_execute', before_cursor_execute)
+        event.listen(database_engine.sync_engine, 'after_cursor_execute', after_cursor_execute)
+        event.listen(database_engine.sync_engine, 'handle_error', handle_error)
+
+#(metric, key in pool_stats(), type, help)
+POOL_METRICS=(
+    ('db_pool_size', 'size', 'gauge', 'Configured pool size'),
+    ('db_pool_checked_out', 'checked_out', 'gauge', 'Connections in use'),
+    ('db_pool_checked_in', 'checked_in', 'gauge', 'Idle connections in the pool'),
+    ('db_pool_overflow', 'overflow', 'gauge', 'Connections over pool_size'),
+    ('db_pool_checkouts_total', 'checkouts', 'counter', 'Connections handed out'),
+    ('db_pool_exhausted_total', 'exhausted', 'counter', 'Checkouts that found the pool exhausted'),
+    ('db_pool_timeouts_total', 'timeouts', 'counter', 'Checkouts that timed out'),
+    ('db_pool_wait_seconds_total', 'wait_seconds_total', 'counter', 'Time spent waiting for a connection'),
+)
+
+def render_pool_metrics():
+    pools={name:stats for name, stats in pool_stats().items() if stats is not None}
+    lines=[]
+    for name, key, metric_type, description in POOL_METRICS:
+        lines+=[f'# HELP {name} {description}', f'# TYPE {name} {metric_type}']
+        lines+=[f'{name}{{pool="{pool}"}} {stats[key]}' for pool, stats in pools.items()]
+    replica_lag=pools.get('replica', {}).get('lag_seconds')
+    if replica_lag is not None:
+        lines+=['# HELP db_replica_lag_seconds Replication lag of the read replica', '# TYPE db_replica_lag_seconds gauge', f'db_replica_lag_seconds {replica_lag}']
+    return lines
+
+def render_metrics():
+    lines=[]
+    for metric in (http_requests, http_request_seconds, http_request_db_seconds, http_request_sql_statements):
+        lines+=metric.render()
+    lines+=render_pool_metrics()
+    return '\n'.join(lines)+'\n'
+
+class RequestMetricsMiddleware:
+    def __init__(self, app):
+        self.app=app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type']!='http':
+            return await self.app(scope, receive, send)
+        started=time.perf_counter()
+        stats=RequestStats()
+        token=request_stats.set(stats)
+        status_code=500
+
+        async def send_with_timing(message):
+            nonlocal status_code
+            if message['type']=='http.response.start':
+                status_code=message['status']
+                if METRICS_SERVER_TIMING:
+                    app_ms=(time.perf_counter()-started)*1000
+                    server_timing=f'app;dur={app_ms:.1f}, db;dur={stats.sql_seconds*1000:.1f};desc="{stats.sql_statements} statements"'
+                    message['headers']=[*message.get('headers', []), (b'server-timing', server_timing.encode('latin-1'))]
+            await send(message)
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            request_stats.reset(token)
+            #the route template keeps the label set bounded, unmatched paths share one label
+            route=scope.get('route')
+            label_values=(scope['method'], route.path if route is not None else 'unmatched')
+            http_requests.inc((*label_values, status_code))
+            http_request_seconds.observe(label_values, time.perf_counter()-started)
+            http_request_db_seconds.observe(label_values, stats.sql_seconds)
+            http_request_sql_statements.observe(label_values, stats.sql_statements)
+            if stats.sql_statements>METRICS_SQL_WARN_STATEMENTS:
+                logger.warning('Request ran too many SQL statements', extra={'method':label_values[0], 'route':label_values[1], 'sql_statements':stats.sql_statements, 'db_seconds':round(stats.sql_seconds, 6)})
@@ -0,0 +1,116 @@
+import ast
+import importlib
+import pathlib
+import sys
+
+ROOT=pathlib.Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from database import Base
+
+#INDEX CHECK
+#python migrations/check_indexes.py exits with 1 when a query in routers/, services/ or dependencies/ filters a table
+#only on columns that no index, primary key or unique constraint of that table starts with.
+#the predicates of one .filter()/.where() call are checked together: Model.column ==, in_(), <, <=, >, >= and between()
+#can use a btree index, != and like/ilike cannot and are ignored. Only filters applied directly to select(), update()
+#delete() or exists() are checked, query=query.filter(...) refinements (the optional filters of the admin listings) narrow a
+#query that was already checked. A call with an argument that is not a plain predicate (a variable, or_(), exists())
+#is skipped. Columns in ALLOWED_UNINDEXED are never reported.
+
+SOURCE_DIRS=('routers', 'services', 'dependencies')
+FILTER_METHODS={'filter', 'where'}
+INDEXABLE_COMPARISONS=(ast.Eq, ast.Lt, ast.LtE, ast.Gt, ast.GtE, ast.In)
+INDEXABLE_METHODS={'in_', 'between', 'is_'}
+NON_INDEXABLE_COMPARISONS=(ast.NotEq, ast.NotIn, ast.IsNot)
+NON_INDEXABLE_METHODS={'like', 'ilike', 'notlike', 'notilike', 'contains', 'startswith', 'endswith', 'isnot', 'is_not', 'op'}
+STATEMENTS={'select', 'update', 'delete', 'exists'}
+
+#(model, column): reason
+ALLOWED_UNINDEXED={
+    ('Users', 'role'): 'only the startup admin check, a handful of rows match',
+}
+
+def load_tables():
+    for path in sorted((ROOT/'models').glob('*.py')):
+        importlib.import_module(f'models.{path.stem}')
+    return {mapper.class_.__name__:mapper.local_table for mapper in Base.registry.mappers}
+
+def leading_columns(table):
+    columns=set()
+    for index in table.indexes:
+        first=index.expressions[0]
+        if getattr(first, 'name', None):
+            columns.add(first.name)
+    for constraint in table.constraints:
+        constraint_columns=list(getattr(constraint, 'columns', []))
+        if constraint_columns and constraint.__class__.__name__ in ('PrimaryKeyConstraint', 'UniqueConstraint'):
+            columns.add(constraint_columns[0].name)
+    return columns
+
+def model_column(node, tables):
+    if isinstance(node, ast.Attribute) and isinstance(node.value, ast.Name) and node.value.id in tables:
+        return node.value.id, node.attr
+    return None
+
+class OpaquePredicate(Exception):
+    pass
+
+def predicates(node, tables):
+    #yields the (model, column) pairs of the indexable predicates of one filter argument, and_() is flattened
+    if isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id=='and_':
+        for arg in node.args:
+            yield from predicates(arg, tables)
+    elif isinstance(node, ast.Compare) and isinstance(node.ops[0], INDEXABLE_COMPARISONS):
+        for side in (node.left, node.comparators[0]):
+            pair=model_column(side, tables)
+            if pair:
+                yield pair
+    elif isinstance(node, ast.Compare) and isinstance(node.ops[0], NON_INDEXABLE_COMPARISONS):
+        return
+    elif isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute) and node.func.attr in INDEXABLE_METHODS:
+        pair=model_column(node.func.value, tables)
+        if pair:
+            yield pair
+    elif isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute) and node.func.attr in NON_INDEXABLE_METHODS:
+        return
+    else:
+        raise OpaquePredicate()
+
+def statement_root(node):
+    #select(...).options(...).filter(...) -> 'select', query.filter(...) -> None
+    while isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute):
+        node=node.func.value
+    if isinstance(node, ast.Call) and isinstance(node.func, ast.Name):
+        return node.func.id
+    return None
+
+def check(tables):
+    indexed={name:leading_columns(table) for name, table in tables.items()}
+    missing=[]
+    for directory in SOURCE_DIRS:
+        for path in sorted((ROOT/directory).glob('*.py')):
+            tree=ast.parse(path.read_text(), str(path))
+            for node in ast.walk(tree):
+                if not (isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute) and node.func.attr in FILTER_METHODS):
+                    continue
+                if statement_root(node.func.value) not in STATEMENTS:
+                    continue
+                columns_by_model={}
+                try:
+                    for arg in node.args:
+                        for model, column in predicates(arg, tables):
+                            columns_by_model.setdefault(model, set()).add(column)
+                except OpaquePredicate:
+                    continue
+                for model, columns in columns_by_model.items():
+                    columns={column for column in columns if (model, column) not in ALLOWED_UNINDEXED}
+                    if columns and not columns&indexed[model]:
+                        missing.append(f'{path.relative_to(ROOT)}:{node.lineno}: {tables[model].name} filtered on {", ".join(sorted(columns))} without a supporting index')
+    return missing
+
+if __name__=='__main__':
+    missing=check(load_tables())
+    for line in missing:
+        print(line)
+    print(f'{len(missing)} unindexed filters' if missing else 'Every filter has a supporting index')
+    sys.exit(1 if missing else 0)
@@ -0,0 +1,49 @@
+import asyncio
+import importlib
+import pathlib
+from logging.config import fileConfig
+from alembic import context
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import NullPool
+from config import URL_DATABASE
+from database import Base, UTCDateTime, async_database_url, database_connect_args
+
+#MIGRATIONS ENVIRONMENT
+#every module in models/ is imported so Base.metadata holds the whole schema for autogenerate.
+#online: runs on an async connection (asyncpg, aiosqlite for local runs). Offline (alembic upgrade head --sql, python manage.py sql): prints the SQL.
+
+if context.config.config_file_name is not None:
+    fileConfig(context.config.config_file_name)
+
+for path in sorted((pathlib.Path(__file__).resolve().parent.parent/'models').glob('*.py')):
+    importlib.import_module(f'models.{path.stem}')
+
+target_metadata=Base.metadata
+
+def render_item(type_, obj, autogen_context):
+    #UTCDateTime only converts values in python, the column is a plain DateTime
+    if type_=='type' and isinstance(obj, UTCDateTime):
+        return 'sa.DateTime()'
+    return False
+
+def run_migrations_offline():
+    context.configure(url=async_database_url(URL_DATABASE), target_metadata=target_metadata, literal_binds=True, render_item=render_item, dialect_opts={'paramstyle':'named'})
+    with context.begin_transaction():
+        context.run_migrations()
+
+def run_migrations(connection):
+    context.configure(connection=connection, target_metadata=target_metadata, compare_type=True, render_item=render_item)
+    with context.begin_transaction():
+        context.run_migrations()
+
+async def run_async_migrations():
+    database_url=async_database_url(URL_DATABASE)
+    engine=create_async_engine(database_url, poolclass=NullPool, connect_args=database_connect_args(database_url))
+    async with engine.connect() as connection:
+        await connection.run_sync(run_migrations)
+    await engine.dispose()
+
+if context.is_offline_mode():
+    run_migrations_offline()
+else:
+    asyncio.run(run_async_migrations())
@@ -0,0 +1,35 @@
+import logging
+import pathlib
+from alembic.config import Config
+from alembic.runtime.migration import MigrationContext
+from alembic.script import ScriptDirectory
+
+logger=logging.getLogger(__name__)
+
+ROOT=pathlib.Path(__file__).resolve().parent.parent
+
+#SCHEMA VERSION
+#the app does not create or alter tables at startup, python manage.py migrate does it once per deploy.
+#check_schema_version only reads alembic_version: a database without a version or behind the migrations of this
+#release stops the startup, a database ahead of them (a newer release migrated it first during a rolling deploy)
+#only logs a warning, migrations are expected to stay compatible with the previous release.
+
+def alembic_config():
+    return Config(str(ROOT/'alembic.ini'))
+
+def current_revision(connection):
+    return MigrationContext.configure(connection).get_current_revision()
+
+async def check_schema_version(engine):
+    async with engine.connect() as connection:
+        revision=await connection.run_sync(current_revision)
+    script=ScriptDirectory.from_config(alembic_config())
+    head=script.get_current_head()
+    if revision==head:
+        return revision
+    if revision is None:
+        raise RuntimeError('The database has no schema version, run python manage.py migrate')
+    if revision not in {known.revision for known in script.walk_revisions()}:
+        logger.warning('The database schema (%s) is newer than this release (%s)', revision, head)
+        return revision
+    raise RuntimeError(f'The database schema is at {revision} and this release needs {head}, run python manage.py migrate')
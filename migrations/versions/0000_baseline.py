@@ -0,0 +1,285 @@
+"""baseline: the schema create_all built before migrations
+
+Revision ID: 0000
+Revises: 
+Create Date: 2026-10-18 13:00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = '0000'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+#databases created by create_all before migrations existed are stamped at this revision by manage.py migrate, so it
+#must hold exactly that schema. Objects added later go in their own revisions and are created IF NOT EXISTS
+
+ENUMS=['checkoutstatus', 'emailtype', 'emailstatus', 'notificationtype', 'productstatus', 'orderstatus', 'paymentmethod', 'paymentstatus', 'refundstatus']
+
+
+def upgrade():
+    op.create_table('categories',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('title', sa.String(length=50), nullable=False),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('title')
+    )
+    op.create_index(op.f('ix_categories_id'), 'categories', ['id'], unique=False)
+    op.create_table('users',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('username', sa.String(length=50), nullable=False),
+    sa.Column('hashed_password', sa.String(length=200), nullable=False),
+    sa.Column('email', sa.String(length=100), nullable=False),
+    sa.Column('name', sa.String(length=50), nullable=False),
+    sa.Column('lastname', sa.String(length=50), nullable=False),
+    sa.Column('disabled', sa.Boolean(), nullable=False),
+    sa.Column('verified', sa.Boolean(), nullable=False),
+    sa.Column('role', sa.String(length=20), nullable=False),
+    sa.Column('stripe_id', sa.String(length=200), nullable=False),
+    sa.Column('phone_number', sa.String(length=30), nullable=False),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('email'),
+    sa.UniqueConstraint('username')
+    )
+    op.create_index(op.f('ix_users_id'), 'users', ['id'], unique=False)
+    op.create_table('checkoutsessions',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('expires_at', sa.DateTime(), nullable=True),
+    sa.Column('status', sa.Enum('expired', 'active', 'cancelled', name='checkoutstatus'), nullable=False),
+    sa.Column('session_id', sa.String(length=200), nullable=False),
+    sa.Column('session_url', sa.Text(), nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_checkoutsessions_id'), 'checkoutsessions', ['id'], unique=False)
+    op.create_table('emails',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('type', sa.Enum('transactional', 'promotional', 'account', 'feedback', 'system', name='emailtype'), nullable=False),
+    sa.Column('status', sa.Enum('pending', 'sent', 'failed', 'unsubscribed', name='emailstatus'), nullable=False),
+    sa.Column('created_at', sa.DateTime(), server_default=sa.func.now(), nullable=True),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_emails_id'), 'emails', ['id'], unique=False)
+    op.create_table('notifications',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('message', sa.Text(), nullable=False),
+    sa.Column('type', sa.Enum('order_confirmation', 'shipping_update', 'payment_received', 'promotion', 'account_alert', 'review_request', 'cart_reminder', name='notificationtype'), nullable=False),
+    sa.Column('created_at', sa.DateTime(), server_default=sa.func.now(), nullable=True),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_notifications_id'), 'notifications', ['id'], unique=False)
+    op.create_table('products',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('title', sa.String(length=200), nullable=False),
+    sa.Column('description', sa.Text(), nullable=False),
+    sa.Column('price', sa.Numeric(precision=10, scale=2), nullable=False),
+    sa.Column('stock', sa.Integer(), nullable=False),
+    sa.Column('category_id', sa.Integer(), nullable=False),
+    sa.Column('discount_percentage', sa.Numeric(precision=10, scale=2), nullable=False),
+    sa.Column('created_at', sa.DateTime(), server_default=sa.func.now(), nullable=True),
+    sa.Column('weight', sa.Float(), nullable=True),
+    sa.Column('height', sa.Float(), nullable=True),
+    sa.Column('length', sa.Float(), nullable=True),
+    sa.Column('width', sa.Float(), nullable=True),
+    sa.Column('status', sa.Enum('active', 'inactive', 'deleted', 'discontinued', name='productstatus'), nullable=False),
+    sa.Column('taxcode', sa.String(length=200), nullable=False),
+    sa.Column('reserve_stock', sa.Integer(), nullable=False),
+    sa.Column('available_stock', sa.Integer(), nullable=False),
+    sa.Column('average_stars', sa.Float(), nullable=True),
+    sa.Column('total_stars', sa.Integer(), nullable=True),
+    sa.CheckConstraint('discount_percentage >= 0', name='check_discount_percentage_positive'),
+    sa.CheckConstraint('price >= 0', name='check_price_positive'),
+    sa.CheckConstraint('reserve_stock >= 0', name='check_reserve_stock_positive'),
+    sa.ForeignKeyConstraint(['category_id'], ['categories.id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('title')
+    )
+    op.create_index(op.f('ix_products_id'), 'products', ['id'], unique=False)
+    op.create_table('shipping_addresses',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('address_line1', sa.String(length=200), nullable=False),
+    sa.Column('address_line2', sa.String(length=200), nullable=True),
+    sa.Column('city', sa.String(length=50), nullable=False),
+    sa.Column('state', sa.String(length=50), nullable=False),
+    sa.Column('country', sa.String(length=50), nullable=False),
+    sa.Column('zip_code', sa.String(length=50), nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_shipping_addresses_id'), 'shipping_addresses', ['id'], unique=False)
+    op.create_table('cart',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('product_id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('units', sa.Integer(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), server_default=sa.func.now(), nullable=True),
+    sa.ForeignKeyConstraint(['product_id'], ['products.id'], ),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_cart_id'), 'cart', ['id'], unique=False)
+    op.create_table('cartsnapshoots',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('product_id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('units', sa.Integer(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), server_default=sa.func.now(), nullable=True),
+    sa.Column('checkout_session_id', sa.Integer(), nullable=False),
+    sa.Column('price_at_purchase', sa.Numeric(precision=10, scale=2), nullable=False),
+    sa.ForeignKeyConstraint(['checkout_session_id'], ['checkoutsessions.id'], ),
+    sa.ForeignKeyConstraint(['product_id'], ['products.id'], ),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_cartsnapshoots_id'), 'cartsnapshoots', ['id'], unique=False)
+    op.create_table('orders',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('total_amount', sa.Numeric(precision=10, scale=2), nullable=False),
+    sa.Column('created_at', sa.DateTime(), server_default=sa.func.now(), nullable=True),
+    sa.Column('status', sa.Enum('pending', 'paid', 'processing', 'shipped', 'delivered', 'cancelled', 'failed', 'refunded', 'returned', name='orderstatus'), nullable=False),
+    sa.Column('shipping_addresses_id', sa.Integer(), nullable=False),
+    sa.Column('oversold', sa.Boolean(), nullable=False),
+    sa.Column('checkout_session_id', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['checkout_session_id'], ['checkoutsessions.id'], ),
+    sa.ForeignKeyConstraint(['shipping_addresses_id'], ['shipping_addresses.id'], ),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_orders_id'), 'orders', ['id'], unique=False)
+    op.create_index(op.f('ix_orders_status'), 'orders', ['status'], unique=False)
+    op.create_table('product_images',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('product_id', sa.Integer(), nullable=False),
+    sa.Column('image_url', sa.Text(), nullable=False),
+    sa.Column('is_main', sa.Boolean(), nullable=False),
+    sa.ForeignKeyConstraint(['product_id'], ['products.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_product_images_id'), 'product_images', ['id'], unique=False)
+    op.create_table('reservations',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('product_id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('units', sa.Integer(), nullable=False),
+    sa.Column('expires_at', sa.DateTime(), nullable=True),
+    sa.Column('status', sa.String(length=200), nullable=True),
+    sa.Column('checkout_session_id', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['checkout_session_id'], ['checkoutsessions.id'], ),
+    sa.ForeignKeyConstraint(['product_id'], ['products.id'], ),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_reservations_id'), 'reservations', ['id'], unique=False)
+    op.create_table('reviews',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('product_id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('review_text', sa.Text(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), server_default=sa.func.now(), nullable=True),
+    sa.Column('edited', sa.Boolean(), nullable=False),
+    sa.ForeignKeyConstraint(['product_id'], ['products.id'], ),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_reviews_id'), 'reviews', ['id'], unique=False)
+    op.create_table('stars',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('product_id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('stars_number', sa.Integer(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), server_default=sa.func.now(), nullable=True),
+    sa.CheckConstraint('stars_number <= 5', name='check_stars_less_than_or_equal_to_5'),
+    sa.CheckConstraint('stars_number >= 0', name='check_stars_greater_than_or_equal_to_0'),
+    sa.ForeignKeyConstraint(['product_id'], ['products.id'], ),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_stars_id'), 'stars', ['id'], unique=False)
+    op.create_table('wishlist',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('product_id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), server_default=sa.func.now(), nullable=True),
+    sa.ForeignKeyConstraint(['product_id'], ['products.id'], ),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_wishlist_id'), 'wishlist', ['id'], unique=False)
+    op.create_table('order_items',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('order_id', sa.Integer(), nullable=False),
+    sa.Column('product_id', sa.Integer(), nullable=False),
+    sa.Column('units', sa.Integer(), nullable=False),
+    sa.Column('price_at_purchase', sa.Numeric(precision=10, scale=2), nullable=False),
+    sa.ForeignKeyConstraint(['order_id'], ['orders.id'], ),
+    sa.ForeignKeyConstraint(['product_id'], ['products.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_order_items_id'), 'order_items', ['id'], unique=False)
+    op.create_table('payments',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('order_id', sa.Integer(), nullable=True),
+    sa.Column('user_id', sa.Integer(), nullable=True),
+    sa.Column('payment_method', sa.Enum('paypal', 'stripe', 'bank_transfer', name='paymentmethod'), nullable=True),
+    sa.Column('status', sa.Enum('pending', 'paid', 'failed', 'refunded', 'cancelled', name='paymentstatus'), nullable=True),
+    sa.Column('created_at', sa.DateTime(), server_default=sa.func.now(), nullable=True),
+    sa.Column('stripe_session_id', sa.String(length=200), nullable=True),
+    sa.Column('stripe_customer_id', sa.String(length=200), nullable=True),
+    sa.Column('currency', sa.String(length=200), nullable=True),
+    sa.Column('tax_details', sa.Numeric(precision=10, scale=2), nullable=True),
+    sa.Column('payment_intent_id', sa.String(length=200), nullable=True),
+    sa.Column('charge_id', sa.String(length=200), nullable=True),
+    sa.Column('receipt_url', sa.Text(), nullable=True),
+    sa.ForeignKeyConstraint(['order_id'], ['orders.id'], ),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_payments_id'), 'payments', ['id'], unique=False)
+    op.create_table('refunds',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('payment_intent_id', sa.Text(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), server_default=sa.func.now(), nullable=True),
+    sa.Column('checkout_session_id', sa.Integer(), nullable=False),
+    sa.Column('status', sa.Enum('pending', 'pending_accidental', 'cancelled', 'failed', 'refunded', 'returned', name='refundstatus'), nullable=False),
+    sa.Column('order_id', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['checkout_session_id'], ['checkoutsessions.id'], ),
+    sa.ForeignKeyConstraint(['order_id'], ['orders.id'], ),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_refunds_id'), 'refunds', ['id'], unique=False)
+
+
+def downgrade():
+    op.drop_table('refunds')
+    op.drop_table('payments')
+    op.drop_table('order_items')
+    op.drop_table('wishlist')
+    op.drop_table('stars')
+    op.drop_table('reviews')
+    op.drop_table('reservations')
+    op.drop_table('product_images')
+    op.drop_table('orders')
+    op.drop_table('cartsnapshoots')
+    op.drop_table('cart')
+    op.drop_table('shipping_addresses')
+    op.drop_table('products')
+    op.drop_table('notifications')
+    op.drop_table('emails')
+    op.drop_table('checkoutsessions')
+    op.drop_table('users')
+    op.drop_table('categories')
+    if op.get_context().dialect.name=='postgresql':
+        for name in ENUMS:
+            op.execute(f'DROP TYPE IF EXISTS {name}')
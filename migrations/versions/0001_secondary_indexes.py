@@ -0,0 +1,52 @@
+"""secondary and composite indexes for the hot filters
+
+Revision ID: 0001
+Revises: 0000
+Create Date: 2026-10-18 12:00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = '0001'
+down_revision = '0000'
+branch_labels = None
+depends_on = None
+
+#(name, table, columns, partial index predicate), the same indexes are declared in models/
+INDEXES=[
+    ('ix_cart_user_id_product_id', 'cart', ['user_id', 'product_id'], None),
+    ('ix_cartsnapshoots_user_id_checkout_session_id', 'cartsnapshoots', ['user_id', 'checkout_session_id'], None),
+    ('ix_reservations_user_id_checkout_session_id_product_id', 'reservations', ['user_id', 'checkout_session_id', 'product_id'], None),
+    ('ix_reservations_checkout_session_id', 'reservations', ['checkout_session_id'], None),
+    ('ix_reservations_pending_expires_at', 'reservations', ['expires_at'], "status = 'pending'"),
+    ('ix_wishlist_user_id_product_id', 'wishlist', ['user_id', 'product_id'], None),
+    ('ix_reviews_product_id_user_id', 'reviews', ['product_id', 'user_id'], None),
+    ('ix_stars_product_id_user_id', 'stars', ['product_id', 'user_id'], None),
+    ('ix_checkoutsessions_session_id', 'checkoutsessions', ['session_id'], None),
+    ('ix_checkoutsessions_user_id', 'checkoutsessions', ['user_id'], None),
+    ('ix_checkoutsessions_active_expires_at', 'checkoutsessions', ['expires_at'], "status = 'active'"),
+    ('ix_payments_payment_intent_id', 'payments', ['payment_intent_id'], None),
+    ('ix_users_stripe_id', 'users', ['stripe_id'], None),
+    ('ix_orders_checkout_session_id', 'orders', ['checkout_session_id'], None),
+    ('ix_orders_user_id_status', 'orders', ['user_id', 'status'], None),
+    ('ix_order_items_order_id_product_id', 'order_items', ['order_id', 'product_id'], None),
+    ('ix_product_images_product_id', 'product_images', ['product_id'], None),
+    ('ix_products_category_id', 'products', ['category_id'], None),
+    ('ix_products_created_at_not_deleted', 'products', ['created_at', 'id'], "status != 'deleted'"),
+]
+
+
+def upgrade():
+    #CONCURRENTLY builds without blocking writes but cannot run inside a transaction. IF NOT EXISTS skips the
+    #indexes create_all already made. A failed concurrent build leaves an INVALID index, drop it before retrying
+    with op.get_context().autocommit_block():
+        for name, table, columns, where in INDEXES:
+            op.create_index(name, table, columns, if_not_exists=True, postgresql_concurrently=True, postgresql_where=sa.text(where) if where else None, sqlite_where=sa.text(where) if where else None)
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        for name, table, columns, where in reversed(INDEXES):
+            op.drop_index(name, table_name=table, if_exists=True, postgresql_concurrently=True)
@@ -0,0 +1,33 @@
+"""full-text search index on products
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18 14:00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = '0002'
+down_revision = '0001'
+branch_labels = None
+depends_on = None
+
+#must match models.products.search_document, the expression the search queries filter and rank on
+SEARCH_DOCUMENT="(setweight(to_tsvector('simple', title), 'A') || setweight(to_tsvector('simple', description), 'B'))"
+
+
+def upgrade():
+    #expression index, only on postgres like the model's ddl_if
+    if op.get_context().dialect.name!='postgresql':
+        return
+    with op.get_context().autocommit_block():
+        op.create_index('ix_products_search_document', 'products', [sa.text(SEARCH_DOCUMENT)], if_not_exists=True, postgresql_using='gin', postgresql_concurrently=True)
+
+
+def downgrade():
+    if op.get_context().dialect.name!='postgresql':
+        return
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_products_search_document', table_name='products', if_exists=True, postgresql_concurrently=True)
@@ -0,0 +1,66 @@
+"""webhook_events and processed_stripe_events
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-18 15:00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+revision = '0003'
+down_revision = '0002'
+branch_labels = None
+depends_on = None
+
+#IF NOT EXISTS, databases created from an earlier baseline already have these tables
+WEBHOOK_EVENT_STATUSES=('pending', 'processing', 'processed', 'dead')
+
+
+def upgrade():
+    if op.get_context().dialect.name=='postgresql':
+        statuses=', '.join(f"'{value}'" for value in WEBHOOK_EVENT_STATUSES)
+        op.execute(f"DO $$ BEGIN CREATE TYPE webhookeventstatus AS ENUM ({statuses}); EXCEPTION WHEN duplicate_object THEN NULL; END $$")
+        status_type=postgresql.ENUM(*WEBHOOK_EVENT_STATUSES, name='webhookeventstatus', create_type=False)
+    else:
+        status_type=sa.Enum(*WEBHOOK_EVENT_STATUSES, name='webhookeventstatus')
+    op.create_table('processed_stripe_events',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('event_id', sa.String(length=255), nullable=False),
+    sa.Column('event_type', sa.String(length=200), nullable=False),
+    sa.Column('processed_at', sa.DateTime(), server_default=sa.func.now(), nullable=True),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('event_id'),
+    if_not_exists=True
+    )
+    op.create_index(op.f('ix_processed_stripe_events_id'), 'processed_stripe_events', ['id'], unique=False, if_not_exists=True)
+    op.create_table('webhook_events',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('event_id', sa.String(length=255), nullable=False),
+    sa.Column('event_type', sa.String(length=200), nullable=False),
+    sa.Column('ordering_key', sa.String(length=255), nullable=False),
+    sa.Column('event_created_at', sa.DateTime(), nullable=False),
+    sa.Column('payload', sa.JSON(), nullable=False),
+    sa.Column('status', status_type, nullable=False),
+    sa.Column('attempts', sa.Integer(), nullable=False),
+    sa.Column('next_attempt_at', sa.DateTime(), server_default=sa.func.now(), nullable=False),
+    sa.Column('locked_until', sa.DateTime(), nullable=True),
+    sa.Column('last_error', sa.Text(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), server_default=sa.func.now(), nullable=True),
+    sa.Column('processed_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('event_id'),
+    if_not_exists=True
+    )
+    op.create_index(op.f('ix_webhook_events_id'), 'webhook_events', ['id'], unique=False, if_not_exists=True)
+    op.create_index('ix_webhook_events_ordering_key_status', 'webhook_events', ['ordering_key', 'status'], unique=False, if_not_exists=True)
+    op.create_index('ix_webhook_events_status_next_attempt_at', 'webhook_events', ['status', 'next_attempt_at'], unique=False, if_not_exists=True)
+
+
+def downgrade():
+    op.drop_table('webhook_events')
+    op.drop_table('processed_stripe_events')
+    if op.get_context().dialect.name=='postgresql':
+        op.execute('DROP TYPE IF EXISTS webhookeventstatus')
@@ -0,0 +1,30 @@
+"""(column, id) indexes for the keyset pages of the product sort options
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-18 16:00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = '0004'
+down_revision = '0003'
+branch_labels = None
+depends_on = None
+
+#the same indexes are declared in models/products.py (SORT_INDEX_COLUMNS)
+COLUMNS=['price', 'discount_percentage', 'weight', 'height', 'length', 'width', 'average_stars', 'total_stars']
+
+
+def upgrade():
+    with op.get_context().autocommit_block():
+        for column in COLUMNS:
+            op.create_index(f'ix_products_{column}_id', 'products', [column, 'id'], if_not_exists=True, postgresql_concurrently=True)
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        for column in reversed(COLUMNS):
+            op.drop_index(f'ix_products_{column}_id', table_name='products', if_exists=True, postgresql_concurrently=True)
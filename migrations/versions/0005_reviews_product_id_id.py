@@ -0,0 +1,25 @@
+"""index for the paginated product reviews
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-18 17:00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = '0005'
+down_revision = '0004'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.get_context().autocommit_block():
+        op.create_index('ix_reviews_product_id_id', 'reviews', ['product_id', 'id'], if_not_exists=True, postgresql_concurrently=True)
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_reviews_product_id_id', table_name='reviews', if_exists=True, postgresql_concurrently=True)
@@ -0,0 +1,38 @@
+"""product_rating_stats, rating aggregates kept out of the products row
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-18 18:00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = '0006'
+down_revision = '0005'
+branch_labels = None
+depends_on = None
+
+HISTOGRAM=['stars_0', 'stars_1', 'stars_2', 'stars_3', 'stars_4', 'stars_5']
+
+
+def upgrade():
+    op.create_table('product_rating_stats',
+    sa.Column('product_id', sa.Integer(), nullable=False),
+    sa.Column('ratings_count', sa.Integer(), nullable=False),
+    sa.Column('ratings_sum', sa.Integer(), nullable=False),
+    *[sa.Column(name, sa.Integer(), nullable=False) for name in HISTOGRAM],
+    sa.Column('updated_at', sa.DateTime(), server_default=sa.func.now(), nullable=True),
+    sa.ForeignKeyConstraint(['product_id'], ['products.id'], ),
+    sa.PrimaryKeyConstraint('product_id')
+    )
+    histogram=', '.join(f'sum(case when stars_number = {number} then 1 else 0 end)' for number in range(len(HISTOGRAM)))
+    op.execute(f"INSERT INTO product_rating_stats (product_id, ratings_count, ratings_sum, {', '.join(HISTOGRAM)}) "
+               f"SELECT product_id, count(*), sum(stars_number), {histogram} FROM stars GROUP BY product_id")
+    #products without ratings had NULL averages that rate_stars could not add to
+    op.execute("UPDATE products SET average_stars = 0, total_stars = 0 WHERE average_stars IS NULL OR total_stars IS NULL")
+
+
+def downgrade():
+    op.drop_table('product_rating_stats')
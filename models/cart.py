@@ -1,6 +1,6 @@
-from sqlalchemy import Boolean, Column, Integer, String, DateTime, Text, Float, ForeignKey, Numeric, Enum
+from sqlalchemy import Boolean, Column, Integer, String, DateTime, Text, Float, ForeignKey, Numeric, Enum, Index
 from sqlalchemy.sql import func
-from database import Base
+from database import Base, UTCDateTime
 from sqlalchemy.orm import relationship
 from enum import Enum as PyEnum
 
@@ -13,7 +13,13 @@ class Cart(Base):
     product_id=Column(Integer,ForeignKey('products.id'),nullable=False)
     user_id=Column(Integer,ForeignKey('users.id'),nullable=False)
     units=Column(Integer, nullable=False)
-    created_at=Column(DateTime,server_default=func.now())
+    created_at=Column(UTCDateTime,server_default=func.now())
+    
+    product=relationship('Products')
+    
+    __table_args__ = (
+        Index('ix_cart_user_id_product_id', 'user_id', 'product_id'),
+    )
     
 class CartSnapshoots(Base):
     __tablename__='cartsnapshoots'
@@ -22,7 +28,11 @@ class CartSnapshoots(Base):
     product_id=Column(Integer,ForeignKey('products.id'),nullable=False)
     user_id=Column(Integer,ForeignKey('users.id'),nullable=False)
     units=Column(Integer, nullable=False)
-    created_at=Column(DateTime,server_default=func.now())
+    created_at=Column(UTCDateTime,server_default=func.now())
     checkout_session_id=Column(Integer,ForeignKey('checkoutsessions.id'),nullable=False)
     price_at_purchase=Column(Numeric(10,2), nullable=False)
+    
+    __table_args__ = (
+        Index('ix_cartsnapshoots_user_id_checkout_session_id', 'user_id', 'checkout_session_id'),
+    )
     
\ No newline at end of file
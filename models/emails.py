@@ -1,6 +1,6 @@
 from sqlalchemy import Boolean, Column, Integer, String, DateTime, Text, Float, ForeignKey, Numeric, Enum
 from sqlalchemy.sql import func
-from database import Base
+from database import Base, UTCDateTime
 from sqlalchemy.orm import relationship
 from enum import Enum as PyEnum
 
@@ -24,7 +24,7 @@ class Emails(Base):
     user_id=Column(Integer,ForeignKey('users.id'),nullable=False)
     type=Column(Enum(EmailType),nullable=False)
     status=Column(Enum(EmailStatus),default=EmailStatus.pending,nullable=False)
-    created_at=Column(DateTime,server_default=func.now())
+    created_at=Column(UTCDateTime,server_default=func.now())
 
     
     
@@ -1,6 +1,6 @@
 from sqlalchemy import Boolean, Column, Integer, String, DateTime, Text, Float, ForeignKey, Numeric, Enum
 from sqlalchemy.sql import func
-from database import Base
+from database import Base, UTCDateTime
 from sqlalchemy.orm import relationship
 from enum import Enum as PyEnum
 
@@ -20,6 +20,6 @@ class Notifications(Base):
     user_id=Column(Integer,ForeignKey('users.id'),nullable=False)
     message=Column(Text,nullable=False)
     type=Column(Enum(NotificationType),nullable=False)
-    created_at=Column(DateTime,server_default=func.now())
+    created_at=Column(UTCDateTime,server_default=func.now())
     
     
\ No newline at end of file
@@ -1,6 +1,6 @@
-from sqlalchemy import Boolean, Column, Integer, String, DateTime, Text, Float, ForeignKey, Numeric, Enum
+from sqlalchemy import Boolean, Column, Integer, String, DateTime, Text, Float, ForeignKey, Numeric, Enum, Index
 from sqlalchemy.sql import func
-from database import Base
+from database import Base, UTCDateTime
 from sqlalchemy.orm import relationship
 from enum import Enum as PyEnum
 
@@ -21,11 +21,15 @@ class Orders(Base):
     id=Column(Integer,primary_key=True,index=True)
     user_id=Column(Integer,ForeignKey('users.id'),nullable=False)
     total_amount=Column(Numeric(10,2),nullable=False)
-    created_at=Column(DateTime,server_default=func.now())
+    created_at=Column(UTCDateTime,server_default=func.now())
     status=Column(Enum(OrderStatus), default=OrderStatus.pending,index=True, nullable=False)
     shipping_addresses_id=Column(Integer,ForeignKey('shipping_addresses.id'),nullable=False)
     oversold=Column(Boolean, default=False, nullable=False)
-    checkout_session_id=Column(Integer,ForeignKey('checkoutsessions.id'),nullable=False)
+    checkout_session_id=Column(Integer,ForeignKey('checkoutsessions.id'),index=True,nullable=False)
+    
+    __table_args__ = (
+        Index('ix_orders_user_id_status', 'user_id', 'status'),
+    )
     
 class OrderItems(Base):
     __tablename__='order_items'
@@ -36,6 +40,10 @@ class OrderItems(Base):
     units=Column(Integer, nullable=False)
     price_at_purchase=Column(Numeric(10,2),nullable=False)
     
+    __table_args__ = (
+        Index('ix_order_items_order_id_product_id', 'order_id', 'product_id'),
+    )
+    
   
 
    
\ No newline at end of file
@@ -1,6 +1,6 @@
-from sqlalchemy import Boolean, Column, Integer, String, DateTime, Text, Float, ForeignKey, Numeric, Enum
+from sqlalchemy import Boolean, Column, Integer, String, DateTime, Text, Float, ForeignKey, Numeric, Enum, Index, text
 from sqlalchemy.sql import func
-from database import Base
+from database import Base, UTCDateTime
 from sqlalchemy.orm import relationship
 from enum import Enum as PyEnum
 
@@ -24,12 +24,12 @@ class Payments(Base):
     user_id=Column(Integer,ForeignKey('users.id'),nullable=True)
     payment_method=Column(Enum(PaymentMethod),nullable=True)
     status=Column(Enum(PaymentStatus),nullable=True)
-    created_at=Column(DateTime,server_default=func.now())
+    created_at=Column(UTCDateTime,server_default=func.now())
     stripe_session_id=Column(String(200),nullable=True)
     stripe_customer_id=Column(String(200),nullable=True)
     currency=Column(String(200),nullable=True)
     tax_details=Column(Numeric(10,2),nullable=True)
-    payment_intent_id=Column(String(200),nullable=True)
+    payment_intent_id=Column(String(200),index=True,nullable=True)
     charge_id=Column(String(200),nullable=True)
     receipt_url=Column(Text,nullable=True)
 
@@ -42,8 +42,13 @@ class CheckOutSessions(Base):
     __tablename__='checkoutsessions'
     
     id=Column(Integer, primary_key=True, index=True)
-    user_id=Column(Integer,ForeignKey('users.id'),nullable=False)
-    expires_at=Column(DateTime)
+    user_id=Column(Integer,ForeignKey('users.id'),index=True,nullable=False)
+    expires_at=Column(UTCDateTime)
     status=Column(Enum(CheckoutStatus), nullable=False)
-    session_id=Column(String(200),nullable=False)
-    session_url=Column(Text,nullable=False)
\ No newline at end of file
+    session_id=Column(String(200),index=True,nullable=False)
+    session_url=Column(Text,nullable=False)
+    
+    __table_args__ = (
+        #the reaper's scan, queries must compare status with a literal 'active' for the planner to use it
+        Index('ix_checkoutsessions_active_expires_at', 'expires_at', postgresql_where=text("status = 'active'"), sqlite_where=text("status = 'active'")),
+    )
@@ -1,8 +1,10 @@
-from sqlalchemy import Boolean, Column, Integer, String, DateTime, Text, Float, ForeignKey, Numeric, Enum, CheckConstraint
+from sqlalchemy import Boolean, Column, Integer, String, DateTime, Text, Float, ForeignKey, Numeric, Enum, CheckConstraint, Index, literal_column, text
 from sqlalchemy.sql import func
-from database import Base
+from database import Base, UTCDateTime
 from sqlalchemy.orm import relationship
 from enum import Enum as PyEnum
+#registers Categories for the category relationship in processes that never import it (the standalone services)
+import models.categories
 
 class ProductStatus(str,PyEnum):
     active='active'
@@ -10,6 +12,15 @@ class ProductStatus(str,PyEnum):
     deleted='deleted'
     discontinued='discontinued'
  
+def search_document(title, description):
+    #weighted tsvector over title (A) and description (B). The GIN index and the search queries must build exactly this expression
+    simple=literal_column("'simple'")
+    return func.setweight(func.to_tsvector(simple, title), literal_column("'A'")).op('||')(func.setweight(func.to_tsvector(simple, description), literal_column("'B'")))
+ 
+#the sort options of the listings with a (column, id) index. stock is left out on purpose, every reservation and checkout
+#updates it and an index on it would keep those updates from being HOT, its sorts (admin only) read the whole table
+SORT_INDEX_COLUMNS=('price', 'discount_percentage', 'weight', 'height', 'length', 'width', 'average_stars', 'total_stars')
+
 class Products(Base):
     __tablename__='products'
     
@@ -18,9 +29,9 @@ class Products(Base):
     description=Column(Text, nullable=False)
     price=Column(Numeric(10,2), nullable=False)
     stock=Column(Integer, nullable=False)
-    category_id=Column(Integer,ForeignKey('categories.id'), nullable=False)
+    category_id=Column(Integer,ForeignKey('categories.id'),index=True, nullable=False)
     discount_percentage=Column(Numeric(10,2),nullable=False)
-    created_at=Column(DateTime, server_default=func.now())
+    created_at=Column(UTCDateTime, server_default=func.now())
     weight=Column(Float,nullable=True)
     height=Column(Float,nullable=True)
     length=Column(Float,nullable=True)
@@ -32,19 +43,27 @@ class Products(Base):
     average_stars=Column(Float, nullable=True)
     total_stars=Column(Integer, nullable=True)
     
+    category=relationship('Categories')
+    images=relationship('product_images', order_by='product_images.id')
+    
     __table_args__ = (
         #CheckConstraint('stock >= 0', name='check_stock_positive'), because if there are oversold overs, it can exist
         CheckConstraint('reserve_stock >= 0', name='check_reserve_stock_positive'),
         #CheckConstraint('available_stock >= 0', name='check_available_stock_positive'),
         CheckConstraint('price >= 0', name='check_price_positive'),
         CheckConstraint('discount_percentage >= 0', name='check_discount_percentage_positive'),
+        Index('ix_products_search_document', search_document(title, description), postgresql_using='gin').ddl_if(dialect='postgresql'),
+        #the default listing (not deleted, newest first), queries must compare status with a literal 'deleted' for the planner to use it
+        Index('ix_products_created_at_not_deleted', 'created_at', 'id', postgresql_where=text("status != 'deleted'"), sqlite_where=text("status != 'deleted'")),
+        #(column, id) for the keyset pages of the other sort options
+        *[Index(f'ix_products_{column}_id', column, 'id') for column in SORT_INDEX_COLUMNS],
     )
     
 class product_images(Base):
     __tablename__='product_images'
     
     id=Column(Integer, primary_key=True, index=True)
-    product_id=Column(Integer, ForeignKey('products.id'), nullable=False)
+    product_id=Column(Integer, ForeignKey('products.id'), index=True, nullable=False)
     image_url=Column(Text,nullable=False)
     is_main=Column(Boolean,nullable=False,default=False)
     
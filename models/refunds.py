@@ -1,6 +1,6 @@
 from sqlalchemy import Boolean, Column, Integer, String, DateTime, Text, Float, ForeignKey, Numeric, Enum, CheckConstraint
 from sqlalchemy.sql import func
-from database import Base
+from database import Base, UTCDateTime
 from sqlalchemy.orm import relationship
 from enum import Enum as PyEnum
 
@@ -18,7 +18,7 @@ class Refunds(Base):
     id=Column(Integer,primary_key=True,index=True)
     user_id=Column(Integer,ForeignKey('users.id'),nullable=False)
     payment_intent_id=Column(Text, nullable=False)
-    created_at=Column(DateTime,server_default=func.now())
+    created_at=Column(UTCDateTime,server_default=func.now())
     checkout_session_id=Column(Integer,ForeignKey('checkoutsessions.id'),nullable=False)
     status=Column(Enum(RefundStatus), default=RefundStatus.pending_accidental, nullable=False)
     order_id=Column(Integer,ForeignKey('orders.id'),nullable=False)
\ No newline at end of file
@@ -1,6 +1,6 @@
-from sqlalchemy import Boolean, Column, Integer, String, DateTime, Text, Float, ForeignKey, Numeric, Enum, CheckConstraint
+from sqlalchemy import Boolean, Column, Integer, String, DateTime, Text, Float, ForeignKey, Numeric, Enum, CheckConstraint, Index, text
 from sqlalchemy.sql import func
-from database import Base
+from database import Base, UTCDateTime
 from datetime import datetime
 
 class Reservations(Base):
@@ -10,6 +10,12 @@ class Reservations(Base):
     product_id=Column(Integer, ForeignKey('products.id'), nullable=False)
     user_id=Column(Integer, ForeignKey('users.id'), nullable=False)
     units=Column(Integer,nullable=False)
-    expires_at=Column(DateTime)
+    expires_at=Column(UTCDateTime)
     status=Column(String(200),default='pending')
-    checkout_session_id=Column(Integer,ForeignKey('checkoutsessions.id'),nullable=False)
\ No newline at end of file
+    checkout_session_id=Column(Integer,ForeignKey('checkoutsessions.id'),index=True,nullable=False)
+    
+    __table_args__ = (
+        Index('ix_reservations_user_id_checkout_session_id_product_id', 'user_id', 'checkout_session_id', 'product_id'),
+        #the reaper's scan, queries must compare status with a literal 'pending' for the planner to use it
+        Index('ix_reservations_pending_expires_at', 'expires_at', postgresql_where=text("status = 'pending'"), sqlite_where=text("status = 'pending'")),
+    )
@@ -1,6 +1,6 @@
-from sqlalchemy import Boolean, Column, Integer, String, DateTime, Text, Float, ForeignKey, Numeric, Enum
+from sqlalchemy import Boolean, Column, Integer, String, DateTime, Text, Float, ForeignKey, Numeric, Enum, Index
 from sqlalchemy.sql import func
-from database import Base
+from database import Base, UTCDateTime
 from sqlalchemy.orm import relationship
 import enum
 
@@ -11,5 +11,11 @@ class Reviews(Base):
     product_id=Column(Integer,ForeignKey('products.id'),nullable=False)
     user_id=Column(Integer,ForeignKey('users.id'),nullable=False)
     review_text=Column(Text, nullable=False)
-    created_at=Column(DateTime,server_default=func.now())
-    edited=Column(Boolean, nullable=False)
\ No newline at end of file
+    created_at=Column(UTCDateTime,server_default=func.now())
+    edited=Column(Boolean, nullable=False)
+    
+    __table_args__ = (
+        Index('ix_reviews_product_id_user_id', 'product_id', 'user_id'),
+        #newest first pages of a product's reviews
+        Index('ix_reviews_product_id_id', 'product_id', 'id'),
+    )
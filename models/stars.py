@@ -1,6 +1,6 @@
-from sqlalchemy import Boolean, Column, Integer, String, DateTime, Text, Float, ForeignKey, Numeric, Enum, CheckConstraint
+from sqlalchemy import Boolean, Column, Integer, String, DateTime, Text, Float, ForeignKey, Numeric, Enum, CheckConstraint, Index
 from sqlalchemy.sql import func
-from database import Base
+from database import Base, UTCDateTime
 from sqlalchemy.orm import relationship
 import enum
 
@@ -11,10 +11,28 @@ class Stars(Base):
     product_id=Column(Integer,ForeignKey('products.id'),nullable=False)
     user_id=Column(Integer,ForeignKey('users.id'),nullable=False)
     stars_number=Column(Integer, nullable=False)
-    created_at=Column(DateTime,server_default=func.now())
+    created_at=Column(UTCDateTime,server_default=func.now())
     
     
     __table_args__ = (
         CheckConstraint('stars_number >= 0', name='check_stars_greater_than_or_equal_to_0'), #0 is for not rated
-        CheckConstraint('stars_number <= 5', name='check_stars_less_than_or_equal_to_5')
-    )
\ No newline at end of file
+        CheckConstraint('stars_number <= 5', name='check_stars_less_than_or_equal_to_5'),
+        Index('ix_stars_product_id_user_id', 'product_id', 'user_id'),
+    )
+
+#rating aggregates of a product, the source of truth for its average and count. rate_stars changes them with atomic
+#increments and services.rating_stats recomputes them from stars and copies average and total into products
+class ProductRatingStats(Base):
+    __tablename__='product_rating_stats'
+
+    product_id=Column(Integer,ForeignKey('products.id'),primary_key=True)
+    ratings_count=Column(Integer, nullable=False, default=0)
+    ratings_sum=Column(Integer, nullable=False, default=0)
+    #histogram, one column per stars_number
+    stars_0=Column(Integer, nullable=False, default=0)
+    stars_1=Column(Integer, nullable=False, default=0)
+    stars_2=Column(Integer, nullable=False, default=0)
+    stars_3=Column(Integer, nullable=False, default=0)
+    stars_4=Column(Integer, nullable=False, default=0)
+    stars_5=Column(Integer, nullable=False, default=0)
+    updated_at=Column(UTCDateTime,server_default=func.now(),onupdate=func.now())
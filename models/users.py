@@ -15,7 +15,7 @@ class Users(Base):
     disabled=Column(Boolean,default=False, nullable=False)
     verified=Column(Boolean, default=False,nullable=False)
     role=Column(String(20),default='user',nullable=False)
-    stripe_id=Column(String(200),nullable=False)
+    stripe_id=Column(String(200),index=True,nullable=False)
     phone_number=Column(String(30), nullable=False)
     
 class ShippingAddresses(Base):
@@ -0,0 +1,42 @@
+from sqlalchemy import Column, Integer, String, Text, JSON, Enum, Index
+from sqlalchemy.sql import func
+from database import Base, UTCDateTime
+from enum import Enum as PyEnum
+
+class WebhookEventStatus(str, PyEnum):
+    pending='pending'
+    processing='processing'
+    processed='processed'
+    dead='dead'
+
+class WebhookEvents(Base):
+    __tablename__='webhook_events'
+
+    id=Column(Integer, primary_key=True, index=True)
+    event_id=Column(String(255), unique=True, nullable=False)
+    event_type=Column(String(200), nullable=False)
+    #events with the same key (the payment intent) are processed one at a time in event_created_at order
+    ordering_key=Column(String(255), nullable=False)
+    event_created_at=Column(UTCDateTime, nullable=False)
+    payload=Column(JSON, nullable=False)
+    status=Column(Enum(WebhookEventStatus), default=WebhookEventStatus.pending, nullable=False)
+    attempts=Column(Integer, default=0, nullable=False)
+    next_attempt_at=Column(UTCDateTime, server_default=func.now(), nullable=False)
+    locked_until=Column(UTCDateTime, nullable=True)
+    last_error=Column(Text, nullable=True)
+    created_at=Column(UTCDateTime, server_default=func.now())
+    processed_at=Column(UTCDateTime, nullable=True)
+
+    __table_args__ = (
+        Index('ix_webhook_events_status_next_attempt_at', 'status', 'next_attempt_at'),
+        Index('ix_webhook_events_ordering_key_status', 'ordering_key', 'status'),
+    )
+
+#stripe events whose effects are committed, the row is written in the same transaction as the handler's changes
+class ProcessedStripeEvents(Base):
+    __tablename__='processed_stripe_events'
+
+    id=Column(Integer, primary_key=True, index=True)
+    event_id=Column(String(255), unique=True, nullable=False)
+    event_type=Column(String(200), nullable=False)
+    processed_at=Column(UTCDateTime, server_default=func.now())
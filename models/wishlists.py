@@ -1,6 +1,6 @@
-from sqlalchemy import Boolean, Column, Integer, String, DateTime, Text, Float, ForeignKey, Numeric, Enum
+from sqlalchemy import Boolean, Column, Integer, String, DateTime, Text, Float, ForeignKey, Numeric, Enum, Index
 from sqlalchemy.sql import func
-from database import Base
+from database import Base, UTCDateTime
 from sqlalchemy.orm import relationship
 import enum
 
@@ -10,5 +10,9 @@ class Wishlist(Base):
     id=Column(Integer,primary_key=True,index=True)
     product_id=Column(Integer,ForeignKey('products.id'),nullable=False)
     user_id=Column(Integer,ForeignKey('users.id'),nullable=False)
-    created_at=Column(DateTime,server_default=func.now())
+    created_at=Column(UTCDateTime,server_default=func.now())
+    
+    __table_args__ = (
+        Index('ix_wishlist_user_id_product_id', 'user_id', 'product_id'),
+    )
     
\ No newline at end of file
@@ -1,18 +1,17 @@
 from fastapi import APIRouter, HTTPException,status, Request, Depends, Header
-from fastapi.responses import JSONResponse
+from utils.responses import ORJSONResponse
 import stripe.error
-from config import STRIPE_SECRET_KEY, SUCCESS_URL, CANCEL_URL,STRIPE_WEBHOOK_SECRET, CREATE_RESERVATION_EXPIRATION_TIME, CHECKOUT_PAYMENT_EXPIRATION_TIME
+from config import SUCCESS_URL, CANCEL_URL,STRIPE_WEBHOOK_SECRET, CREATE_RESERVATION_EXPIRATION_TIME, CHECKOUT_PAYMENT_EXPIRATION_TIME
 import stripe
 from typing import Annotated
-from dependencies.database import SessionDB
+from dependencies.database import SessionDB, ReadOnlySessionDB
 from fastapi_csrf_protect import CsrfProtect
 from routers.users import get_current_active_user, is_admin
-from schemas.users import User
+from schemas.users import UserIdentity
 from schemas.cart_and_payment import CartProduct, CartProductsCheckout, CartSortBy, CartInventoryParams, CartSnapshootInventoryParams, CartSnapshootSortBy
-from models.products import Products, product_images
-from models.categories import Categories
+from models.products import Products
 from models.cart import Cart, CartSnapshoots
-from routers.products import get_stock
+from routers.products import get_stock, invalidate_product_cache, product_images_response
 from sqlalchemy.exc import SQLAlchemyError
 from decimal import Decimal, ROUND_HALF_UP
 from models.reservations import Reservations
@@ -22,22 +21,58 @@ from models.users import ShippingAddresses, Users
 from models.payments import Payments, PaymentMethod, PaymentStatus, CheckOutSessions
 from models.refunds import Refunds
 import pytz 
-from sqlalchemy import update, select, delete
+from sqlalchemy import update, select, delete, insert, literal
+from sqlalchemy.orm import joinedload, selectinload
+from utils.pagination import paginate
+from services import stripe_gateway
+from services.inventory import move_reserved_stock, sell_checkout_stock
+from services.webhook_queue import enqueue_event, webhook_queue
+from models.webhook_events import ProcessedStripeEvents
+from cache import webhook_event_cache
+import json
+import logging
+
+logger=logging.getLogger(__name__)
 
 router=APIRouter(prefix='/payment')
 
 utc=pytz.UTC
-stripe.api_key=STRIPE_SECRET_KEY
 
-def create_cart_snapshoot(session:SessionDB, product_id:int, user_id:int, units:int, checkout_session_id:int):
-    product_db=session.query(Products).filter(Products.id==product_id).first()
-    cart_snapshoot_db=CartSnapshoots(product_id=product_id, user_id=user_id, units=units, checkout_session_id=checkout_session_id, price_at_purchase=product_db.price)
-    session.add(cart_snapshoot_db)
+#sort options shared by the offset and the cursor pagination, (column, ascending)
+CART_SORT_COLUMNS={
+    CartSortBy.units_asc:(Cart.units,True),
+    CartSortBy.units_desc:(Cart.units,False),
+    CartSortBy.date_asc:(Cart.created_at,True),
+    CartSortBy.date_desc:(Cart.created_at,False),
+}
+
+CART_SNAPSHOOT_SORT_COLUMNS={
+    CartSnapshootSortBy.units_asc:(CartSnapshoots.units,True),
+    CartSnapshootSortBy.units_desc:(CartSnapshoots.units,False),
+    CartSnapshootSortBy.date_asc:(CartSnapshoots.created_at,True),
+    CartSnapshootSortBy.date_desc:(CartSnapshoots.created_at,False),
+    CartSnapshootSortBy.price_at_purchase_asc:(CartSnapshoots.price_at_purchase,True),
+    CartSnapshootSortBy.price_at_purchase_desc:(CartSnapshoots.price_at_purchase,False),
+}
+
+async def load_cart(session:SessionDB, user_id:int, images:bool=False):
+    #the cart with its products and categories in one joined query (plus one IN (...) query for the images),
+    #shared by the line items, the reservations and the snapshots of a checkout
+    query=select(Cart).filter(Cart.user_id==user_id).options(joinedload(Cart.product).joinedload(Products.category)).order_by(Cart.id)
+    if images:
+        query=query.options(selectinload(Cart.product, Products.images))
+    return (await session.execute(query)).scalars().all()
+
+def create_cart_snapshoots(session:SessionDB, cart_products:list, user_id:int, checkout_session_id:int):
+    session.add_all([
+        CartSnapshoots(product_id=cart_product.product_id, user_id=user_id, units=cart_product.units, checkout_session_id=checkout_session_id, price_at_purchase=cart_product.product.price)
+        for cart_product in cart_products
+    ])
     
-def create_checkout_session_row(session:SessionDB, user_id:int, stripe_session_id:str, stripe_session_url:str):
-    checkout_session_db=CheckOutSessions(user_id=user_id, status='active', session_id=stripe_session_id, session_url=stripe_session_url)
+async def create_checkout_session_row(session:SessionDB, user_id:int, stripe_session_id:str, stripe_session_url:str, expires_at:datetime):
+    checkout_session_db=CheckOutSessions(user_id=user_id, status='active', session_id=stripe_session_id, session_url=stripe_session_url, expires_at=expires_at)
     session.add(checkout_session_db)
-    session.flush()
+    await session.flush()
     return checkout_session_db
     
 def create_refund(session:SessionDB, user_id:int, payment_intent_id:str, checkout_session_id:int, order_id:int):
@@ -46,145 +81,119 @@ def create_refund(session:SessionDB, user_id:int, payment_intent_id:str, checkou
     session.add(refund_db)
         
 
-def create_reservations(session:SessionDB, cart_products:list, user_id:int, checkout_session_id:int):
+async def create_reservations(session:SessionDB, cart_products:list, user_id:int, checkout_session_id:int):
+    #cart_products come from load_cart, the products are already loaded
     if len(cart_products)<=0:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='There are no products in the cart')
-    for cart_product in cart_products:  
-        existing_product_db=session.query(Products).filter(Products.id==cart_product.product_id).first()
-        if not existing_product_db:
-            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='The product does not exist')
-        existing_reservation_db=session.query(Reservations).filter(Reservations.user_id==user_id, Reservations.product_id==cart_product.product_id, Reservations.status=='pending', Reservations.checkout_session_id==checkout_session_id).first()
-        if existing_reservation_db:
-            raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail='A reservation was already created. Try again later')
+    existing_reservation_db=(await session.execute(select(Reservations.id).filter(Reservations.user_id==user_id, Reservations.product_id.in_([cart_product.product_id for cart_product in cart_products]), Reservations.status=='pending', Reservations.checkout_session_id==checkout_session_id))).first()
+    if existing_reservation_db:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail='A reservation was already created. Try again later')
+    #one line per product, move_reserved_stock locks them in product id order
+    units_by_product={}
+    for cart_product in cart_products:
+        units_by_product[cart_product.product_id]=units_by_product.get(cart_product.product_id, 0)+cart_product.units
+    lines=sorted(units_by_product.items())
+    reserved_ids=await move_reserved_stock(session, units_by_product, reserve=True)
+    missing_ids=[product_id for product_id, units in lines if product_id not in reserved_ids]
+    if missing_ids:
+        #the caller rolls back, so the lines that were reserved are released too
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=f'Not enough stock for product ID: {", ".join(str(product_id) for product_id in missing_ids)}')
     
-        result = session.query(Products).filter(
-            Products.id == cart_product.product_id,
-            Products.available_stock >= cart_product.units
-        ).update(
-            {
-                Products.reserve_stock: Products.reserve_stock + cart_product.units,
-                Products.available_stock: Products.available_stock - cart_product.units
-            },
-            synchronize_session=False  # Important for a reliable atomic update
-        )
-        
-        if result == 0:
-            raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=f'Not enough stock for product ID: {cart_product.product_id}')
-        
-        now = datetime.now(timezone.utc)
-        expiration = now + timedelta(minutes=CREATE_RESERVATION_EXPIRATION_TIME)
-        reservation_db = Reservations(
-            product_id=cart_product.product_id, 
-            user_id=user_id, 
-            units=cart_product.units, 
-            expires_at=expiration, 
-            status='pending', 
-            checkout_session_id=checkout_session_id
-        )
-        session.add(reservation_db)
-            
-    
-            
+    expiration=datetime.now(timezone.utc)+timedelta(minutes=CREATE_RESERVATION_EXPIRATION_TIME)
+    session.add_all([
+        Reservations(product_id=product_id, user_id=user_id, units=units, expires_at=expiration, status='pending', checkout_session_id=checkout_session_id)
+        for product_id, units in lines
+    ])
          
-def delete_reservation(session: SessionDB, product_id: int, units: int, user_id: int, checkout_session_id: int):
+async def delete_reservation(session: SessionDB, product_id: int, units: int, user_id: int, checkout_session_id: int):
     # Atomic update: only subtract if reservation exists
-    updated_rows = session.query(Products).filter(
+    updated_rows = await session.execute(update(Products).filter(
         Products.id == product_id,
-        session.query(Reservations.id).filter(
+        select(Reservations.id).filter(
             Reservations.user_id == user_id,
             Reservations.product_id == product_id,
             Reservations.status == 'pending',
             Reservations.checkout_session_id == checkout_session_id
         ).exists()
-    ).update(
+    ).values(
         {
             Products.reserve_stock: Products.reserve_stock - units,
             Products.available_stock: Products.available_stock + units
-        },
-        synchronize_session=False
-    )
+        }
+    ).execution_options(synchronize_session=False))
 
-    if updated_rows == 0:
+    if updated_rows.rowcount == 0:
         # No reservation found, nothing to do
         return
 
     # Delete reservation in the same transaction
-    session.query(Reservations).filter(
+    await session.execute(delete(Reservations).filter(
         Reservations.user_id == user_id,
         Reservations.product_id == product_id,
         Reservations.status == 'pending',
         Reservations.checkout_session_id == checkout_session_id
-    ).delete(synchronize_session=False)
+    ).execution_options(synchronize_session=False))
 
          
-def expire_checkout_session(session:SessionDB, user_id:int, checkout_session_id:int):
-    session.query(CheckOutSessions).filter(
+async def expire_checkout_session(session:SessionDB, user_id:int, checkout_session_id:int):
+    await session.execute(update(CheckOutSessions).filter(
         CheckOutSessions.user_id == user_id, 
         CheckOutSessions.id == checkout_session_id
-    ).update({'status': 'expired'}, synchronize_session=False)
+    ).values({'status': 'expired'}).execution_options(synchronize_session=False))
     
 
 @router.get('/get_cart_products',tags=['cart'])
 async def get_cart(
     request:Request,
-    user: Annotated[User, Depends(get_current_active_user)],
+    user: Annotated[UserIdentity, Depends(get_current_active_user)],
     csrf_protect:Annotated[CsrfProtect, Depends()],
     x_csrf_token:Annotated[str,Header(...,description='"X-CSRF-Token')],
     session:SessionDB
-)->JSONResponse:
+)->ORJSONResponse:
     await csrf_protect.validate_csrf(request)
     try:
-        cart_products_db=session.query(Cart).filter(Cart.user_id==user.id).all()
+        cart_products_db=await load_cart(session, user.id, images=True)
         cart_products=[]
         for cart_product_db in cart_products_db:
-            product_db=session.query(Products).filter(Products.id==cart_product_db.product_id).first()
-            category_db=session.query(Categories).filter(Categories.id==product_db.category_id).first()
-            product_images_db=session.query(product_images).filter(product_images.product_id==product_db.id).all()
-            product_images_list=[]
-            for product_image_db in product_images_db:
-                image_response={
-                    'id':product_image_db.id,
-                    'image_url':product_image_db.image_url,
-                    'is_main':product_image_db.is_main,
-                    'product_id':product_image_db.product_id
-                }
-                product_images_list.append(image_response)
+            product_db=cart_product_db.product
+            category_db=product_db.category
+            product_images_list=product_images_response(product_db)
             product_response={
                 'cart_product_id':cart_product_db.id,
                 'id':product_db.id,
                 'title':product_db.title,
                 'description':product_db.description,
-                'price':str(product_db.price) if product_db.price is not None else None,
+                'price':product_db.price,
                 'stock':get_stock(product_db),
                 'category':category_db.title,
-                'discount_percentage':str(product_db.discount_percentage) if product_db.discount_percentage is not None else None,
+                'discount_percentage':product_db.discount_percentage,
                 'status':product_db.status,
                 'images':product_images_list,
                 'units':cart_product_db.units
             }
             cart_products.append(product_response)
-        return JSONResponse(status_code=status.HTTP_200_OK, content={'products_cart':cart_products})
-    except Exception as e:
-        print(e)
+        return ORJSONResponse(status_code=status.HTTP_200_OK, content={'products_cart':cart_products})
+    except Exception:
+        logger.exception('Getting the cart failed', extra={'user_id':user.id})
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail='An error occurred while getting the products')
 
 @router.post('/add_cart_product',tags=['cart'])
 async def add_cart_product(
     request:Request,
-    user: Annotated[User, Depends(get_current_active_user)],
+    user: Annotated[UserIdentity, Depends(get_current_active_user)],
     csrf_protect:Annotated[CsrfProtect, Depends()],
     x_csrf_token:Annotated[str,Header(...,description='"X-CSRF-Token')],
     session:SessionDB,
     cart_product:CartProduct
-    )->JSONResponse:
+    )->ORJSONResponse:
     await csrf_protect.validate_csrf(request)
-    existing_product=session.query(Products).filter(Products.id==cart_product.product_id, Products.status!='deleted').first()
-    existing_reservations=session.query(Reservations).filter(Reservations.user_id==user.id).first()
+    existing_product=(await session.execute(select(Products).filter(Products.id==cart_product.product_id, Products.status!='deleted'))).scalars().first()
+    existing_reservations=(await session.execute(select(Reservations).filter(Reservations.user_id==user.id))).scalars().first()
     if existing_reservations:
         raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail='You cannot add products from the cart if you recently started a checkout')
     if not existing_product:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='The product does not exist')
-    existing_cart_product=session.query(Cart).filter(Cart.product_id==cart_product.product_id,Cart.user_id==user.id).first()
+    existing_cart_product=(await session.execute(select(Cart).filter(Cart.product_id==cart_product.product_id,Cart.user_id==user.id))).scalars().first()
     if existing_cart_product:
         raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail='The product is already in the cart')
     if cart_product.units>existing_product.available_stock:
@@ -194,49 +203,49 @@ async def add_cart_product(
     try:
         cart_product_db=Cart(product_id=cart_product.product_id, user_id=user.id,units=cart_product.units)
         session.add(cart_product_db)
-        session.commit()
-        return JSONResponse(status_code=status.HTTP_200_OK, content={'message':'Product successfully added to the cart'})
+        await session.commit()
+        return ORJSONResponse(status_code=status.HTTP_200_OK, content={'message':'Product successfully added to the cart'})
     except SQLAlchemyError:
-        session.rollback()
+        await session.rollback()
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail='An error occurred while adding the product to the cart')
     
 #delete product and send the list of products from cart to create checkout session
 @router.delete('/delete_cart_product/{cart_product_id}',tags=['cart'])
 async def delete_product(
     request:Request,
-    user: Annotated[User, Depends(get_current_active_user)],
+    user: Annotated[UserIdentity, Depends(get_current_active_user)],
     csrf_protect:Annotated[CsrfProtect, Depends()],
     x_csrf_token:Annotated[str,Header(...,description='"X-CSRF-Token')],
     cart_product_id:int,
     session:SessionDB
-    )->JSONResponse:    
+    )->ORJSONResponse:    
     await csrf_protect.validate_csrf(request)
-    existing_cart_product=session.query(Cart).filter(Cart.id==cart_product_id).first()
-    existing_reservations=session.query(Reservations).filter(Reservations.user_id==user.id).first()
+    existing_cart_product=(await session.execute(select(Cart).filter(Cart.id==cart_product_id))).scalars().first()
+    existing_reservations=(await session.execute(select(Reservations).filter(Reservations.user_id==user.id))).scalars().first()
     if existing_reservations:
         raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail='You cannot delete products from the cart if you recently started a checkout')
     if not existing_cart_product:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,detail='Product is not in the cart')
     
     try:
-        session.delete(existing_cart_product)
-        session.commit()
-        return JSONResponse(status_code=status.HTTP_200_OK, content={'message':'Product successfully removed from cart'})
+        await session.delete(existing_cart_product)
+        await session.commit()
+        return ORJSONResponse(status_code=status.HTTP_200_OK, content={'message':'Product successfully removed from cart'})
     except SQLAlchemyError:
-        session.rollback()
+        await session.rollback()
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="An error occurred while removing the product from the cart.")
   
 @router.post('/delete_reservations',tags=['payment'])
 async def delete_reservations(
     request:Request,
-    user: Annotated[User, Depends(get_current_active_user)],
+    user: Annotated[UserIdentity, Depends(get_current_active_user)],
     csrf_protect:Annotated[CsrfProtect, Depends()],
     x_csrf_token:Annotated[str,Header(...,description='"X-CSRF-Token')],
     session:SessionDB
 ):
     await csrf_protect.validate_csrf(request)
     try:
-        reservations_with_products = session.query(
+        reservations_with_products = (await session.execute(select(
             Reservations,
             Products
         ).join(
@@ -244,7 +253,7 @@ async def delete_reservations(
             Reservations.product_id == Products.id
         ).filter(
             Reservations.user_id == user.id
-        ).with_for_update().all()
+        ).with_for_update())).all()
 
         if not reservations_with_products:
             return
@@ -253,19 +262,19 @@ async def delete_reservations(
             product.reserve_stock -= reservation.units
             product.available_stock += reservation.units
 
-        session.query(Reservations).filter(
+        await session.execute(delete(Reservations).filter(
             Reservations.user_id == user.id
-        ).delete(synchronize_session=False)
+        ).execution_options(synchronize_session=False))
 
-        session.query(CheckOutSessions).filter(
+        await session.execute(update(CheckOutSessions).filter(
             CheckOutSessions.user_id == user.id,
             CheckOutSessions.status == 'active'
-        ).update({'status': 'expired'}, synchronize_session=False)
+        ).values({'status': 'expired'}).execution_options(synchronize_session=False))
 
-        session.commit()
+        await session.commit()
 
     except SQLAlchemyError as e:
-        session.rollback()
+        await session.rollback()
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                             detail=f'An error occurred while deleting reservations: {e}')
 
@@ -273,25 +282,26 @@ async def delete_reservations(
 @router.post('/create_checkout_session',tags=['payment'])
 async def create_checkout_session(
     request:Request,
-    user: Annotated[User, Depends(get_current_active_user)],
+    user: Annotated[UserIdentity, Depends(get_current_active_user)],
     csrf_protect:Annotated[CsrfProtect, Depends()],
     x_csrf_token:Annotated[str,Header(...,description='"X-CSRF-Token')],
     session:SessionDB,
 ):
     await csrf_protect.validate_csrf(request)
-    cart_products=session.query(Cart).filter(Cart.user_id==user.id).all()
+    cart_products=await load_cart(session, user.id)
     if len(cart_products)<=0:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='The cart is empty')
-    existing_reservation=session.query(Reservations).filter(Reservations.user_id==user.id).first()
+    existing_reservation=(await session.execute(select(Reservations).filter(Reservations.user_id==user.id))).scalars().first()
     if existing_reservation:
         raise HTTPException(status_code=409, detail="You already have a checkout in progress or you recently had one. Try again later")
     try:
+        expires_at=datetime.now(timezone.utc)+timedelta(minutes=CHECKOUT_PAYMENT_EXPIRATION_TIME)
         line_items_list=[]
         for cart_product in cart_products:
-            product_db=session.query(Products).filter(Products.id==cart_product.product_id).first()
+            product_db=cart_product.product
             if not product_db:
                 raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='The product does not exist')
-            category_db=session.query(Categories).filter(Categories.id==product_db.category_id).first()
+            category_db=product_db.category
             if not category_db:
                 raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='The category does not exist')
             if product_db.price<=0:
@@ -324,61 +334,67 @@ async def create_checkout_session(
             }
             line_items_list.append(product)
         
-        stripe_session=stripe.checkout.Session.create(
-            payment_method_types=['card'],
-            mode='payment',
-            line_items=line_items_list,
-            shipping_address_collection={"allowed_countries": ["US"]},
-            customer=f'{user.stripe_id}',
-            customer_update={"shipping": "auto"},
-            success_url=SUCCESS_URL,
-            cancel_url=CANCEL_URL,
-            automatic_tax={'enabled':True},
-            expires_at=int((datetime.now(timezone.utc)+timedelta(minutes=CHECKOUT_PAYMENT_EXPIRATION_TIME)).timestamp())
-        )
+        stripe_session=await stripe_gateway.create_checkout_session({
+            'payment_method_types':['card'],
+            'mode':'payment',
+            'line_items':line_items_list,
+            'shipping_address_collection':{"allowed_countries": ["US"]},
+            'customer':f'{user.stripe_id}',
+            'customer_update':{"shipping": "auto"},
+            'success_url':SUCCESS_URL,
+            'cancel_url':CANCEL_URL,
+            'automatic_tax':{'enabled':True},
+            'expires_at':int(expires_at.timestamp())
+        })
         
-        checkout_session_db=create_checkout_session_row(session, user.id, stripe_session.id, stripe_session.url)
-        create_reservations(session, cart_products, user.id, checkout_session_db.id)
+        checkout_session_db=await create_checkout_session_row(session, user.id, stripe_session.id, stripe_session.url, expires_at)
+        await create_reservations(session, cart_products, user.id, checkout_session_db.id)
         
         #create the cart for each of the products of the cart with the checkout session id. 
-        for cart_product in cart_products:
-            create_cart_snapshoot(session,cart_product.product_id, user.id, cart_product.units, checkout_session_db.id)
-        session.commit()
-        return JSONResponse(status_code=status.HTTP_200_OK,content={'url':stripe_session.url})
+        create_cart_snapshoots(session, cart_products, user.id, checkout_session_db.id)
+        await session.commit()
+        return ORJSONResponse(status_code=status.HTTP_200_OK,content={'url':stripe_session.url})
+    except HTTPException:
+        await session.rollback()
+        raise
     except Exception as e:
-        session.rollback()
+        await session.rollback()
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e)) 
 
 #shipping address, order, order items, payment , modify the stock, delete products from cart(if linked checkout active), refund and oversold if needed, release reservations and set expired
 
-def handle_checkout_success(stripe_session_data,session:SessionDB):
+async def handle_checkout_success(stripe_session_data,session:SessionDB):
     customer_id = stripe_session_data.get("customer")
-    user=session.query(Users).filter(Users.stripe_id==customer_id).first()
+    user=(await session.execute(select(Users).filter(Users.stripe_id==customer_id))).scalars().first()
     user_id=user.id
-    linked_checkout_session=session.query(CheckOutSessions).filter(CheckOutSessions.session_id==stripe_session_data['id']).first()
-    payment_intent = stripe.PaymentIntent.retrieve(stripe_session_data['payment_intent'])
-    existing_order = session.query(Orders).filter(Orders.checkout_session_id == linked_checkout_session.id).first()
+    payment_intent = await stripe_gateway.retrieve_payment_intent(stripe_session_data['payment_intent'])
+    #locked before its status is read and before the reservations and products (the reaper's order), so a reaper
+    #pass expiring it either finished first (status is expired, the order is flagged oversold) or skips it
+    linked_checkout_session=(await session.execute(select(CheckOutSessions).filter(CheckOutSessions.session_id==stripe_session_data['id']).with_for_update())).scalars().first()
+    existing_order = (await session.execute(select(Orders).filter(Orders.checkout_session_id == linked_checkout_session.id))).scalars().first()
     if existing_order:
-        print("Webhook received for an already processed checkout session. Ignoring.")
+        logger.info('Checkout session already fulfilled', extra={'checkout_session_id':linked_checkout_session.id, 'order_id':existing_order.id})
         return
     try:
         #create shipping address
         address=stripe_session_data['customer_details']['address']
         shipping_address_db=ShippingAddresses(user_id=user_id, address_line1=address['line1'], address_line2=address['line2'], city=address['city'], state=address['state'], country=address['country'], zip_code=address['postal_code'])
         session.add(shipping_address_db)
-        session.flush()
+        await session.flush()
         #create order
         order_db=Orders(user_id=user_id, total_amount=stripe_session_data['amount_total'], shipping_addresses_id=shipping_address_db.id, checkout_session_id=linked_checkout_session.id)
         session.add(order_db)
-        session.flush()
-        #create order items
-        cart_products_snapshoot_db=session.query(CartSnapshoots).filter(CartSnapshoots.user_id==user_id, CartSnapshoots.checkout_session_id==linked_checkout_session.id).all()
-        for cart_product_snapshoot in cart_products_snapshoot_db:
-            #use the cart snapshoots associated with the checkout session linked
-            order_product_db=OrderItems(order_id=order_db.id, product_id=cart_product_snapshoot.product_id, units=cart_product_snapshoot.units, price_at_purchase=cart_product_snapshoot.price_at_purchase)
-            session.add(order_product_db)
+        await session.flush()
+        #create order items, straight from the cart snapshoots associated with the checkout session linked
+        await session.execute(insert(OrderItems).from_select(
+            ['order_id', 'product_id', 'units', 'price_at_purchase'],
+            select(literal(order_db.id), CartSnapshoots.product_id, CartSnapshoots.units, CartSnapshoots.price_at_purchase).filter(
+                CartSnapshoots.user_id==user_id,
+                CartSnapshoots.checkout_session_id==linked_checkout_session.id
+            ).order_by(CartSnapshoots.id)
+        ))
         #create payment
-        payment_db = session.query(Payments).filter(Payments.payment_intent_id == payment_intent['id']).first()
+        payment_db = (await session.execute(select(Payments).filter(Payments.payment_intent_id == payment_intent['id']))).scalars().first()
         if payment_db:
             payment_db.order_id=order_db.id
             payment_db.user_id=user_id
@@ -392,143 +408,160 @@ def handle_checkout_success(stripe_session_data,session:SessionDB):
         else:    
             payment_db=Payments(order_id=order_db.id, user_id=user_id, payment_method=PaymentMethod.stripe, status=PaymentStatus.paid, stripe_session_id=stripe_session_data['id'], stripe_customer_id=customer_id, currency=stripe_session_data['currency'], tax_details=stripe_session_data['total_details'].get("amount_tax", 0), payment_intent_id=payment_intent['id']) 
             session.add(payment_db)
-        print(f'PAYMENT_DB_:{payment_db.user_id}')
-        print(f'PAYMENT_DB_:{payment_db.payment_method}')
-        print(f'PAYMENT_DB_:{payment_db.status}')
-        print(f'PAYMENT_DB_:{payment_db.created_at}')
-        print(f'PAYMENT_DB_:{payment_db.stripe_session_id}')
-        print(f'PAYMENT_DB_:{payment_db.stripe_customer_id}')
-        print(f'PAYMENT_DB_:{payment_db.currency}')
-        print(f'PAYMENT_DB_:{payment_db.tax_details}')
-        print(f'PAYMENT_DB_:{payment_db.payment_intent_id}')
-        print(f'PAYMENT_DB_:{payment_db.charge_id}')
-        print(f'PAYMENT_DB_:{payment_db.receipt_url}')
         #modify stock and release reservations
-        for product in cart_products_snapshoot_db:
-            delete_reservation(session, product.product_id, product.units, user_id, linked_checkout_session.id) 
-            session.query(Products).filter(Products.id == product.product_id).update({Products.stock: Products.stock - product.units, Products.available_stock: Products.available_stock - product.units},synchronize_session=False)
+        sold_product_ids=await sell_checkout_stock(session, user_id, linked_checkout_session.id)
         #refund and if oversold and expired session
         if linked_checkout_session.status!='active': 
             order_db.oversold=True
             #create refund request
             create_refund(session,user_id, payment_intent['id'], linked_checkout_session.id, order_db.id)
-            print(f'A refund petition was created')
         else:
             #delete cart products if checkout is active
-            cart_products=session.query(Cart).filter(Cart.user_id==user_id).all()
-            for cart_product in cart_products:
-                session.delete(cart_product)
+            await session.execute(delete(Cart).filter(Cart.user_id==user_id).execution_options(synchronize_session=False))
         linked_checkout_session.status='expired'
-        session.commit()
+        await session.commit()
+        for product_id in sold_product_ids:
+            await invalidate_product_cache(product_id)
+        logger.info('Checkout session fulfilled', extra={
+            'order_id':order_db.id,
+            'user_id':user_id,
+            'checkout_session_id':linked_checkout_session.id,
+            'payment_intent_id':payment_intent['id'],
+            'amount_total':stripe_session_data['amount_total'],
+            'currency':stripe_session_data['currency'],
+            'products':len(sold_product_ids),
+            'oversold':bool(order_db.oversold)
+        })
     except SQLAlchemyError as e:
-        session.rollback()
-        print(f'An error occured while handling the checkout success: {e}')
+        await session.rollback()
+        logger.error('Fulfilling the checkout session failed', extra={'checkout_session_id':linked_checkout_session.id, 'user_id':user_id, 'error':str(e)})
+        raise
         
         
-def handle_charge_succeess(charge_data,session:SessionDB):
+async def handle_charge_succeess(charge_data,session:SessionDB):
     payment_intent_id = charge_data['payment_intent']
-    payment_db = session.query(Payments).filter(Payments.payment_intent_id == payment_intent_id).first()
+    payment_db = (await session.execute(select(Payments).filter(Payments.payment_intent_id == payment_intent_id))).scalars().first()
     try:
         if payment_db:
             payment_db.charge_id=charge_data['id']
             payment_db.receipt_url=charge_data['receipt_url']
-            session.commit()
+            await session.commit()
         else:
-            payment_db=Payments(charge_id=charge_data['id'], receipt_url=charge_data['receipt_url']) 
+            payment_db=Payments(charge_id=charge_data['id'], receipt_url=charge_data['receipt_url'], payment_intent_id=payment_intent_id) 
             session.add(payment_db)
-            session.commit()
-        print(f'PAYMENT_DB_CHARGE:{payment_db.user_id}')
-        print(f'PAYMENT_DB_CHARGE:{payment_db.payment_method}')
-        print(f'PAYMENT_DB_CHARGE:{payment_db.status}')
-        print(f'PAYMENT_DB_CHARGE:{payment_db.created_at}')
-        print(f'PAYMENT_DB_CHARGE:{payment_db.stripe_session_id}')
-        print(f'PAYMENT_DB_CHARGE:{payment_db.stripe_customer_id}')
-        print(f'PAYMENT_DB_CHARGE:{payment_db.currency}')
-        print(f'PAYMENT_DB_CHARGE:{payment_db.tax_details}')
-        print(f'PAYMENT_DB_CHARGE:{payment_db.payment_intent_id}')
-        print(f'PAYMENT_DB_CHARGE:{payment_db.charge_id}')
-        print(f'PAYMENT_DB_CHARGE:{payment_db.receipt_url}')
+            await session.commit()
+        logger.info('Charge recorded', extra={'payment_intent_id':payment_intent_id, 'charge_id':charge_data['id'], 'order_id':payment_db.order_id})
     except SQLAlchemyError as e:
-        session.rollback()
-        print(f'An error occured while handling the charge success: {e}')
+        await session.rollback()
+        logger.error('Recording the charge failed', extra={'payment_intent_id':payment_intent_id, 'charge_id':charge_data['id'], 'error':str(e)})
+        raise
     
        
     
     
 
-def handle_failed_payment(intent, session:SessionDB, stripe_session_data):
+async def handle_failed_payment(intent, session:SessionDB, stripe_session_data):
     # Log failure or notify user
     customer_id = intent.get("customer")
-    user=session.query(Users).filter(Users.stripe_id==customer_id).first()
+    user=(await session.execute(select(Users).filter(Users.stripe_id==customer_id))).scalars().first()
     user_id=user.id
-    linked_checkout_session=session.query(CheckOutSessions).filter(CheckOutSessions.session_id==stripe_session_data['id']).first()
+    linked_checkout_session=(await session.execute(select(CheckOutSessions).filter(CheckOutSessions.session_id==stripe_session_data['id']))).scalars().first()
     try:
-        expire_checkout_session(session, user_id, linked_checkout_session.id)
-        reservations_db=session.query(Reservations).filter(Reservations.user_id==user_id, Reservations.checkout_session_id==linked_checkout_session.id).all()
+        await expire_checkout_session(session, user_id, linked_checkout_session.id)
+        reservations_db=(await session.execute(select(Reservations).filter(Reservations.user_id==user_id, Reservations.checkout_session_id==linked_checkout_session.id))).scalars().all()
         for reservation_db in reservations_db:
-            delete_reservation(session, reservation_db.product_id, reservation_db.units, user_id, linked_checkout_session.id)
-        session.commit()
+            await delete_reservation(session, reservation_db.product_id, reservation_db.units, user_id, linked_checkout_session.id)
+        await session.commit()
+        logger.info('Checkout session released', extra={'reason':'payment_failed', 'checkout_session_id':linked_checkout_session.id, 'user_id':user_id, 'payment_intent_id':intent['id'], 'reservations':len(reservations_db)})
     except SQLAlchemyError as e:
-        session.rollback()
-        print(f'An error occured while handling the checkout failure: {e}')
+        await session.rollback()
+        logger.error('Releasing the checkout session failed', extra={'reason':'payment_failed', 'checkout_session_id':linked_checkout_session.id, 'user_id':user_id, 'error':str(e)})
+        raise
     
     
-def handle_expired_payment(intent, session:SessionDB, stripe_session_data):
+async def handle_expired_payment(intent, session:SessionDB, stripe_session_data):
     # Log failure or notify user
     customer_id = intent.get("customer")
-    user=session.query(Users).filter(Users.stripe_id==customer_id).first()
+    user=(await session.execute(select(Users).filter(Users.stripe_id==customer_id))).scalars().first()
     user_id=user.id
-    linked_checkout_session=session.query(CheckOutSessions).filter(CheckOutSessions.session_id==stripe_session_data['id']).first()
+    linked_checkout_session=(await session.execute(select(CheckOutSessions).filter(CheckOutSessions.session_id==stripe_session_data['id']))).scalars().first()
     try:
-        expire_checkout_session(session, user_id, linked_checkout_session.id)
-        reservations_db=session.query(Reservations).filter(Reservations.user_id==user_id, Reservations.checkout_session_id==linked_checkout_session.id).all()
+        await expire_checkout_session(session, user_id, linked_checkout_session.id)
+        reservations_db=(await session.execute(select(Reservations).filter(Reservations.user_id==user_id, Reservations.checkout_session_id==linked_checkout_session.id))).scalars().all()
         for reservation_db in reservations_db:
-            delete_reservation(session, reservation_db.product_id, reservation_db.units, user_id, linked_checkout_session.id)
-        session.commit()
+            await delete_reservation(session, reservation_db.product_id, reservation_db.units, user_id, linked_checkout_session.id)
+        await session.commit()
+        logger.info('Checkout session released', extra={'reason':'payment_expired', 'checkout_session_id':linked_checkout_session.id, 'user_id':user_id, 'payment_intent_id':intent['id'], 'reservations':len(reservations_db)})
     except SQLAlchemyError as e:
-        session.rollback()
-        print(f'An error occured while handling the checkout failure: {e}')
+        await session.rollback()
+        logger.error('Releasing the checkout session failed', extra={'reason':'payment_expired', 'checkout_session_id':linked_checkout_session.id, 'user_id':user_id, 'error':str(e)})
+        raise
     
-@router.post("/webhook/stripe", status_code=200,tags=['payment'])
-async def stripe_webhook(
-    request:Request,
-    session:SessionDB
-    ):
-    payload = await request.body()
-    sig_header = request.headers.get("stripe-signature")
-
-    try:
-        event = stripe.Webhook.construct_event(
-            payload, sig_header, STRIPE_WEBHOOK_SECRET
-        )
-    except ValueError as e:
-        raise HTTPException(status_code=400, detail=f"Invalid payload {e}")
-    except stripe.error.SignatureVerificationError as e:
-        raise HTTPException(status_code=400, detail=f"Invalid signature {e}")
-
+#runs in the webhook queue consumers (services/webhook_queue.py), errors are raised so the event is retried
+async def process_stripe_event(event:dict, session:SessionDB):
+    if await webhook_event_cache.get(('processed', event['id'])):
+        return
+    if (await session.execute(select(ProcessedStripeEvents.id).filter(ProcessedStripeEvents.event_id==event['id']))).first():
+        await webhook_event_cache.set(('processed', event['id']), True)
+        return
+    #committed by the handler together with its changes, a handler that fails rolls it back and the event is retried
+    session.add(ProcessedStripeEvents(event_id=event['id'], event_type=event['type']))
     # Handle specific event types
     if event['type'] == 'checkout.session.completed':
         stripe_session_data = event['data']['object']
-        handle_checkout_success(stripe_session_data,session)
+        await handle_checkout_success(stripe_session_data,session)
         
     elif event['type'] == 'charge.succeeded':
         # This is the new block for a successful charge
         charge_data = event['data']['object']
-        handle_charge_succeess(charge_data, session)
+        await handle_charge_succeess(charge_data, session)
 
     elif event['type'] == 'payment_intent.payment_failed':
         intent = event['data']['object']
-        checkout_sessions = stripe.checkout.Session.list(payment_intent=intent["id"])
+        checkout_sessions = await stripe_gateway.list_checkout_sessions(intent["id"])
         if checkout_sessions.data:
             stripe_session_data = checkout_sessions.data[0]
-            handle_failed_payment(intent,session, stripe_session_data)
+            await handle_failed_payment(intent,session, stripe_session_data)
     
     elif event['type'] == 'payment_intent.expired':
         intent = event['data']['object']
-        checkout_sessions = stripe.checkout.Session.list(payment_intent=intent["id"])
+        checkout_sessions = await stripe_gateway.list_checkout_sessions(intent["id"])
         if checkout_sessions.data:
             stripe_session_data = checkout_sessions.data[0]
-            handle_expired_payment(intent,session, stripe_session_data)
+            await handle_expired_payment(intent,session, stripe_session_data)
+    #handlers that had nothing to do return without committing
+    await session.commit()
+    await webhook_event_cache.set(('processed', event['id']), True)
+
+HANDLED_STRIPE_EVENTS={'checkout.session.completed', 'charge.succeeded', 'payment_intent.payment_failed', 'payment_intent.expired'}
+
+@router.post("/webhook/stripe", status_code=200,tags=['payment'])
+async def stripe_webhook(
+    request:Request,
+    session:SessionDB
+    ):
+    payload = await request.body()
+    sig_header = request.headers.get("stripe-signature")
+
+    try:
+        event = stripe.Webhook.construct_event(
+            payload, sig_header, STRIPE_WEBHOOK_SECRET
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid payload {e}")
+    except stripe.error.SignatureVerificationError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid signature {e}")
+
+    #store the event and answer right away, the webhook queue processes it. Redeliveries of a stored event are ignored
+    if event['type'] in HANDLED_STRIPE_EVENTS and not await webhook_event_cache.get(('received', event['id'])):
+        try:
+            if await enqueue_event(session, json.loads(payload)):
+                webhook_queue.notify()
+            await webhook_event_cache.set(('received', event['id']), True)
+        except SQLAlchemyError as e:
+            await session.rollback()
+            #stripe redelivers on non 2xx responses
+            raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=f'The event could not be stored: {e}')
         
     return {"status": "success"}
 
@@ -547,18 +580,18 @@ async def get_carts_admins(
     admin: Annotated[bool, Depends(is_admin)],
     csrf_protect:Annotated[CsrfProtect, Depends()],
     x_csrf_token:Annotated[str,Header(...,description='"X-CSRF-Token')],
-    session:SessionDB,
+    session:ReadOnlySessionDB,
     carts_params: CartInventoryParams,
     page:int|None=1,
     limit:int|None=10,
-    )->JSONResponse:
+    cursor:str|None=None,
+    )->ORJSONResponse:
     await csrf_protect.validate_csrf(request)
     if not admin:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,detail='Not enough permissions')
     try:
-        query=session.query(Cart)
-        
-        carts_found=[]
+        #the rows are returned as they are, one object per row keyed by column
+        query=select(Cart.id, Cart.product_id, Cart.user_id, Cart.units, Cart.created_at)
      
         if carts_params.product_id:
             query=query.filter(Cart.product_id==carts_params.product_id)
@@ -582,33 +615,10 @@ async def get_carts_admins(
             
             
            
-        if carts_params.sort_by==CartSortBy.units_asc:
-            query=query.order_by(Cart.units.asc())
-            
-        elif carts_params.sort_by==CartSortBy.units_desc:
-            query=query.order_by(Cart.units.desc())
-            
-        elif carts_params.sort_by==CartSortBy.date_asc:
-            query=query.order_by(Cart.created_at.asc())
-            
-        elif carts_params.sort_by==CartSortBy.date_desc:
-            query=query.order_by(Cart.created_at.desc())  
-        
-        offset=(page-1)*limit
-        query=query.offset(offset).limit(limit)    
-        
-        carts=query.all()
-        for cart in carts:
-            cart_object={
-                'id':cart.id,
-                'product_id':cart.product_id,
-                'user_id':cart.user_id,
-                'units':cart.units,
-                'created_at':cart.created_at.isoformat()
-            }
-            carts_found.append(cart_object)
-                
-        return JSONResponse(status_code=status.HTTP_200_OK,content={'carts':carts_found, 'page':page,'limit':limit})
+        order_column, ascending=CART_SORT_COLUMNS.get(carts_params.sort_by, (None,True))
+        sort_key=carts_params.sort_by.value if carts_params.sort_by else 'default'
+        carts, next_cursor=await paginate(session, query, page, limit, cursor, sort_key, Cart.id, order_column, ascending)
+        return ORJSONResponse(status_code=status.HTTP_200_OK,content={'carts':carts, 'page':page,'limit':limit, 'next_cursor':next_cursor})
     except SQLAlchemyError:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,detail='An error occurred while getting the carts.')
 
@@ -620,18 +630,17 @@ async def get_cart_snapshoots_admins(
     admin: Annotated[bool, Depends(is_admin)],
     csrf_protect:Annotated[CsrfProtect, Depends()],
     x_csrf_token:Annotated[str,Header(...,description='"X-CSRF-Token')],
-    session:SessionDB,
+    session:ReadOnlySessionDB,
     cart_snapshoots_params: CartSnapshootInventoryParams,
     page:int|None=1,
     limit:int|None=10,
-    )->JSONResponse:
+    cursor:str|None=None,
+    )->ORJSONResponse:
     await csrf_protect.validate_csrf(request)
     if not admin:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,detail='Not enough permissions')
     try:
-        query=session.query(CartSnapshoots)
-        
-        cart_snapshoots_found=[]
+        query=select(CartSnapshoots.id, CartSnapshoots.product_id, CartSnapshoots.user_id, CartSnapshoots.units, CartSnapshoots.created_at, CartSnapshoots.checkout_session_id, CartSnapshoots.price_at_purchase)
      
         if cart_snapshoots_params.product_id:
             query=query.filter(CartSnapshoots.product_id==cart_snapshoots_params.product_id)
@@ -664,41 +673,9 @@ async def get_cart_snapshoots_admins(
             
             
            
-        if cart_snapshoots_params.sort_by==CartSnapshootSortBy.units_asc:
-            query=query.order_by(CartSnapshoots.units.asc())
-            
-        elif cart_snapshoots_params.sort_by==CartSnapshootSortBy.units_desc:
-            query=query.order_by(CartSnapshoots.units.desc())
-            
-        elif cart_snapshoots_params.sort_by==CartSnapshootSortBy.date_asc:
-            query=query.order_by(CartSnapshoots.created_at.asc())
-            
-        elif cart_snapshoots_params.sort_by==CartSnapshootSortBy.date_desc:
-            query=query.order_by(CartSnapshoots.created_at.desc()) 
-            
-        elif cart_snapshoots_params.sort_by==CartSnapshootSortBy.price_at_purchase_asc:
-            query=query.order_by(CartSnapshoots.price_at_purchase.asc()) 
-        
-        elif cart_snapshoots_params.sort_by==CartSnapshootSortBy.price_at_purchase_desc:
-            query=query.order_by(CartSnapshoots.price_at_purchase.desc())  
-        
-        offset=(page-1)*limit
-        query=query.offset(offset).limit(limit)    
-        
-        cart_snapshoots=query.all()
-        for cart_snapshoot in cart_snapshoots:
-            cart_snapshoot_object={
-                'id':cart_snapshoot.id,
-                'product_id':cart_snapshoot.product_id,
-                'user_id':cart_snapshoot.user_id,
-                'units':cart_snapshoot.units,
-                'created_at':cart_snapshoot.created_at.isoformat(),
-                'checkout_session_id':cart_snapshoot.checkout_session_id,
-                'price_at_purchase':str(cart_snapshoot.price_at_purchase) if cart_snapshoot.price_at_purchase is not None else None
-                
-            }
-            cart_snapshoots_found.append(cart_snapshoot_object)
-                
-        return JSONResponse(status_code=status.HTTP_200_OK,content={'carts_snapshoots':cart_snapshoots_found, 'page':page,'limit':limit})
+        order_column, ascending=CART_SNAPSHOOT_SORT_COLUMNS.get(cart_snapshoots_params.sort_by, (None,True))
+        sort_key=cart_snapshoots_params.sort_by.value if cart_snapshoots_params.sort_by else 'default'
+        cart_snapshoots, next_cursor=await paginate(session, query, page, limit, cursor, sort_key, CartSnapshoots.id, order_column, ascending)
+        return ORJSONResponse(status_code=status.HTTP_200_OK,content={'carts_snapshoots':cart_snapshoots, 'page':page,'limit':limit, 'next_cursor':next_cursor})
     except SQLAlchemyError:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,detail='An error occurred while getting the cart snapshoots.')
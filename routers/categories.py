@@ -2,11 +2,13 @@ from fastapi import APIRouter, Request, Depends, Header, HTTPException, status
 from schemas.categories import CategoryInventoryParams
 from models.categories import Categories
 from typing import Annotated
-from fastapi.responses import JSONResponse
+from utils.responses import ORJSONResponse
 from routers.users import is_admin
 from fastapi_csrf_protect import CsrfProtect
-from dependencies.database import SessionDB
+from dependencies.database import ReadOnlySessionDB
+from sqlalchemy import select
 from sqlalchemy.exc import SQLAlchemyError
+from utils.pagination import paginate
 
 
 
@@ -19,34 +21,23 @@ async def get_categories_admins(
     admin: Annotated[bool, Depends(is_admin)],
     csrf_protect:Annotated[CsrfProtect, Depends()],
     x_csrf_token:Annotated[str,Header(...,description='"X-CSRF-Token')],
-    session:SessionDB,
+    session:ReadOnlySessionDB,
     categories_params: CategoryInventoryParams,
     page:int|None=1,
     limit:int|None=10,
-    )->JSONResponse:
+    cursor:str|None=None,
+    )->ORJSONResponse:
     await csrf_protect.validate_csrf(request)
     if not admin:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,detail='Not enough permissions')
     try:
-        query=session.query(Categories)
-        
-        categories_found=[]
+        query=select(Categories.id, Categories.title)
      
         if categories_params.title:
             query=query.filter(Categories.title.ilike(f"%{categories_params.title}%"))
             
         
-        offset=(page-1)*limit
-        query=query.offset(offset).limit(limit)    
-        
-        categories=query.all()
-        for category in categories:
-            category_object={
-                'id':category.id,
-                'title':category.title
-            }
-            categories_found.append(category_object)
-                
-        return JSONResponse(status_code=status.HTTP_200_OK,content={'categories':categories_found, 'page':page,'limit':limit})
+        categories, next_cursor=await paginate(session, query, page, limit, cursor, 'default', Categories.id)
+        return ORJSONResponse(status_code=status.HTTP_200_OK,content={'categories':categories, 'page':page,'limit':limit, 'next_cursor':next_cursor})
     except SQLAlchemyError:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,detail='An error occurred while getting the categories.')
@@ -0,0 +1,15 @@
+from fastapi import APIRouter, Request, HTTPException, status
+from fastapi.responses import PlainTextResponse
+import secrets
+from metrics import render_metrics
+from config import METRICS_TOKEN
+
+router=APIRouter()
+
+
+#scraped by prometheus, outside the admin session and csrf flow. With METRICS_TOKEN set the scraper sends it as a bearer token
+@router.get('/metrics', include_in_schema=False)
+async def get_metrics(request:Request)->PlainTextResponse:
+    if METRICS_TOKEN and not secrets.compare_digest(request.headers.get('authorization', ''), f'Bearer {METRICS_TOKEN}'):
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail='Not authenticated')
+    return PlainTextResponse(render_metrics(), media_type='text/plain; version=0.0.4')
@@ -0,0 +1,101 @@
+from fastapi import APIRouter, Request, Depends, Header, HTTPException, status
+from typing import Annotated
+from utils.responses import ORJSONResponse
+from routers.users import is_admin
+from fastapi_csrf_protect import CsrfProtect
+from database import pool_stats
+from services.passwords import password_hasher
+from logs import logging_stats
+from services.reservation_reaper import reservation_reaper
+from services.webhook_queue import webhook_queue
+from services.rating_stats import rating_stats_reconciler
+
+router=APIRouter(prefix='/monitoring_admin')
+
+
+@router.get('/database_pools',tags=['monitoring_admin'])
+async def get_database_pools(
+    request:Request,
+    admin: Annotated[bool, Depends(is_admin)],
+    csrf_protect:Annotated[CsrfProtect, Depends()],
+    x_csrf_token:Annotated[str,Header(...,description='"X-CSRF-Token')],
+    )->ORJSONResponse:
+    await csrf_protect.validate_csrf(request)
+    if not admin:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,detail='Not enough permissions')
+    return ORJSONResponse(status_code=status.HTTP_200_OK, content={'pools':pool_stats()})
+
+@router.get('/password_hashing',tags=['monitoring_admin'])
+async def get_password_hashing(
+    request:Request,
+    admin: Annotated[bool, Depends(is_admin)],
+    csrf_protect:Annotated[CsrfProtect, Depends()],
+    x_csrf_token:Annotated[str,Header(...,description='"X-CSRF-Token')],
+    )->ORJSONResponse:
+    await csrf_protect.validate_csrf(request)
+    if not admin:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,detail='Not enough permissions')
+    return ORJSONResponse(status_code=status.HTTP_200_OK, content={'password_hashing':password_hasher.stats()})
+
+@router.get('/logging',tags=['monitoring_admin'])
+async def get_logging(
+    request:Request,
+    admin: Annotated[bool, Depends(is_admin)],
+    csrf_protect:Annotated[CsrfProtect, Depends()],
+    x_csrf_token:Annotated[str,Header(...,description='"X-CSRF-Token')],
+    )->ORJSONResponse:
+    await csrf_protect.validate_csrf(request)
+    if not admin:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,detail='Not enough permissions')
+    return ORJSONResponse(status_code=status.HTTP_200_OK, content={'logging':logging_stats()})
+
+@router.get('/reservation_reaper',tags=['monitoring_admin'])
+async def get_reservation_reaper(
+    request:Request,
+    admin: Annotated[bool, Depends(is_admin)],
+    csrf_protect:Annotated[CsrfProtect, Depends()],
+    x_csrf_token:Annotated[str,Header(...,description='"X-CSRF-Token')],
+    )->ORJSONResponse:
+    await csrf_protect.validate_csrf(request)
+    if not admin:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,detail='Not enough permissions')
+    return ORJSONResponse(status_code=status.HTTP_200_OK, content={'reservation_reaper':reservation_reaper.stats()})
+
+@router.get('/rating_stats',tags=['monitoring_admin'])
+async def get_rating_stats_reconciler(
+    request:Request,
+    admin: Annotated[bool, Depends(is_admin)],
+    csrf_protect:Annotated[CsrfProtect, Depends()],
+    x_csrf_token:Annotated[str,Header(...,description='"X-CSRF-Token')],
+    )->ORJSONResponse:
+    await csrf_protect.validate_csrf(request)
+    if not admin:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,detail='Not enough permissions')
+    return ORJSONResponse(status_code=status.HTTP_200_OK, content={'rating_stats':rating_stats_reconciler.stats()})
+
+@router.get('/webhook_events',tags=['monitoring_admin'])
+async def get_webhook_events(
+    request:Request,
+    admin: Annotated[bool, Depends(is_admin)],
+    csrf_protect:Annotated[CsrfProtect, Depends()],
+    x_csrf_token:Annotated[str,Header(...,description='"X-CSRF-Token')],
+    )->ORJSONResponse:
+    await csrf_protect.validate_csrf(request)
+    if not admin:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,detail='Not enough permissions')
+    return ORJSONResponse(status_code=status.HTTP_200_OK, content={'webhook_queue':webhook_queue.stats(), 'webhook_events':await webhook_queue.depth()})
+
+@router.post('/webhook_events/{event_id}/requeue',tags=['monitoring_admin'])
+async def requeue_webhook_event(
+    request:Request,
+    event_id:str,
+    admin: Annotated[bool, Depends(is_admin)],
+    csrf_protect:Annotated[CsrfProtect, Depends()],
+    x_csrf_token:Annotated[str,Header(...,description='"X-CSRF-Token')],
+    )->ORJSONResponse:
+    await csrf_protect.validate_csrf(request)
+    if not admin:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,detail='Not enough permissions')
+    if not await webhook_queue.requeue(event_id):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,detail='There is no dead webhook event with that id')
+    return ORJSONResponse(status_code=status.HTTP_200_OK, content={'message':'Webhook event requeued'})
@@ -1,10 +1,11 @@
 from fastapi import APIRouter, Request, Depends, Header, HTTPException, status
 from typing import Annotated
-from fastapi.responses import JSONResponse
+from utils.responses import ORJSONResponse
 from routers.users import is_admin
 from fastapi_csrf_protect import CsrfProtect
 from dependencies.database import SessionDB
 from models.orders import Orders
+from sqlalchemy import select
 from sqlalchemy.exc import SQLAlchemyError
 from schemas.orders import OrderStatusRequest
 
@@ -19,20 +20,20 @@ async def update_order_status(
     order_id:int,
     session:SessionDB,
     order_status:OrderStatusRequest
-)->JSONResponse:
+)->ORJSONResponse:
     await csrf_protect.validate_csrf(request)
     if not admin:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,detail='Not enough permissions')
-    order_db=session.query(Orders).filter(Orders.id==order_id).first()
+    order_db=(await session.execute(select(Orders).filter(Orders.id==order_id))).scalars().first()
     if not order_db:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='The order does not exist')
     try:
         order_db.status=order_status.order_status
-        session.commit()
-        session.refresh(order_db)
-        return JSONResponse(status_code=status.HTTP_200_OK, content={'message':f'Order status successfully updated to {order_db.status}'})
+        await session.commit()
+        await session.refresh(order_db)
+        return ORJSONResponse(status_code=status.HTTP_200_OK, content={'message':f'Order status successfully updated to {order_db.status}'})
     except SQLAlchemyError as e:
-        session.rollback()
+        await session.rollback()
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f'An error occurred while updating the order: {e}')
         
         
@@ -1,5 +1,5 @@
 from fastapi import APIRouter, Depends, Request, Header, HTTPException,status
-from fastapi.responses import JSONResponse
+from utils.responses import ORJSONResponse
 from typing import Annotated
 from routers.users import is_admin, get_current_active_user_custom, get_current_active_user
 from fastapi_csrf_protect import CsrfProtect
@@ -7,48 +7,141 @@ from fastapi_csrf_protect.exceptions import CsrfProtectError
 from models.products import Products, product_images
 from models.categories import Categories
 from schemas.products import Product, ProductImages, ProductUser, ProductUpdate, ProductsInventoryParams, ProductsSortBy, ProductsSortByUser,ProductsSearchUser
-from dependencies.database import SessionDB
+from dependencies.database import SessionDB, ReadOnlySessionDB
 from sqlalchemy.exc import SQLAlchemyError
 from models.reservations import Reservations
 from models.wishlists import Wishlist
-from schemas.users import User
+from schemas.users import UserIdentity
 from models.reviews import Reviews
-from models.users import Users
+from sqlalchemy import select, literal_column
+from sqlalchemy.orm import joinedload, selectinload
+from utils.pagination import paginate
+from services.search import apply_product_search, product_search_index
+from cache import catalog_cache, category_cache
+from database import is_fresh_read
+from routers.reviews import product_reviews_page, count_product_reviews
+from config import PRODUCT_REVIEWS_PREVIEW
+from services.rating_stats import get_rating_stats
 
 
 router=APIRouter(prefix='/products')
 
-def in_wishlist(session:SessionDB, user_id:int, product_id:int):
-    wishlist_product_db=session.query(Wishlist).filter(Wishlist.product_id==product_id, Wishlist.user_id==user_id).first()
+async def invalidate_product_cache(product_id:int|None=None):
+    #any product change can move it in or out of a listing page, so the listings are always dropped
+    if product_id is not None:
+        await catalog_cache.delete(('get_product', product_id))
+    await catalog_cache.delete_namespace('get_products')
+
+def invalidate_search_index(namespace:str|None):
+    #the in-process search index (sqlite) is rebuilt with the listings, so a product created or renamed through
+    #another worker (its invalidation comes over the redis channel) is searchable here too
+    if namespace is None or namespace=='get_products':
+        product_search_index.invalidate()
+
+catalog_cache.add_invalidation_listener(invalidate_search_index)
+
+#sort options shared by the offset and the cursor pagination, (column, ascending)
+PRODUCTS_SORT_COLUMNS={
+    ProductsSortBy.price_asc:(Products.price,True),
+    ProductsSortBy.price_desc:(Products.price,False),
+    ProductsSortBy.stock_asc:(Products.stock,True),
+    ProductsSortBy.stock_desc:(Products.stock,False),
+    ProductsSortBy.discount_percentage_asc:(Products.discount_percentage,True),
+    ProductsSortBy.discount_percentage_desc:(Products.discount_percentage,False),
+    ProductsSortBy.date_asc:(Products.created_at,True),
+    ProductsSortBy.date_desc:(Products.created_at,False),
+    ProductsSortBy.weight_asc:(Products.weight,True),
+    ProductsSortBy.weight_desc:(Products.weight,False),
+    ProductsSortBy.height_asc:(Products.height,True),
+    ProductsSortBy.height_desc:(Products.height,False),
+    ProductsSortBy.length_asc:(Products.length,True),
+    ProductsSortBy.length_desc:(Products.length,False),
+    ProductsSortBy.width_asc:(Products.width,True),
+    ProductsSortBy.width_desc:(Products.width,False),
+    ProductsSortBy.average_stars_asc:(Products.average_stars,True),
+    ProductsSortBy.average_stars_desc:(Products.average_stars,False),
+    ProductsSortBy.total_stars_asc:(Products.total_stars,True),
+    ProductsSortBy.total_stars_desc:(Products.total_stars,False),
+}
+
+async def in_wishlist(session:SessionDB, user_id:int, product_id:int):
+    wishlist_product_db=(await session.execute(select(Wishlist).filter(Wishlist.product_id==product_id, Wishlist.user_id==user_id))).scalars().first()
     if wishlist_product_db:
         return True
     return False
 
-def exists_review(session:SessionDB, user_id:int, product_id:int):
-    existing_review_db=session.query(Reviews).filter(Reviews.product_id==product_id, Reviews.user_id==user_id).first()
+async def exists_review(session:SessionDB, user_id:int, product_id:int):
+    existing_review_db=(await session.execute(select(Reviews).filter(Reviews.product_id==product_id, Reviews.user_id==user_id))).scalars().first()
     if existing_review_db:
         return True
     return False
 
-def get_or_create_category(session:SessionDB, category_name:str):
+async def get_category_id(session:SessionDB, category_name:str):
+    category_id=await category_cache.get(('category_id', category_name))
+    if category_id is None:
+        existing_category=(await session.execute(select(Categories.id).filter(Categories.title==category_name))).first()
+        if not existing_category:
+            return None
+        category_id=existing_category.id
+        await category_cache.set(('category_id', category_name), category_id)
+    return category_id
+
+async def get_or_create_category(session:SessionDB, category_name:str):
     try:
-        existing_category=session.query(Categories).filter(Categories.title==category_name).first()
-        if existing_category:
-            return existing_category.id
+        existing_category_id=await get_category_id(session, category_name)
+        if existing_category_id:
+            return existing_category_id
         category_db=Categories(title=category_name)
         session.add(category_db)
-        session.commit()
-        session.refresh(category_db)
+        await session.commit()
+        await session.refresh(category_db)
+        await category_cache.set(('category_id', category_name), category_db.id)
         return category_db.id
     except SQLAlchemyError:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,detail='An error occurred while getting the category')
 
+def load_product_relations(query, images:bool=True):
+    #category and images for the whole page in one joined query plus one IN (...) query, instead of two queries per product
+    query=query.options(joinedload(Products.category))
+    if images:
+        query=query.options(selectinload(Products.images))
+    return query
+
+#column values are returned as they are, the response class serializes Decimal (as a string), datetimes and enums
+PRODUCT_FIELDS=('id', 'title', 'description', 'price', 'category', 'discount_percentage', 'weight', 'height', 'length', 'width', 'status')
+PRODUCT_ADMIN_FIELDS=('id', 'title', 'description', 'price', 'stock', 'reserve_stock', 'available_stock', 'category', 'discount_percentage', 'created_at', 'weight', 'height', 'length', 'width', 'status', 'taxcode', 'average_stars', 'total_stars')
+PRODUCT_IMAGE_FIELDS=('id', 'product_id', 'image_url', 'is_main')
+
+def product_fields(product_db, fields:tuple):
+    return {field:product_db.category.title if field=='category' else getattr(product_db, field) for field in fields}
+
+def product_images_response(product_db):
+    return [{field:getattr(image_db, field) for field in PRODUCT_IMAGE_FIELDS} for image_db in product_db.images]
+
+async def paginate_products(session:SessionDB, query, sort_by, page:int, limit:int, cursor:str|None, default_sort=(None,True), relevance=None):
+    sort_key=sort_by.value if sort_by else 'default'
+    if sort_by==ProductsSortBy.relevance and relevance is not None:
+        #the rank is selected next to the product so the cursor can carry it
+        rows, next_cursor=await paginate(session, query.add_columns(relevance), page, limit, cursor, sort_key, Products.id, relevance, False, row_values=lambda row:(row[1], row[0].id))
+        return [row[0] for row in rows], next_cursor
+    order_column, ascending=PRODUCTS_SORT_COLUMNS.get(sort_by, default_sort)
+    return await paginate(session, query, page, limit, cursor, sort_key, Products.id, order_column, ascending)
+
 def get_stock(product_db):
     try:
         return product_db.available_stock>0
     except Exception:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail='An error occurred while getting the stock')
 
+def product_listing_response(product_db, stock_field:str='is_there_stock'):
+    return {
+        **product_fields(product_db, PRODUCT_FIELDS),
+        stock_field:get_stock(product_db),
+        'images':product_images_response(product_db),
+        'average_stars':product_db.average_stars,
+        'total_stars':product_db.total_stars
+    }
+
 #ADMINS
 @router.post('/create_product',tags=['products_admins'])
 async def create_product(
@@ -58,11 +151,11 @@ async def create_product(
     x_csrf_token:Annotated[str,Header(...,description='"X-CSRF-Token')],
     product:Product,
     session:SessionDB
-    )->JSONResponse:
+    )->ORJSONResponse:
     await csrf_protect.validate_csrf(request)
     if not admin:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,detail='Not enough permissions')
-    existing_product=session.query(Products).filter(Products.title==product.title).first()
+    existing_product=(await session.execute(select(Products).filter(Products.title==product.title))).scalars().first()
     if existing_product:
         raise HTTPException(status_code=status.HTTP_409_CONFLICT,detail='Product with this title already exists')
     counter=0
@@ -73,19 +166,20 @@ async def create_product(
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,detail='Only one image can be the main')
     try:
         
-        category_id=get_or_create_category(session, product.category)
+        category_id=await get_or_create_category(session, product.category)
         
         product_db=Products(title=product.title,description=product.description,price=product.price,stock=product.stock,category_id=category_id,discount_percentage=product.discount_percentage,weight=product.weight,height=product.height,length=product.length,width=product.width,status='active',taxcode=product.taxcode,reserve_stock=0,available_stock=product.stock, average_stars=0, total_stars=0)
         session.add(product_db)
-        session.commit()
-        session.refresh(product_db)
+        await session.commit()
+        await session.refresh(product_db)
         for image in product.images:
             image_db=product_images(image_url=image.image_url,is_main=image.is_main,product_id=product_db.id)
             session.add(image_db)
-        session.commit()
-        return JSONResponse(status_code=status.HTTP_201_CREATED,content={'message':'Product created'})
+        await session.commit()
+        await invalidate_product_cache()
+        return ORJSONResponse(status_code=status.HTTP_201_CREATED,content={'message':'Product created'})
     except SQLAlchemyError:
-        session.rollback()
+        await session.rollback()
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="An error occurred while saving the product.")
     
 @router.patch('/update_product/{product_id}',tags=['products_admins'])
@@ -97,14 +191,14 @@ async def update_product(
     product_id:int,
     product:ProductUpdate,
     session:SessionDB
-)->JSONResponse:
+)->ORJSONResponse:
     await csrf_protect.validate_csrf(request)
     if not admin:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,detail='Not enough permissions')
-    existing_product=session.query(Products).filter(Products.id==product_id).first()
+    existing_product=(await session.execute(select(Products).filter(Products.id==product_id))).scalars().first()
     if not existing_product:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,detail='Product does not exist')
-    #existing_reservation=session.query(Reservations).filter(Reservations.product_id==product_id).first()
+    #existing_reservation=(await session.execute(select(Reservations).filter(Reservations.product_id==product_id))).scalars().first()
     #if existing_reservation:
     #    raise HTTPException(status_code=status.HTTP_409_CONFLICT,detail='Product cannot be modified because there are reservations of the product')
     try: 
@@ -120,54 +214,34 @@ async def update_product(
                         counter+=1
                 if counter!=1:
                     raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,detail='Only one image can be the main')
-                existing_images=session.query(product_images).filter(product_images.product_id==product_id).all()
+                existing_images=(await session.execute(select(product_images).filter(product_images.product_id==product_id))).scalars().all()
                 for image in existing_images:
-                    session.delete(image)
+                    await session.delete(image)
                 for product_image in product_dict['images']:
                     new_image=product_images(product_id=product_id,image_url=product_image['image_url'],is_main=product_image['is_main'])
                     session.add(new_image)
                     
             elif key=='category':
-                    category_id=get_or_create_category(session,value)
+                    category_id=await get_or_create_category(session,value)
                     setattr(existing_product,'category_id',category_id)         
             elif key=='stock':
                     existing_product.stock+=value
                     existing_product.available_stock+=value
             else:
                     setattr(existing_product, key, value)
-        session.commit()
-        session.refresh(existing_product)
-        existing_images_final=session.query(product_images).filter(product_images.product_id==product_id).all()
-        existing_images_list=[]
-        for existing_image in existing_images_final:
-            image_dict={'image_id':existing_image.id,'image_url':existing_image.image_url,'is_main':existing_image.is_main}
-            existing_images_list.append(image_dict)
-        existing_product_category=session.query(Categories).filter(Categories.id==existing_product.category_id).first()
+        await session.commit()
+        await session.refresh(existing_product)
+        await invalidate_product_cache(product_id)
+        existing_images_list=(await session.execute(select(product_images.id.label('image_id'), product_images.image_url, product_images.is_main).filter(product_images.product_id==product_id).order_by(product_images.id))).all()
+        existing_product_category=(await session.execute(select(Categories).filter(Categories.id==existing_product.category_id))).scalars().first()
         product_updated={
-            'id':existing_product.id,
-            'title':existing_product.title,
-            'description':existing_product.description,
-            'price':str(existing_product.price),
-            'stock':existing_product.stock,
-            'reserve_stock': existing_product.reserve_stock,
-            'available_stock':existing_product.available_stock,
+            **{field:getattr(existing_product, field) for field in PRODUCT_ADMIN_FIELDS if field!='category'},
             'category':existing_product_category.title,
-            'discount_percentage':str(existing_product.discount_percentage),
-            'created_at':existing_product.created_at.isoformat(),
-            'weight':float(existing_product.weight) if existing_product.weight is not None else None,
-            'height':float(existing_product.height) if existing_product.height is not None else None,
-            'length':float(existing_product.length) if existing_product.length is not None else None,
-            'width':float(existing_product.width) if existing_product.width is not None else None,
-            'images':existing_images_list,
-            'status':existing_product.status,
-            'taxcode':existing_product.taxcode,
-            'average_stars':existing_product.average_stars,
-            'total_stars':existing_product.total_stars
-            
+            'images':existing_images_list
         }
-        return JSONResponse(status_code=status.HTTP_200_OK,content={'message':'Product successfully updated', 'updated_product':product_updated})
+        return ORJSONResponse(status_code=status.HTTP_200_OK,content={'message':'Product successfully updated', 'updated_product':product_updated})
     except SQLAlchemyError:
-        session.rollback()
+        await session.rollback()
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="An error occurred while updating the product.")
     
 @router.delete('/delete_product/{product_id}',tags=['products_admins'])
@@ -178,22 +252,23 @@ async def delete_product(
     x_csrf_token:Annotated[str,Header(...,description='"X-CSRF-Token')],
     product_id:int,
     session:SessionDB
-    )->JSONResponse:    
+    )->ORJSONResponse:    
     await csrf_protect.validate_csrf(request)
     if not admin:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,detail='Not enough permissions')
-    existing_product=session.query(Products).filter(Products.id==product_id).first()
+    existing_product=(await session.execute(select(Products).filter(Products.id==product_id))).scalars().first()
     if not existing_product:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,detail='Product does not exist')
-    #existing_reservation=session.query(Reservations).filter(Reservations.product_id==product_id).first()
+    #existing_reservation=(await session.execute(select(Reservations).filter(Reservations.product_id==product_id))).scalars().first()
     #if existing_reservation:
     #    raise HTTPException(status_code=status.HTTP_409_CONFLICT,detail='Product cannot be modified because there are reservations of the product')
     try:
         existing_product.status='deleted'
-        session.commit()
-        return JSONResponse(status_code=status.HTTP_200_OK, content={'message':'Product successfully deleted'})
+        await session.commit()
+        await invalidate_product_cache(product_id)
+        return ORJSONResponse(status_code=status.HTTP_200_OK, content={'message':'Product successfully deleted'})
     except SQLAlchemyError:
-        session.rollback()
+        await session.rollback()
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="An error occurred while deleting the product.")
   
       
@@ -203,27 +278,27 @@ async def get_products_admins(
     admin: Annotated[bool, Depends(is_admin)],
     csrf_protect:Annotated[CsrfProtect, Depends()],
     x_csrf_token:Annotated[str,Header(...,description='"X-CSRF-Token')],
-    session:SessionDB,
+    session:ReadOnlySessionDB,
     products_params: ProductsInventoryParams,
     page:int|None=1,
     limit:int|None=10,
-    )->JSONResponse:
+    cursor:str|None=None,
+    )->ORJSONResponse:
     await csrf_protect.validate_csrf(request)
     if not admin:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,detail='Not enough permissions')
     try:
-        query=session.query(Products)
-        
-        products_found=[]
+        query=select(Products)
         
+        relevance=None
         if products_params.query_title:
-            query=query.filter(Products.title.ilike(f"%{products_params.query_title}%"))
+            query, relevance=await apply_product_search(session, query, products_params.query_title)
             
         if products_params.category:
-            category=session.query(Categories).filter(Categories.title==products_params.category).first()
-            if not category:
+            category_id=await get_category_id(session, products_params.category)
+            if not category_id:
                 raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='The category does not exist')
-            query=query.filter(Products.category_id==category.id)
+            query=query.filter(Products.category_id==category_id)
                 
         
         if products_params.status:
@@ -292,98 +367,11 @@ async def get_products_admins(
         if products_params.max_total_stars is not None:
             query=query.filter(Products.total_stars<=products_params.max_total_stars)
             
-        if products_params.sort_by==ProductsSortBy.price_asc:
-            query=query.order_by(Products.price.asc())
-            
-        elif products_params.sort_by==ProductsSortBy.price_desc:
-            query=query.order_by(Products.price.desc())
-            
-        elif products_params.sort_by==ProductsSortBy.stock_asc:
-            query=query.order_by(Products.stock.asc())
-            
-        elif products_params.sort_by==ProductsSortBy.stock_desc:
-            query=query.order_by(Products.stock.desc())
-            
-        elif products_params.sort_by==ProductsSortBy.discount_percentage_asc:
-            query=query.order_by(Products.discount_percentage.asc())
-            
-        elif products_params.sort_by==ProductsSortBy.discount_percentage_desc:
-            query=query.order_by(Products.discount_percentage.desc())
+        products, next_cursor=await paginate_products(session, load_product_relations(query, images=False), products_params.sort_by, page, limit, cursor, relevance=relevance)
         
-        elif products_params.sort_by==ProductsSortBy.date_asc:
-            query=query.order_by(Products.created_at.asc())
-            
-        elif products_params.sort_by==ProductsSortBy.date_desc:
-            query=query.order_by(Products.created_at.desc())  
-        
-        elif products_params.sort_by==ProductsSortBy.weight_asc:
-            query=query.order_by(Products.weight.asc())
-            
-        elif products_params.sort_by==ProductsSortBy.weight_desc:
-            query=query.order_by(Products.weight.desc())  
-            
-        elif products_params.sort_by==ProductsSortBy.height_asc:
-            query=query.order_by(Products.height.asc())
-            
-        elif products_params.sort_by==ProductsSortBy.height_desc:
-            query=query.order_by(Products.height.desc())  
-            
-        elif products_params.sort_by==ProductsSortBy.length_asc:
-            query=query.order_by(Products.length.asc())
-            
-        elif products_params.sort_by==ProductsSortBy.length_desc:
-            query=query.order_by(Products.length.desc())
-            
-        elif products_params.sort_by==ProductsSortBy.width_asc:
-            query=query.order_by(Products.width.asc())
-            
-        elif products_params.sort_by==ProductsSortBy.width_desc:
-            query=query.order_by(Products.width.desc())
-            
-        elif products_params.sort_by==ProductsSortBy.average_stars_asc:
-            query=query.order_by(Products.average_stars.asc())
-            
-        elif products_params.sort_by==ProductsSortBy.average_stars_desc:
-            query=query.order_by(Products.average_stars.desc())
-            
-        elif products_params.sort_by==ProductsSortBy.total_stars_asc:
-            query=query.order_by(Products.total_stars.asc())
-            
-        elif products_params.sort_by==ProductsSortBy.total_stars_desc:
-            query=query.order_by(Products.total_stars.desc())
-            
-        offset=(page-1)*limit
-        query=query.offset(offset).limit(limit)    
-        
-        products=query.all()
-        
-        for product in products:
-            
-                category_db=session.query(Categories).filter(Categories.id==product.category_id).first()
-            
-                product_found={
-                    'id':product.id,
-                    'title':product.title,
-                    'description':product.description,
-                    'price':str(product.price) if product.price is not None else None,
-                    'stock':product.stock,
-                    'reserve_stock': product.reserve_stock,
-                    'available_stock':product.available_stock,
-                    'category':category_db.title,
-                    'discount_percentage':str(product.discount_percentage) if product.discount_percentage is not None else None,
-                    'created_at':product.created_at.isoformat(),
-                    'weight':float(product.weight) if product.weight is not None else None,
-                    'height':float(product.height) if product.height is not None else None,
-                    'length':float(product.length) if product.length is not None else None,
-                    'width':float(product.width) if product.width is not None else None,
-                    'status':product.status,
-                    'taxcode':product.taxcode,
-                    'average_stars':product.average_stars,
-                    'total_stars':product.total_stars
-                    }
-                products_found.append(product_found)
+        products_found=[product_fields(product, PRODUCT_ADMIN_FIELDS) for product in products]
                 
-        return JSONResponse(status_code=status.HTTP_200_OK,content={'products':products_found, 'page':page,'limit':limit})
+        return ORJSONResponse(status_code=status.HTTP_200_OK,content={'products':products_found, 'page':page,'limit':limit, 'next_cursor':next_cursor})
     except SQLAlchemyError:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,detail='An error occurred while getting the products.')
         
@@ -395,48 +383,22 @@ async def get_product_admins(
     admin: Annotated[bool, Depends(is_admin)],
     csrf_protect:Annotated[CsrfProtect, Depends()],
     x_csrf_token:Annotated[str,Header(...,description='"X-CSRF-Token')],
-    session:SessionDB,
+    session:ReadOnlySessionDB,
     product_id:int
-    )->JSONResponse:
+    )->ORJSONResponse:
     await csrf_protect.validate_csrf(request)
     if not admin:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,detail='Not enough permissions')
-    existing_product=session.query(Products).filter(Products.id==product_id).first()
+    existing_product=(await session.execute(select(Products).filter(Products.id==product_id))).scalars().first()
     if not existing_product:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,detail='Product does not exist')
     try:
-        product_db=session.query(Products).filter(Products.id==product_id).first()
-        product_category_db=session.query(Categories).filter(Categories.id==product_db.category_id).first()
-        product_images_db=session.query(product_images).filter(product_images.product_id==product_id).all()
-        product_images_list=[]
-        for image_db in product_images_db:
-            image_db_dict={
-                'id':image_db.id,
-                'product_id':image_db.product_id,
-                'image_url':image_db.image_url,
-                'is_main':image_db.is_main
-            }
-            product_images_list.append(image_db_dict)
+        product_db=(await session.execute(load_product_relations(select(Products).filter(Products.id==product_id)))).scalars().first()
         product_response={
-            'id':product_db.id,
-            'title':product_db.title,
-            'description':product_db.description,
-            'price':str(product_db.price) if product_db.price is not None else None,
-            'stock':product_db.stock,
-            'category':product_category_db.title,
-            'discount_percentage':str(product_db.discount_percentage) if product_db.price is not None else None,
-            'created_at':product_db.created_at.isoformat(),
-            'weight':float(product_db.weight) if product_db.price is not None else None,
-            'height':float(product_db.height) if product_db.price is not None else None,
-            'length':float(product_db.length) if product_db.price is not None else None,
-            'width':float(product_db.width) if product_db.price is not None else None,
-            'status':product_db.status,
-            'images':product_images_list,
-            'taxcode':product_db.taxcode,
-            'average_stars':product_db.average_stars,
-            'total_stars':product_db.total_stars
+            **product_fields(product_db, PRODUCT_ADMIN_FIELDS),
+            'images':product_images_response(product_db)
         }
-        return JSONResponse(status_code=status.HTTP_200_OK, content={'product':product_response})
+        return ORJSONResponse(status_code=status.HTTP_200_OK, content={'product':product_response})
     except SQLAlchemyError:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail='An error occurred while getting the product')
 
@@ -449,166 +411,83 @@ async def get_product_admins(
 @router.get('/get_products',tags=['products'])
 async def get_products(
     request:Request,
-    session:SessionDB,
+    session:ReadOnlySessionDB,
     page:int|None=1,
     limit:int|None=10,
-    )->JSONResponse:
+    cursor:str|None=None,
+    )->ORJSONResponse:
+    cache_key=('get_products', page, limit, cursor)
+    cached_content=await catalog_cache.get(cache_key)
+    if cached_content is not None:
+        return ORJSONResponse(status_code=status.HTTP_200_OK, content=cached_content)
     try:
-        offset=(page-1)*limit
-        products_db=session.query(Products).filter(Products.status!='deleted').order_by(Products.created_at.desc()).offset(offset).limit(limit).all()
-        products_response=[]
-        for product_db in products_db:
-            is_stock=get_stock(product_db)
-            product_category_db=session.query(Categories).filter(Categories.id==product_db.category_id).first()
-            product_images_db=session.query(product_images).filter(product_images.product_id==product_db.id).all()
-            product_images_list=[]
-            for image_db in product_images_db:
-                image_db_dict={
-                    'id':image_db.id,
-                    'product_id':image_db.product_id,
-                    'image_url':image_db.image_url,
-                    'is_main':image_db.is_main
-                }
-                product_images_list.append(image_db_dict)
-            product_response={
-                'id':product_db.id,
-                'title':product_db.title,
-                'description':product_db.description,
-                'price':str(product_db.price) if product_db.price is not None else None,
-                'is_there_stock':is_stock,
-                'category':product_category_db.title,
-                'discount_percentage':str(product_db.discount_percentage) if product_db.price is not None else None,
-                'weight':float(product_db.weight) if product_db.price is not None else None,
-                'height':float(product_db.height) if product_db.price is not None else None,
-                'length':float(product_db.length) if product_db.price is not None else None,
-                'width':float(product_db.width) if product_db.price is not None else None,
-                'status':product_db.status,
-                'images':product_images_list,
-                'average_stars':product_db.average_stars,
-                'total_stars':product_db.total_stars
-            }
-            products_response.append(product_response)
-                
-        return JSONResponse(status_code=status.HTTP_200_OK, content={'products':products_response})
+        #literal so prepared (generic) plans can still use the partial ix_products_created_at_not_deleted
+        query=select(Products).filter(Products.status!=literal_column("'deleted'"))
+        products_db, next_cursor=await paginate_products(session, load_product_relations(query), None, page, limit, cursor, default_sort=(Products.created_at,False))
+        content={'products':[product_listing_response(product_db) for product_db in products_db], 'next_cursor':next_cursor}
+        if is_fresh_read(session):
+            await catalog_cache.set(cache_key, content)
+        return ORJSONResponse(status_code=status.HTTP_200_OK, content=content)
     except SQLAlchemyError:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail='An error ocurred while getting the products')
 
 @router.get('/get_product/{product_id}',tags=['products'])
 async def get_product(
-    user:Annotated[User, Depends(get_current_active_user_custom)],
+    user:Annotated[UserIdentity, Depends(get_current_active_user_custom)],
     request:Request,
-    session:SessionDB,
+    session:ReadOnlySessionDB,
     product_id:int
-    )->JSONResponse:
-    existing_product=session.query(Products).filter(Products.id==product_id,Products.status!='deleted').first()
-    if not existing_product:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,detail='Product does not exist')
+    )->ORJSONResponse:
+    cache_key=('get_product', product_id)
+    product_response=await catalog_cache.get(cache_key)
+    if product_response is None:
+        existing_product=(await session.execute(load_product_relations(select(Products).filter(Products.id==product_id,Products.status!='deleted')))).scalars().first()
+        if not existing_product:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,detail='Product does not exist')
+        try:
+            #only the newest reviews, the rest are paged with reviews_next_cursor through /reviews/get_product_reviews
+            reviews_product, reviews_next_cursor=await product_reviews_page(session, product_id, PRODUCT_REVIEWS_PREVIEW, '')
+            reviews_count=await count_product_reviews(session, product_id)
+            #live from product_rating_stats, the listings use the copy in products
+            rating_stats=await get_rating_stats(session, product_id)
+            product_response={
+                **product_fields(existing_product, PRODUCT_FIELDS),
+                'is_there_stock':get_stock(existing_product),
+                'images':product_images_response(existing_product),
+                **rating_stats,
+                'reviews_count':reviews_count,
+                'reviews':reviews_product,
+                'reviews_next_cursor':reviews_next_cursor
+            }
+            if is_fresh_read(session):
+                await catalog_cache.set(cache_key, product_response)
+        except SQLAlchemyError:
+            raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail='An error occurred while getting the product')
     try:
+        #per-user fields are layered on top of the shared (cached) product
         product_in_wishlist=None
         my_review_in_product=None
         if user:
-            product_in_wishlist=in_wishlist(session, user.id, product_id)
-            my_review_in_product=exists_review(session, user.id, product_id)
-        
-        is_stock=get_stock(existing_product)
-        product_category_db=session.query(Categories).filter(Categories.id==existing_product.category_id).first()
-        product_images_db=session.query(product_images).filter(product_images.product_id==product_id).all()
-        product_images_list=[]
-        for image_db in product_images_db:
-            image_db_dict={
-                'id':image_db.id,
-                'product_id':image_db.product_id,
-                'image_url':image_db.image_url,
-                'is_main':image_db.is_main
-            }
-            product_images_list.append(image_db_dict)
-        reviews_product=[]
-        reviews_product_db=session.query(Reviews).filter(Reviews.product_id==product_id).all()
-        for review_product_db in reviews_product_db:
-            
-            review_user=session.query(Users).filter(Users.id==review_product_db.user_id).first()
-            
-            reviews_product.append({
-                'id':review_product_db.id,
-                'product_id':review_product_db.product_id,
-                'user_id':review_product_db.user_id,
-                'review_text':review_product_db.review_text,
-                'created_at':review_product_db.created_at.isoformat(),
-                'edited':review_product_db.edited,
-                'review_user_username':review_user.username
-            })
-            
-            
-        product_response={
-            'id':existing_product.id,
-            'title':existing_product.title,
-            'description':existing_product.description,
-            'price':str(existing_product.price) if existing_product.price is not None else None,
-            'is_there_stock':is_stock,
-            'category':product_category_db.title,
-            'discount_percentage':str(existing_product.discount_percentage) if existing_product.price is not None else None,
-            'weight':float(existing_product.weight) if existing_product.price is not None else None,
-            'height':float(existing_product.height) if existing_product.price is not None else None,
-            'length':float(existing_product.length) if existing_product.price is not None else None,
-            'width':float(existing_product.width) if existing_product.price is not None else None,
-            'status':existing_product.status,
-            'images':product_images_list,
-            'average_stars':existing_product.average_stars,
-            'total_stars':existing_product.total_stars,
-            'in_wishlist':product_in_wishlist,
-            'my_review_in_product':my_review_in_product,
-            'reviews':reviews_product
-        }
-        return JSONResponse(status_code=status.HTTP_200_OK, content={'product':product_response})
+            product_in_wishlist=await in_wishlist(session, user.id, product_id)
+            my_review_in_product=await exists_review(session, user.id, product_id)
+        return ORJSONResponse(status_code=status.HTTP_200_OK, content={'product':{**product_response, 'in_wishlist':product_in_wishlist, 'my_review_in_product':my_review_in_product}})
     except SQLAlchemyError:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail='An error occurred while getting the product')
 
 @router.get('/get_my_wishlist/', tags=['wishlists'])
 async def get_my_wishlist(
     request:Request,
-    user: Annotated[User, Depends(get_current_active_user)],
-    session:SessionDB,
+    user: Annotated[UserIdentity, Depends(get_current_active_user)],
+    session:ReadOnlySessionDB,
     page:int|None=1,
-    limit:int|None=10
-)->JSONResponse:
+    limit:int|None=10,
+    cursor:str|None=None
+)->ORJSONResponse:
     try:
-        products_found=[]
-        
-        offset=(page-1)*limit
-        wishlist_products_db=session.query(Wishlist).filter(Wishlist.user_id==user.id).offset(offset).limit(limit).all()
-        for wishlist_product in wishlist_products_db:
-            product_db=session.query(Products).filter(Products.id==wishlist_product.product_id).first()
-            is_stock=get_stock(product_db)
-            product_category_db=session.query(Categories).filter(Categories.id==product_db.category_id).first()
-            product_images_db=session.query(product_images).filter(product_images.product_id==product_db.id).all()
-            product_images_list=[]
-            for image_db in product_images_db:
-                image_db_dict={
-                    'id':image_db.id,
-                    'product_id':image_db.product_id,
-                    'image_url':image_db.image_url,
-                    'is_main':image_db.is_main
-                }
-                product_images_list.append(image_db_dict)
-            product_response={
-                'id':product_db.id,
-                'title':product_db.title,
-                'description':product_db.description,
-                'price':str(product_db.price) if product_db.price is not None else None,
-                'is_there_stock':is_stock,
-                'category':product_category_db.title,
-                'discount_percentage':str(product_db.discount_percentage) if product_db.price is not None else None,
-                'weight':float(product_db.weight) if product_db.price is not None else None,
-                'height':float(product_db.height) if product_db.price is not None else None,
-                'length':float(product_db.length) if product_db.price is not None else None,
-                'width':float(product_db.width) if product_db.price is not None else None,
-                'status':product_db.status,
-                'images':product_images_list,
-                'average_stars':product_db.average_stars,
-                'total_stars':product_db.total_stars
-            }
-            products_found.append(product_response)
-        return JSONResponse(status_code=status.HTTP_200_OK, content={'message':'Products from wishlist successfully found', 'products':products_found})
+        query=select(Products, Wishlist.id).join(Wishlist, Wishlist.product_id==Products.id).filter(Wishlist.user_id==user.id)
+        wishlist_rows, next_cursor=await paginate(session, load_product_relations(query), page, limit, cursor, 'wishlist', Wishlist.id, Wishlist.id, row_values=lambda row:(row[1], row[1]))
+        products_found=[product_listing_response(product_db) for product_db, wishlist_id in wishlist_rows]
+        return ORJSONResponse(status_code=status.HTTP_200_OK, content={'message':'Products from wishlist successfully found', 'products':products_found, 'next_cursor':next_cursor})
             
     except SQLAlchemyError:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail='An error occurred when getting the products from your wishlist.')   
@@ -617,24 +496,24 @@ async def get_my_wishlist(
 @router.post('/get_products_search',tags=['products'])
 async def get_products_search(
     request:Request,
-    session:SessionDB,
+    session:ReadOnlySessionDB,
     products_params: ProductsSearchUser,
     page:int|None=1,
     limit:int|None=10,
-    )->JSONResponse:
+    cursor:str|None=None,
+    )->ORJSONResponse:
     try:
-        query=session.query(Products)
-        
-        products_found=[]
+        query=select(Products)
         
+        relevance=None
         if products_params.query_title:
-            query=query.filter(Products.title.ilike(f"%{products_params.query_title}%"))
+            query, relevance=await apply_product_search(session, query, products_params.query_title)
             
         if products_params.category:
-            category=session.query(Categories).filter(Categories.title==products_params.category).first()
-            if not category:
+            category_id=await get_category_id(session, products_params.category)
+            if not category_id:
                 raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='The category does not exist')
-            query=query.filter(Products.category_id==category.id)
+            query=query.filter(Products.category_id==category_id)
             
         if products_params.status:
             if products_params.status=='deleted':
@@ -690,96 +569,11 @@ async def get_products_search(
         if products_params.max_total_stars is not None:
             query=query.filter(Products.total_stars<=products_params.max_total_stars)    
             
-        if products_params.sort_by==ProductsSortBy.price_asc:
-            query=query.order_by(Products.price.asc())
-            
-        elif products_params.sort_by==ProductsSortBy.price_desc:
-            query=query.order_by(Products.price.desc())
-            
-        elif products_params.sort_by==ProductsSortBy.discount_percentage_asc:
-            query=query.order_by(Products.discount_percentage.asc())
-            
-        elif products_params.sort_by==ProductsSortBy.discount_percentage_desc:
-            query=query.order_by(Products.discount_percentage.desc())
-        
-        elif products_params.sort_by==ProductsSortBy.weight_asc:
-            query=query.order_by(Products.weight.asc())
-            
-        elif products_params.sort_by==ProductsSortBy.weight_desc:
-            query=query.order_by(Products.weight.desc())  
-            
-        elif products_params.sort_by==ProductsSortBy.height_asc:
-            query=query.order_by(Products.height.asc())
-            
-        elif products_params.sort_by==ProductsSortBy.height_desc:
-            query=query.order_by(Products.height.desc())  
-            
-        elif products_params.sort_by==ProductsSortBy.length_asc:
-            query=query.order_by(Products.length.asc())
-            
-        elif products_params.sort_by==ProductsSortBy.length_desc:
-            query=query.order_by(Products.length.desc())
-            
-        elif products_params.sort_by==ProductsSortBy.width_asc:
-            query=query.order_by(Products.width.asc())
-            
-        elif products_params.sort_by==ProductsSortBy.width_desc:
-            query=query.order_by(Products.width.desc())
-            
-        elif products_params.sort_by==ProductsSortBy.average_stars_asc:
-            query=query.order_by(Products.average_stars.asc())
-            
-        elif products_params.sort_by==ProductsSortBy.average_stars_desc:
-            query=query.order_by(Products.average_stars.desc())
-            
-        elif products_params.sort_by==ProductsSortBy.total_stars_asc:
-            query=query.order_by(Products.total_stars.asc())
-            
-        elif products_params.sort_by==ProductsSortBy.total_stars_desc:
-            query=query.order_by(Products.total_stars.desc())
-            
-        
-        
-        offset=(page-1)*limit
-        query=query.offset(offset).limit(limit)    
-        
-        products=query.all()
+        products, next_cursor=await paginate_products(session, load_product_relations(query), products_params.sort_by, page, limit, cursor, relevance=relevance)
         
-        for product in products:
-            
-                category_db=session.query(Categories).filter(Categories.id==product.category_id).first()
-                is_stock=get_stock(product)
-                product_images_db=session.query(product_images).filter(product_images.product_id==product.id).all()
-                product_images_list=[]
-                for image_db in product_images_db:
-                    image_db_dict={
-                        'id':image_db.id,
-                        'product_id':image_db.product_id,
-                        'image_url':image_db.image_url,
-                        'is_main':image_db.is_main
-                    }
-                    product_images_list.append(image_db_dict)
-            
-                product_found={
-                    'id':product.id,
-                    'title':product.title,
-                    'description':product.description,
-                    'price':str(product.price) if product.price is not None else None,
-                    'stock':is_stock,
-                    'category':category_db.title,
-                    'discount_percentage':str(product.discount_percentage) if product.discount_percentage is not None else None,
-                    'weight':float(product.weight) if product.weight is not None else None,
-                    'height':float(product.height) if product.height is not None else None,
-                    'length':float(product.length) if product.length is not None else None,
-                    'width':float(product.width) if product.width is not None else None,
-                    'status':product.status,
-                    'images':product_images_list,
-                    'average_stars':product.average_stars,
-                    'total_stars':product.total_stars
-                    }
-                products_found.append(product_found)
+        products_found=[product_listing_response(product, stock_field='stock') for product in products]
                 
-        return JSONResponse(status_code=status.HTTP_200_OK,content={'products':products_found, 'page':page,'limit':limit})
+        return ORJSONResponse(status_code=status.HTTP_200_OK,content={'products':products_found, 'page':page,'limit':limit, 'next_cursor':next_cursor})
     except SQLAlchemyError:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,detail='An error occurred while getting the products.')
         
\ No newline at end of file
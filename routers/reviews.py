@@ -1,10 +1,10 @@
 from fastapi import APIRouter, HTTPException,status, Request, Depends, Header
-from fastapi.responses import JSONResponse
+from utils.responses import ORJSONResponse
 from typing import Annotated
-from dependencies.database import SessionDB
+from dependencies.database import SessionDB, ReadOnlySessionDB
 from fastapi_csrf_protect import CsrfProtect
 from routers.users import get_current_active_user, is_admin
-from schemas.users import User
+from schemas.users import UserIdentity
 from models.products import Products, product_images
 from sqlalchemy.exc import SQLAlchemyError
 from decimal import Decimal, ROUND_HALF_UP
@@ -12,39 +12,57 @@ from datetime import datetime, timedelta, timezone
 from models.orders import Orders, OrderItems, OrderStatus
 from models.users import ShippingAddresses, Users
 import pytz 
-from sqlalchemy import update, select, delete, exists
+from sqlalchemy import update, select, delete, exists, func
 from models.reviews import Reviews
 from schemas.reviews import Review
+from cache import catalog_cache
+from utils.pagination import paginate
+from config import PRODUCT_REVIEWS_MAX_LIMIT
 
 router=APIRouter(prefix='/reviews')
 
+#PRODUCT REVIEWS
+#newest first, keyset paginated on the review id (ix_reviews_product_id_id) with the username joined in the same query
+
+async def count_product_reviews(session, product_id:int):
+    return (await session.execute(select(func.count()).select_from(Reviews).filter(Reviews.product_id==product_id))).scalar()
+
+async def product_reviews_page(session, product_id:int, limit:int, cursor:str):
+    query=select(Reviews.id, Reviews.product_id, Reviews.user_id, Reviews.review_text, Reviews.created_at, Reviews.edited, Users.username.label('review_user_username')).join(Users, Users.id==Reviews.user_id).filter(Reviews.product_id==product_id)
+    review_rows, next_cursor=await paginate(session, query, 1, limit, cursor, 'reviews', Reviews.id, None, False)
+    #the rows serialize as objects keyed by the column names and labels
+    return review_rows, next_cursor
+
 
 @router.post('/add_review',tags=['reviews'])
 async def add_review(
     request:Request,
-    user: Annotated[User, Depends(get_current_active_user)],
+    user: Annotated[UserIdentity, Depends(get_current_active_user)],
     csrf_protect:Annotated[CsrfProtect, Depends()],
     x_csrf_token:Annotated[str,Header(...,description='"X-CSRF-Token')],
     session:SessionDB,
     review:Review
-    )->JSONResponse:
+    )->ORJSONResponse:
     await csrf_protect.validate_csrf(request)
-    product_db=session.query(Products).filter(Products.id==review.product_id).with_for_update().first()
+    #the product row is not locked, reviews only touch reviews (checkout updates the products row)
+    product_db=(await session.execute(select(Products.id).filter(Products.id==review.product_id))).first()
     if not product_db:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='The product was not found.')
-    existing_order=session.query(
+    existing_order=(await session.execute(select(
             exists().where(
                 Orders.user_id == user.id,
                 Orders.status == 'delivered',
                 OrderItems.order_id == Orders.id,
                 OrderItems.product_id == review.product_id
             )
-        ).scalar()
+        ))).scalar()
     if not existing_order:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='You cannot add a review to this product because you have not made a delivered order for it.')
     try: #handle case where stars is null
-        
-        existing_review_db=session.query(Reviews).filter(Reviews.product_id==review.product_id, Reviews.user_id==user.id).first()
+        if session.bind.dialect.name=='postgresql':
+            #serializes the reviews of one user on one product, so two concurrent first reviews cannot both be inserted
+            await session.execute(select(func.pg_advisory_xact_lock(review.product_id, user.id)))
+        existing_review_db=(await session.execute(select(Reviews).filter(Reviews.product_id==review.product_id, Reviews.user_id==user.id))).scalars().first()
         if existing_review_db: #update the rating
             existing_review_db.review_text=review.review_text
             existing_review_db.edited=True
@@ -52,42 +70,65 @@ async def add_review(
         else:
             new_review_db=Reviews(product_id=review.product_id, user_id=user.id, review_text=review.review_text, edited=False)
             session.add(new_review_db)
-        session.commit()
-        return JSONResponse(status_code=status.HTTP_201_CREATED,content={'message':'Review added to product successfully successfully.'})
+        await session.commit()
+        await catalog_cache.delete(('get_product', review.product_id))
+        return ORJSONResponse(status_code=status.HTTP_201_CREATED,content={'message':'Review added to product successfully successfully.'})
     except SQLAlchemyError:
-        session.rollback()
+        await session.rollback()
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail='An error occurred while adding the review to the product.')
     
 @router.delete('/remove_review/{product_id}', tags=['reviews'])
 async def remove_review(
     request:Request,
-    user: Annotated[User, Depends(get_current_active_user)],
+    user: Annotated[UserIdentity, Depends(get_current_active_user)],
     csrf_protect:Annotated[CsrfProtect, Depends()],
     x_csrf_token:Annotated[str,Header(...,description='"X-CSRF-Token')],
     session:SessionDB,
     product_id:int
-    )->JSONResponse:
+    )->ORJSONResponse:
     await csrf_protect.validate_csrf(request)
-    product_db=session.query(Products).filter(Products.id==product_id).with_for_update().first()
+    #the product row is not locked, reviews only touch reviews (checkout updates the products row)
+    product_db=(await session.execute(select(Products.id).filter(Products.id==product_id))).first()
     if not product_db:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='The product was not found.')
-    existing_order=session.query(
+    existing_order=(await session.execute(select(
             exists().where(
                 Orders.user_id == user.id,
                 Orders.status == 'delivered',
                 OrderItems.order_id == Orders.id,
                 OrderItems.product_id == product_id
             )
-        ).scalar()
+        ))).scalar()
     if not existing_order:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='You cannot add a review to this product because you have not made a delivered order for it.')
-    existing_review_db=session.query(Reviews).filter(Reviews.product_id==product_id, Reviews.user_id==user.id).first()
+    if session.bind.dialect.name=='postgresql':
+        #the same lock as add_review, a concurrent edit of this review finishes before it is removed
+        await session.execute(select(func.pg_advisory_xact_lock(product_id, user.id)))
+    existing_review_db=(await session.execute(select(Reviews).filter(Reviews.product_id==product_id, Reviews.user_id==user.id))).scalars().first()
     if not existing_review_db:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='The review was not found.')
     try:
-        session.delete(existing_review_db)
-        session.commit()
-        return JSONResponse(status_code=status.HTTP_200_OK, content={'message':'The review was successfully removed from the product.'})
+        await session.delete(existing_review_db)
+        await session.commit()
+        await catalog_cache.delete(('get_product', product_id))
+        return ORJSONResponse(status_code=status.HTTP_200_OK, content={'message':'The review was successfully removed from the product.'})
         
     except SQLAlchemyError:
-        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail='An error occurred while removing the review from the product.')
\ No newline at end of file
+        await session.rollback()
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail='An error occurred while removing the review from the product.')
+
+@router.get('/get_product_reviews/{product_id}', tags=['reviews'])
+async def get_product_reviews(
+    request:Request,
+    session:ReadOnlySessionDB,
+    product_id:int,
+    limit:int|None=10,
+    cursor:str|None=''
+    )->ORJSONResponse:
+    #an empty cursor is the first page, next_cursor is None on the last one
+    limit=max(1, min(limit or 10, PRODUCT_REVIEWS_MAX_LIMIT))
+    try:
+        reviews, next_cursor=await product_reviews_page(session, product_id, limit, cursor or '')
+        return ORJSONResponse(status_code=status.HTTP_200_OK, content={'reviews':reviews, 'limit':limit, 'next_cursor':next_cursor})
+    except SQLAlchemyError:
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail='An error occurred while getting the reviews of the product.')
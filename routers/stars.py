@@ -1,10 +1,10 @@
 from fastapi import APIRouter, HTTPException,status, Request, Depends, Header
-from fastapi.responses import JSONResponse
+from utils.responses import ORJSONResponse
 from typing import Annotated
 from dependencies.database import SessionDB
 from fastapi_csrf_protect import CsrfProtect
 from routers.users import get_current_active_user, is_admin
-from schemas.users import User
+from schemas.users import UserIdentity
 from models.products import Products, product_images
 from sqlalchemy.exc import SQLAlchemyError
 from decimal import Decimal, ROUND_HALF_UP
@@ -12,9 +12,11 @@ from datetime import datetime, timedelta, timezone
 from models.orders import Orders, OrderItems, OrderStatus
 from models.users import ShippingAddresses, Users
 import pytz 
-from sqlalchemy import update, select, delete, exists
+from sqlalchemy import update, select, delete, exists, func
 from models.stars import Stars
 from schemas.stars import Star
+from cache import catalog_cache
+from services.rating_stats import apply_rating
 
 router=APIRouter(prefix='/stars')
 
@@ -22,44 +24,46 @@ router=APIRouter(prefix='/stars')
 @router.post('/rate_stars',tags=['stars'])
 async def rate_stars(
     request:Request,
-    user: Annotated[User, Depends(get_current_active_user)],
+    user: Annotated[UserIdentity, Depends(get_current_active_user)],
     csrf_protect:Annotated[CsrfProtect, Depends()],
     x_csrf_token:Annotated[str,Header(...,description='"X-CSRF-Token')],
     session:SessionDB,
     star:Star
-    )->JSONResponse:
+    )->ORJSONResponse:
     await csrf_protect.validate_csrf(request)
-    product_db=session.query(Products).filter(Products.id==star.product_id).with_for_update().first()
+    #the product row is not locked, ratings only touch stars and product_rating_stats
+    product_db=(await session.execute(select(Products.id).filter(Products.id==star.product_id))).first()
     if not product_db:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='The product was not found.')
-    existing_order=session.query(
+    existing_order=(await session.execute(select(
             exists().where(
                 Orders.user_id == user.id,
                 Orders.status == 'delivered',
                 OrderItems.order_id == Orders.id,
                 OrderItems.product_id == star.product_id
             )
-        ).scalar()
+        ))).scalar()
     if not existing_order:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='You cannot rate this product because you have not made a delivered order for it.')
-    try: #handle case where stars is null
-        
-        existing_star_db=session.query(Stars).filter(Stars.product_id==star.product_id, Stars.user_id==user.id).first()
+    try:
+        if session.bind.dialect.name=='postgresql':
+            #serializes the ratings of one user on one product, so two concurrent first ratings cannot both be inserted
+            await session.execute(select(func.pg_advisory_xact_lock(star.product_id, user.id)))
+        existing_star_db=(await session.execute(select(Stars).filter(Stars.product_id==star.product_id, Stars.user_id==user.id))).scalars().first()
+        #the stats row is updated before stars so the reconciler, which locks it first, never counts half a rating
+        await apply_rating(session, star.product_id, existing_star_db.stars_number if existing_star_db else None, star.stars_number)
         if existing_star_db: #update the rating
-            product_db.average_stars=((product_db.average_stars*product_db.total_stars)+(star.stars_number-existing_star_db.stars_number))/product_db.total_stars
-            
             existing_star_db.stars_number=star.stars_number
         else:
-            product_db.average_stars=((product_db.average_stars*product_db.total_stars)+star.stars_number)/(product_db.total_stars+1)
-            product_db.total_stars+=1
-            
             new_star_db=Stars(product_id=star.product_id, user_id=user.id, stars_number=star.stars_number)
             session.add(new_star_db)
         
-        session.commit()
-        return JSONResponse(status_code=status.HTTP_201_CREATED,content={'message':'Product rated successfully.'})
+        await session.commit()
+        #listings keep the copied average until the reconciler refreshes it
+        await catalog_cache.delete(('get_product', star.product_id))
+        return ORJSONResponse(status_code=status.HTTP_201_CREATED,content={'message':'Product rated successfully.'})
     except SQLAlchemyError:
-        session.rollback()
+        await session.rollback()
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail='An error occurred while rating the product')
     
     
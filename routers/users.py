@@ -1,43 +1,41 @@
-from fastapi import APIRouter, Depends, Request, HTTPException, status, Response
+from fastapi import APIRouter, Depends, Request, HTTPException, status, Response, Header
 from fastapi_csrf_protect import CsrfProtect
 from fastapi_csrf_protect.exceptions import CsrfProtectError
-from passlib.context import CryptContext
+from services.passwords import pwd_context, password_hasher
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from typing import Annotated
-from sqlalchemy.orm import Session
+from sqlalchemy import select
 from dependencies.database import SessionDB
 from datetime import datetime, timedelta, timezone
-from config import ACCESS_TOKEN_EXPIRE_MINUTES, ALGORITHM, REFRESH_TOKEN_EXPIRE_DAYS, SECRET_KEY, STRIPE_SECRET_KEY
-from schemas.users import UserSignUp,User,UserDB
+from config import ACCESS_TOKEN_EXPIRE_MINUTES, ALGORITHM, REFRESH_TOKEN_EXPIRE_DAYS, SECRET_KEY, USER_CACHE_TTL_SECONDS
+from schemas.users import UserSignUp,User,UserDB,UserAccountUpdate,UserIdentity
 from schemas.security import Token,TokenData,CsrfSettings
-from fastapi.responses import JSONResponse
+from utils.responses import ORJSONResponse
 import jwt
 from jwt.exceptions import ExpiredSignatureError, InvalidTokenError
 from models.users import Users
-import stripe
+from services.stripe_gateway import create_customer
 import phonenumbers
 from phonenumbers.phonenumberutil import NumberParseException
 from models.orders import Orders
+from cache import user_cache
+from sqlalchemy.exc import SQLAlchemyError
 
 router=APIRouter(prefix='/users')
 
 #OAUTH2
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme=OAuth2PasswordBearer(tokenUrl='token')
 access_token_expires=timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
 refresh_token_expires=timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS)
 
-#STRIPE
-stripe.api_key=STRIPE_SECRET_KEY
-
 
 
 #METHODS
-def get_password_hash(password:str):
-    return pwd_context.hash(password)
+async def get_password_hash(password:str):
+    return await password_hasher.hash(password)
 
-def get_user(session: SessionDB, username:str):
-    user=session.query(Users).filter(Users.username==username.lower()).first()
+async def get_user(session: SessionDB, username:str):
+    user=(await session.execute(select(Users).filter(Users.username==username.lower()))).scalars().first()
     if user:
         user_dict={
             'id':user.id,
@@ -55,24 +53,64 @@ def get_user(session: SessionDB, username:str):
         }
         return UserDB(**user_dict)
 
-def verify_password(password, hashed_password):
-    return pwd_context.verify(password, hashed_password) 
+#USER IDENTITY CACHE
+#the access token carries the identity claims (user_claims) and the authentication dependencies build the user from
+#them. What is left of the users query is the revocation check, cached per (username, token iat) for
+#USER_CACHE_TTL_SECONDS: only the identity columns are read, and a token of a removed user, or issued before a
+#role/disabled change, no longer matches the row and is rejected. Account changes drop every cached identity of the
+#user right away (for every worker with the redis backend).
+IDENTITY_COLUMNS=(Users.id, Users.username, Users.disabled, Users.role, Users.stripe_id)
+
+def identity_namespace(username:str):
+    return f'identity:{username}'
+
+async def invalidate_user_identity(username:str):
+    await user_cache.delete_namespace(identity_namespace(username))
+
+def user_claims(user:User):
+    return {'sub':user.username, 'uid':user.id, 'role':user.role, 'disabled':user.disabled, 'stripe_id':user.stripe_id}
+
+def claims_identity(payload:dict):
+    return UserIdentity(id=payload['uid'], username=payload['sub'], disabled=payload.get('disabled'), role=payload.get('role'), stripe_id=payload.get('stripe_id'))
+
+async def get_user_identity(session: SessionDB, payload:dict):
+    username=payload['sub']
+    cache_key=(identity_namespace(username), payload.get('iat'))
+    cached_user=await user_cache.get(cache_key)
+    if cached_user is not None:
+        return UserIdentity(**cached_user)
+    user_row=(await session.execute(select(*IDENTITY_COLUMNS).filter(Users.username==username.lower()))).first()
+    if user_row is None:
+        return None
+    row_identity=UserIdentity(**user_row._asdict())
+    if 'uid' in payload:
+        user_identity=claims_identity(payload)
+        if user_identity!=row_identity:
+            return None
+    else: #tokens issued before the claims were added, the identity comes from the row
+        user_identity=row_identity
+    await user_cache.set(cache_key, user_identity.model_dump(), USER_CACHE_TTL_SECONDS)
+    return user_identity
+
+async def verify_password(password, hashed_password):
+    return await password_hasher.verify(password, hashed_password)
 
-def authenticate_user(session:SessionDB,username:str, password:str):
-    user=get_user(session,username)
+async def authenticate_user(session:SessionDB,username:str, password:str):
+    user=await get_user(session,username)
     if not user:
         return False
-    if not verify_password(password, user.hashed_password):
+    if not await verify_password(password, user.hashed_password):
         return False
     return user
 
 def create_access_token(data:dict, expires_delta:timedelta|None=None):
     to_encode=data.copy()
+    now=datetime.now(timezone.utc)
     if expires_delta:
-        expire=datetime.now(timezone.utc)+expires_delta
+        expire=now+expires_delta
     else:
-        expire=datetime.now(timezone.utc)+timedelta(minutes=15)
-    to_encode.update({'exp':expire})
+        expire=now+timedelta(minutes=15)
+    to_encode.update({'exp':expire, 'iat':now})
     encode_jwt=jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encode_jwt
 
@@ -90,16 +128,14 @@ async def get_current_user(request:Request, session:SessionDB):
         username=payload.get('sub')
         if username is None:
             raise credentials_exception
-        token_data=TokenData(username=username)
     except ExpiredSignatureError:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Token has expired",headers={"WWW-Authenticate": "Bearer"})
     except InvalidTokenError:
         raise credentials_exception
-    user=get_user(session, username=token_data.username)
+    user=await get_user_identity(session, payload)
     if user is None:
         raise credentials_exception
-    user_without_password=User(id=user.id,username=user.username, email=user.email, disabled=user.disabled,name=user.name,lastname=user.lastname,verified=user.verified,role=user.role,stripe_id=user.stripe_id, phone_number=user.phone_number)
-    return user_without_password
+    return user
 
 async def get_current_user_custom(request:Request, session:SessionDB): #same but without raising exceptions if no user found, for get products
     token = request.cookies.get("access_token")
@@ -110,25 +146,23 @@ async def get_current_user_custom(request:Request, session:SessionDB): #same but
         username=payload.get('sub')
         if username is None:
             return False
-        token_data=TokenData(username=username)
     except ExpiredSignatureError:
         return False
     except InvalidTokenError:
         return False
-    user=get_user(session, username=token_data.username)
+    user=await get_user_identity(session, payload)
     if user is None:
         return False
-    user_without_password=User(id=user.id,username=user.username, email=user.email, disabled=user.disabled,name=user.name,lastname=user.lastname,verified=user.verified,role=user.role,stripe_id=user.stripe_id, phone_number=user.phone_number)
-    return user_without_password
+    return user
 
-async def get_current_active_user(current_user:Annotated[User,Depends(get_current_user)]):
+async def get_current_active_user(current_user:Annotated[UserIdentity,Depends(get_current_user)]):
     #if current_user.verified==True: #set to false in production
     #    raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,detail='Please verify your email')
     if current_user.disabled==True:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,detail='Inactive user')
     return current_user
 
-async def get_current_active_user_custom(current_user:Annotated[User,Depends(get_current_user_custom)]):
+async def get_current_active_user_custom(current_user:Annotated[UserIdentity,Depends(get_current_user_custom)]):
     if current_user:
         #if current_user.verified==True: #set to false in production
             #return False
@@ -137,7 +171,7 @@ async def get_current_active_user_custom(current_user:Annotated[User,Depends(get
         return current_user
     return False
 
-async def is_admin(active_current_user:Annotated[User, Depends(get_current_active_user)]):
+async def is_admin(active_current_user:Annotated[UserIdentity, Depends(get_current_active_user)]):
     return active_current_user.role=='admin'
         
         
@@ -164,8 +198,8 @@ def process_phone_number(raw_number: str, region: str = "US") -> str:
 
 #ROUTES
 @router.post('/token',tags=['Users'])
-async def login(form_data:Annotated[OAuth2PasswordRequestForm, Depends()], session:SessionDB, csrf_protect: Annotated[CsrfProtect, Depends()])->JSONResponse:
-    user=authenticate_user(session,form_data.username.lower(), form_data.password)
+async def login(form_data:Annotated[OAuth2PasswordRequestForm, Depends()], session:SessionDB, csrf_protect: Annotated[CsrfProtect, Depends()])->ORJSONResponse:
+    user=await authenticate_user(session,form_data.username.lower(), form_data.password)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -173,11 +207,11 @@ async def login(form_data:Annotated[OAuth2PasswordRequestForm, Depends()], sessi
             headers={"WWW-Authenticate": "Bearer"},
         )
     
-    access_token=create_access_token(data={'sub':user.username}, expires_delta=access_token_expires)
+    access_token=create_access_token(data=user_claims(user), expires_delta=access_token_expires)
     refresh_token=create_access_token(data={'sub':user.username}, expires_delta=refresh_token_expires)
     csrf_token, signed_token=csrf_protect.generate_csrf_tokens()
     
-    response=JSONResponse(content={'message':'Login successful', 'csrf_token':csrf_token})
+    response=ORJSONResponse(content={'message':'Login successful', 'csrf_token':csrf_token})
     response.set_cookie(
         key="access_token",
         value=access_token,
@@ -201,7 +235,7 @@ async def login(form_data:Annotated[OAuth2PasswordRequestForm, Depends()], sessi
     return response
 
 @router.post("/refresh-token",tags=['Users'])
-def refresh_token(request: Request, response: Response, session:SessionDB):
+async def refresh_token(request: Request, response: Response, session:SessionDB):
     old_refresh_token = request.cookies.get("refresh_token")
     
     if not old_refresh_token:
@@ -212,7 +246,7 @@ def refresh_token(request: Request, response: Response, session:SessionDB):
         username = payload.get("sub")
         if username is None:
             raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid refresh token")
-        user_db=session.query(Users).filter(Users.username==username).first()
+        user_db=(await session.execute(select(Users).filter(Users.username==username))).scalars().first()
         if user_db is None:
             raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid refresh token")
         if user_db.disabled==True:
@@ -222,9 +256,9 @@ def refresh_token(request: Request, response: Response, session:SessionDB):
     except InvalidTokenError:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid refresh token")
     
-    # Generate new access token
+    # Generate new access token, with the current claims of the user
     new_access_token = create_access_token(
-        data={"sub": username},
+        data=user_claims(user_db),
         expires_delta=access_token_expires
     )
     
@@ -258,45 +292,77 @@ def refresh_token(request: Request, response: Response, session:SessionDB):
 
 
 @router.get('/me',tags=['Users'])
-def get_me(session:SessionDB, current_user:Annotated[User,Depends(get_current_active_user)])->User:
-    return current_user
+async def get_me(session:SessionDB, current_user:Annotated[UserIdentity,Depends(get_current_active_user)])->User:
+    #the profile fields are not in the token
+    user=await get_user(session, current_user.username)
+    if user is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='User not found')
+    return User(**user.model_dump(exclude={'hashed_password'}))
 
 @router.post('/logout',tags=['Users']) #check it when hosting a real server, for it needs https to send and delete the cookies
-def logout(request:Request,response:Response)->JSONResponse:
-    print(request.headers)
+def logout(request:Request,response:Response)->ORJSONResponse:
     response.delete_cookie(key='access_token',path='/',secure=True,samesite='lax')
     response.delete_cookie(key='refresh_token',path='/',secure=True,samesite='lax')
     response.delete_cookie(key='fastapi-csrf-token',path='/',secure=True,samesite='lax')
-    return JSONResponse(content={'message':'Logged out successfully'})
+    return ORJSONResponse(content={'message':'Logged out successfully'})
 
 @router.post('/signup',tags=['Users'])
-def signup(user:UserSignUp, session:SessionDB)->User:
+async def signup(user:UserSignUp, session:SessionDB)->User:
     user.email=user.email.lower()
     user.username=user.username.lower()
-    existing_user_username=session.query(Users).filter(Users.username==user.username).first()
+    existing_user_username=(await session.execute(select(Users).filter(Users.username==user.username))).scalars().first()
     if existing_user_username:
         raise HTTPException(
             status_code=status.HTTP_409_CONFLICT,
             detail='User with this username already exists'
         )
-    existing_user_email=session.query(Users).filter(Users.email==user.email).first()
+    existing_user_email=(await session.execute(select(Users).filter(Users.email==user.email))).scalars().first()
     if existing_user_email:
         raise HTTPException(
             status_code=status.HTTP_409_CONFLICT,
             detail='User with this email already exists'
         )
     try:
-        customer=stripe.Customer.create(
+        customer=await create_customer(
             email=user.email,name=f'{user.name} {user.lastname}'
         )
         phone_number=process_phone_number(user.phone_number, user.phone_number_region)
-        hashed_password=get_password_hash(user.password)
+        hashed_password=await get_password_hash(user.password)
         user_db=Users(username=user.username, email=user.email, hashed_password=hashed_password,name=user.name,lastname=user.lastname,stripe_id=customer['id'], phone_number=phone_number)
         session.add(user_db)
-        session.commit()
-        session.refresh(user_db)
+        await session.commit()
+        await session.refresh(user_db)
         user_returned=User(id=user_db.id, username=user_db.username, email=user_db.email, name=user_db.name, lastname=user_db.lastname, disabled=user_db.disabled, verified=user_db.verified, role=user_db.role, stripe_id=user_db.stripe_id, phone_number=user_db.phone_number)
         return user_returned
     except Exception as e:
-        session.rollback()
+        await session.rollback()
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f'An error ocurred while creating the user. {e}')
+
+@router.patch('/update_user_account_admins/{user_id}',tags=['users_admins'])
+async def update_user_account_admins(
+    request:Request,
+    admin: Annotated[bool, Depends(is_admin)],
+    csrf_protect:Annotated[CsrfProtect, Depends()],
+    x_csrf_token:Annotated[str,Header(...,description='"X-CSRF-Token')],
+    user_id:int,
+    account:UserAccountUpdate,
+    session:SessionDB
+)->ORJSONResponse:
+    await csrf_protect.validate_csrf(request)
+    if not admin:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,detail='Not enough permissions')
+    user_db=(await session.execute(select(Users).filter(Users.id==user_id))).scalars().first()
+    if not user_db:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='The user does not exist')
+    try:
+        if account.disabled is not None:
+            user_db.disabled=account.disabled
+        if account.role is not None:
+            user_db.role=account.role.value
+        await session.commit()
+        #access tokens issued before the change stop matching the account
+        await invalidate_user_identity(user_db.username)
+        return ORJSONResponse(status_code=status.HTTP_200_OK, content={'message':'User account successfully updated', 'user':{'id':user_db.id, 'username':user_db.username, 'disabled':user_db.disabled, 'role':user_db.role}})
+    except SQLAlchemyError:
+        await session.rollback()
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail='An error occurred while updating the user account')
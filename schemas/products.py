@@ -81,6 +81,7 @@ class ProductsSortBy(str,PyEnum):
     average_stars_desc='average_stars_desc'
     total_stars_asc='total_stars_asc'
     total_stars_desc='total_stars_desc'
+    relevance='relevance'
 
 class ProductsInventoryParams(BaseModel):
     query_title:Annotated[str|None,constr(max_length=200)]=None
@@ -128,6 +129,7 @@ class ProductsSortByUser(str,PyEnum):
     average_stars_desc='average_stars_desc'
     total_stars_asc='total_stars_asc'
     total_stars_desc='total_stars_desc'
+    relevance='relevance'
 
 class ProductsSearchUser(BaseModel):
     query_title:Annotated[str|None,constr(max_length=200)]=None
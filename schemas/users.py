@@ -1,7 +1,12 @@
 from pydantic import BaseModel, EmailStr, constr, field_validator
 from typing import Annotated
+from enum import Enum as PyEnum
 import re
 
+class UserRole(str, PyEnum):
+    user='user'
+    admin='admin'
+
 class UserSignUp(BaseModel):
     username:Annotated[str, constr(min_length=3, max_length=50)]
     password:Annotated[str,constr(min_length=8,max_length=200)]
@@ -12,6 +17,14 @@ class UserSignUp(BaseModel):
     phone_number_region:Annotated[str,constr(min_length=2, max_length=30)]
     
     
+#the authenticated user as the access token claims carry it (routers.users.user_claims), what the dependencies return
+class UserIdentity(BaseModel):
+    id:int
+    username:Annotated[str, constr(min_length=3, max_length=50)]
+    disabled:bool|None=False
+    role:str|None='user'
+    stripe_id:str
+
 class User(BaseModel):
     id:int
     username:Annotated[str, constr(min_length=3, max_length=50)]
@@ -27,6 +40,10 @@ class User(BaseModel):
 class UserDB(User):
     hashed_password:str
     
+class UserAccountUpdate(BaseModel):
+    disabled:bool|None=None
+    role:UserRole|None=None
+    
     
 @field_validator('password')
 def password_complexity(cls, v):
@@ -0,0 +1,27 @@
+#SECURITY HEADERS
+#pure ASGI: the headers are added to the http.response.start message on its way out, the body is passed through
+#untouched (streaming responses are not buffered) and no extra task is created per request, unlike @app.middleware.
+#a header of the same name set by a route is replaced, as before.
+
+SECURITY_HEADERS=[
+    (b'x-frame-options', b'DENY'),
+    (b'x-content-type-options', b'nosniff'),
+    (b'referrer-policy', b'no-referrer-when-downgrade'),
+    (b'permissions-policy', b'geolocation=(), microphone=(), camera=()'),
+]
+
+class SecurityHeadersMiddleware:
+    def __init__(self, app, headers:list=SECURITY_HEADERS):
+        self.app=app
+        self.headers=headers
+        self.header_names={name for name, value in headers}
+
+    async def __call__(self, scope, receive, send):
+        if scope['type']!='http':
+            return await self.app(scope, receive, send)
+
+        async def send_with_headers(message):
+            if message['type']=='http.response.start':
+                message['headers']=[header for header in message.get('headers', []) if header[0].lower() not in self.header_names]+self.headers
+            await send(message)
+        await self.app(scope, receive, send_with_headers)
@@ -0,0 +1,133 @@
+import asyncio
+import hashlib
+import hmac
+import json
+import re
+import time
+import uuid
+from urllib.parse import parse_qsl
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+#FAKE STRIPE SERVER (tests and load tests only)
+#implements the few api calls the backend makes, with stripe-style form decoding, list objects and errors.
+#run: uvicorn services.fake_stripe:app --port 12111 and set STRIPE_API_BASE=http://127.0.0.1:12111
+#POST /_fake/config {"latency_seconds":0.2, "fail_next":2} adds latency or makes the next calls fail with a
+#retryable 500 to exercise timeouts and retries. sign_payload builds the Stripe-Signature header for webhook tests.
+
+app=FastAPI(title='fake stripe')
+
+state={'customers':{}, 'checkout_sessions':{}, 'payment_intents':{}, 'idempotency':{}, 'latency_seconds':0.0, 'fail_next':0, 'requests':0}
+
+KEY_PATTERN=re.compile(r'[^\[\]]+')
+
+def decode_form(body:bytes):
+    #a[b][0][c]=v -> {'a':{'b':[{'c':'v'}]}}
+    data={}
+    for key, value in parse_qsl(body.decode(), keep_blank_values=True):
+        parts=KEY_PATTERN.findall(key)
+        node=data
+        for part, next_part in zip(parts, parts[1:]):
+            node=node.setdefault(part, {})
+        node[parts[-1]]=value
+    return to_lists(data)
+
+def to_lists(node):
+    if not isinstance(node, dict):
+        return node
+    if node and all(key.isdigit() for key in node):
+        return [to_lists(node[key]) for key in sorted(node, key=int)]
+    return {key:to_lists(value) for key, value in node.items()}
+
+def new_id(prefix:str):
+    return f'{prefix}_test_{uuid.uuid4().hex[:24]}'
+
+def stripe_error(status_code:int, message:str, error_type:str='invalid_request_error', headers:dict|None=None):
+    return JSONResponse(status_code=status_code, content={'error':{'type':error_type, 'message':message}}, headers=headers)
+
+def sign_payload(payload:bytes, secret:str, timestamp:int|None=None):
+    timestamp=timestamp or int(time.time())
+    signature=hmac.new(secret.encode(), f'{timestamp}.'.encode()+payload, hashlib.sha256).hexdigest()
+    return f't={timestamp},v1={signature}'
+
+@app.middleware('http')
+async def simulate_network(request:Request, call_next):
+    if request.url.path.startswith('/_fake'):
+        return await call_next(request)
+    state['requests']+=1
+    if state['latency_seconds']:
+        await asyncio.sleep(state['latency_seconds'])
+    if state['fail_next']>0:
+        state['fail_next']-=1
+        return stripe_error(500, 'Simulated failure', 'api_error', headers={'Stripe-Should-Retry':'true'})
+    idempotency_key=request.headers.get('idempotency-key')
+    if request.method=='POST' and idempotency_key in state['idempotency']:
+        return JSONResponse(content=state['idempotency'][idempotency_key], headers={'Idempotent-Replayed':'true'})
+    response=await call_next(request)
+    if request.method=='POST' and idempotency_key and response.status_code==200:
+        body=b''.join([chunk async for chunk in response.body_iterator])
+        state['idempotency'][idempotency_key]=json.loads(body)
+        return JSONResponse(content=state['idempotency'][idempotency_key])
+    return response
+
+@app.post('/_fake/config')
+async def configure(request:Request):
+    config=await request.json()
+    for key in ('latency_seconds', 'fail_next'):
+        if key in config:
+            state[key]=config[key]
+    return {'latency_seconds':state['latency_seconds'], 'fail_next':state['fail_next'], 'requests':state['requests']}
+
+@app.post('/v1/customers')
+async def create_customer(request:Request):
+    params=decode_form(await request.body())
+    customer={'id':new_id('cus'), 'object':'customer', 'email':params.get('email'), 'name':params.get('name'), 'created':int(time.time())}
+    state['customers'][customer['id']]=customer
+    return customer
+
+@app.post('/v1/checkout/sessions')
+async def create_checkout_session(request:Request):
+    params=decode_form(await request.body())
+    if not params.get('line_items'):
+        return stripe_error(400, 'Missing required param: line_items.')
+    amount_subtotal=sum(int(item['price_data']['unit_amount'])*int(item['quantity']) for item in params['line_items'])
+    payment_intent={'id':new_id('pi'), 'object':'payment_intent', 'amount':amount_subtotal, 'currency':params['line_items'][0]['price_data']['currency'], 'customer':params.get('customer'), 'status':'requires_payment_method'}
+    state['payment_intents'][payment_intent['id']]=payment_intent
+    session_id=new_id('cs')
+    checkout_session={
+        'id':session_id,
+        'object':'checkout.session',
+        'url':f'{request.base_url}pay/{session_id}',
+        'mode':params.get('mode'),
+        'status':'open',
+        'payment_status':'unpaid',
+        'customer':params.get('customer'),
+        'payment_intent':payment_intent['id'],
+        'amount_subtotal':amount_subtotal,
+        'amount_total':amount_subtotal,
+        'currency':payment_intent['currency'],
+        'expires_at':int(params['expires_at']) if params.get('expires_at') else int(time.time())+86400,
+        'success_url':params.get('success_url'),
+        'cancel_url':params.get('cancel_url'),
+        'total_details':{'amount_discount':0, 'amount_shipping':0, 'amount_tax':0}
+    }
+    state['checkout_sessions'][session_id]=checkout_session
+    return checkout_session
+
+@app.get('/v1/checkout/sessions')
+async def list_checkout_sessions(request:Request):
+    payment_intent=request.query_params.get('payment_intent')
+    sessions=[checkout_session for checkout_session in state['checkout_sessions'].values() if payment_intent is None or checkout_session['payment_intent']==payment_intent]
+    return {'object':'list', 'url':'/v1/checkout/sessions', 'has_more':False, 'data':sessions}
+
+@app.get('/v1/checkout/sessions/{session_id}')
+async def retrieve_checkout_session(session_id:str):
+    if session_id not in state['checkout_sessions']:
+        return stripe_error(404, f"No such checkout.session: '{session_id}'")
+    return state['checkout_sessions'][session_id]
+
+@app.get('/v1/payment_intents/{payment_intent_id}')
+async def retrieve_payment_intent(payment_intent_id:str):
+    if payment_intent_id not in state['payment_intents']:
+        return stripe_error(404, f"No such payment_intent: '{payment_intent_id}'")
+    return state['payment_intents'][payment_intent_id]
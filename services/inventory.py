@@ -0,0 +1,72 @@
+from sqlalchemy import update, select, delete, values, column, func, Integer, literal_column
+from models.products import Products
+from models.cart import CartSnapshoots
+from models.reservations import Reservations
+
+#RESERVED STOCK
+#checkouts move units from available_stock to reserve_stock and the reservation reaper moves them back.
+#both lock the product rows in product id order first, so transactions over overlapping sets of products
+#queue up instead of deadlocking (FOR NO KEY UPDATE, so inserts referencing the products are not blocked), and then update every row in one UPDATE ... FROM (VALUES ...) on postgres.
+
+async def move_reserved_stock(session, units_by_product:dict, reserve:bool):
+    #returns the ids of the products that were updated, when reserving a product without enough available stock is left out
+    lines=sorted(units_by_product.items())
+    if not lines:
+        return set()
+    if session.bind.dialect.name=='postgresql':
+        await session.execute(select(Products.id).filter(Products.id.in_(units_by_product)).order_by(Products.id).with_for_update(key_share=True))
+        stock_lines=values(column('product_id', Integer), column('units', Integer), name='stock_lines').data(lines)
+        units=stock_lines.c.units if reserve else -stock_lines.c.units
+        query=update(Products).filter(Products.id==stock_lines.c.product_id)
+        if reserve:
+            query=query.filter(Products.available_stock>=stock_lines.c.units)
+        result=await session.execute(query.values(
+            {
+                Products.reserve_stock: Products.reserve_stock+units,
+                Products.available_stock: Products.available_stock-units
+            }
+        ).returning(Products.id).execution_options(synchronize_session=False))
+        return set(result.scalars().all())
+    updated_ids=set()
+    for product_id, units in lines:
+        query=update(Products).filter(Products.id==product_id)
+        if reserve:
+            query=query.filter(Products.available_stock>=units)
+        else:
+            units=-units
+        result=await session.execute(query.values(
+            {
+                Products.reserve_stock: Products.reserve_stock+units,
+                Products.available_stock: Products.available_stock-units
+            }
+        ).execution_options(synchronize_session=False))
+        if result.rowcount>0:
+            updated_ids.add(product_id)
+    return updated_ids
+
+async def sell_checkout_stock(session, user_id:int, checkout_session_id:int):
+    #a paid checkout: its snapshot units leave stock and the units still reserved for it leave reserve_stock, the
+    #rest (reservations already released by the reaper) leave available_stock, which can go negative when oversold.
+    #the reservations are locked first, as the reaper does, so it skips them instead of releasing them twice, and every
+    #product is adjusted by one UPDATE ... FROM. Returns the ids of the products sold
+    pending=literal_column("'pending'")
+    reservations_filter=(Reservations.user_id==user_id, Reservations.checkout_session_id==checkout_session_id, Reservations.status==pending)
+    await session.execute(select(Reservations.id).filter(*reservations_filter).order_by(Reservations.id).with_for_update())
+    sold=select(CartSnapshoots.product_id, func.sum(CartSnapshoots.units).label('units')).filter(
+        CartSnapshoots.user_id==user_id,
+        CartSnapshoots.checkout_session_id==checkout_session_id
+    ).group_by(CartSnapshoots.product_id).subquery('sold')
+    reserved=select(Reservations.product_id, func.sum(Reservations.units).label('units')).filter(*reservations_filter).group_by(Reservations.product_id).subquery('reserved')
+    product_ids=(await session.execute(select(Products.id).filter(Products.id.in_(select(sold.c.product_id))).order_by(Products.id).with_for_update(key_share=True))).scalars().all()
+    if not product_ids:
+        return product_ids
+    lines=select(sold.c.product_id, sold.c.units, func.coalesce(reserved.c.units, 0).label('reserved_units')).outerjoin(reserved, reserved.c.product_id==sold.c.product_id).subquery('lines')
+    await session.execute(update(Products).filter(Products.id==lines.c.product_id).values(
+        {
+            Products.stock: Products.stock-lines.c.units,
+            Products.reserve_stock: Products.reserve_stock-lines.c.reserved_units,
+            Products.available_stock: Products.available_stock-(lines.c.units-lines.c.reserved_units)
+        }
+    ).execution_options(synchronize_session=False))
+    await session.execute(delete(Reservations).filter(*reservations_filter).execution_options(synchronize_session=False))
+    return product_ids
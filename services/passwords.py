@@ -0,0 +1,92 @@
+import asyncio
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from fastapi import HTTPException, status
+from passlib.context import CryptContext
+from config import PASSWORD_HASH_EXECUTOR, PASSWORD_HASH_WORKERS, PASSWORD_HASH_MAX_PENDING
+
+#PASSWORD HASHING
+#bcrypt costs ~250ms of CPU per call, so hashing and verification run in a bounded pool instead of on the event loop.
+#at most PASSWORD_HASH_WORKERS calls run at once, PASSWORD_HASH_MAX_PENDING more may wait, the rest are rejected.
+#bcrypt releases the GIL while hashing so the thread pool scales with cores, the process pool isolates it completely.
+
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+#module level so the process pool can pickle them
+def hash_password_sync(password:str):
+    return pwd_context.hash(password)
+
+def verify_password_sync(password:str, hashed_password:str):
+    return pwd_context.verify(password, hashed_password)
+
+class PasswordHasher:
+    def __init__(self, executor_kind:str, workers:int, max_pending:int):
+        self.executor_kind=executor_kind
+        self.workers=workers
+        self.max_pending=max_pending
+        self._executor=None
+        self._semaphore=asyncio.Semaphore(workers)
+        self.running=0
+        self.waiting=0
+        self.max_waiting=0
+        self.completed=0
+        self.rejected=0
+        self.wait_seconds_total=0.0
+        self.run_seconds_total=0.0
+
+    def _get_executor(self):
+        if self._executor is None:
+            if self.executor_kind=='process':
+                self._executor=ProcessPoolExecutor(max_workers=self.workers)
+            else:
+                self._executor=ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='password-hash')
+        return self._executor
+
+    async def _run(self, function, *args):
+        if self.waiting>=self.max_pending:
+            self.rejected+=1
+            raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail='Too many requests, try again later', headers={'Retry-After':'1'})
+        self.waiting+=1
+        self.max_waiting=max(self.max_waiting, self.waiting)
+        queued_at=time.perf_counter()
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.waiting-=1
+        started=time.perf_counter()
+        self.wait_seconds_total+=started-queued_at
+        self.running+=1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._get_executor(), function, *args)
+        finally:
+            self.running-=1
+            self.completed+=1
+            self.run_seconds_total+=time.perf_counter()-started
+            self._semaphore.release()
+
+    async def hash(self, password:str):
+        return await self._run(hash_password_sync, password)
+
+    async def verify(self, password:str, hashed_password:str):
+        return await self._run(verify_password_sync, password, hashed_password)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor=None
+
+    def stats(self):
+        return {
+            'executor':self.executor_kind,
+            'workers':self.workers,
+            'max_pending':self.max_pending,
+            'running':self.running,
+            'waiting':self.waiting,
+            'max_waiting':self.max_waiting,
+            'completed':self.completed,
+            'rejected':self.rejected,
+            'wait_seconds_avg':round(self.wait_seconds_total/self.completed, 6) if self.completed else 0.0,
+            'run_seconds_avg':round(self.run_seconds_total/self.completed, 6) if self.completed else 0.0
+        }
+
+password_hasher=PasswordHasher(PASSWORD_HASH_EXECUTOR, PASSWORD_HASH_WORKERS, PASSWORD_HASH_MAX_PENDING)
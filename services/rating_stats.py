@@ -0,0 +1,227 @@
+import asyncio
+import logging
+import time
+from datetime import datetime, timezone, timedelta
+from sqlalchemy import select, update, insert, func, case
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.exc import SQLAlchemyError
+from database import SessionLocal, engine
+from logs import setup_logging, stop_logging
+from models.products import Products
+from models.stars import Stars, ProductRatingStats
+from config import RATING_STATS_RECONCILE_INTERVAL_SECONDS, RATING_STATS_RECONCILE_BATCH_SIZE, RATING_STATS_RECONCILE_FULL_EVERY_RUNS
+
+logger=logging.getLogger(__name__)
+
+#PRODUCT RATING STATS
+#product_rating_stats holds the count, the sum and the histogram of the ratings of a product. rate_stars changes them
+#with one atomic upsert (INSERT ... ON CONFLICT DO UPDATE SET x=x+delta), so ratings never lock the products row
+#that checkout updates. The reconciler walks the products in batches of batch_size: it recomputes the stats from
+#stars to repair any drift and copies average and total into products.average_stars and products.total_stars,
+#which the listings filter and sort on, only for the products whose values changed. Listings follow a new rating
+#after at most interval_seconds, get_product reads the stats directly.
+#a pass only walks the products whose stats row was updated (every rating bumps updated_at) since one interval
+#before the previous pass started, the overlap covers ratings still uncommitted then. The first pass and every
+#full_every_runs-th pass walk every product, which also repairs drift nothing rated since.
+#updated_at is not indexed, an index would make every rating upsert a non-HOT update for a scan of a table with one
+#row per rated product.
+
+HISTOGRAM_COLUMNS=[ProductRatingStats.stars_0, ProductRatingStats.stars_1, ProductRatingStats.stars_2, ProductRatingStats.stars_3, ProductRatingStats.stars_4, ProductRatingStats.stars_5]
+STATS_COLUMNS=['ratings_count', 'ratings_sum']+[column.key for column in HISTOGRAM_COLUMNS]
+
+def rating_deltas(old_stars:int|None, new_stars:int):
+    deltas={key:0 for key in STATS_COLUMNS}
+    deltas[f'stars_{new_stars}']+=1
+    deltas['ratings_sum']+=new_stars
+    if old_stars is None:
+        deltas['ratings_count']+=1
+    else:
+        deltas[f'stars_{old_stars}']-=1
+        deltas['ratings_sum']-=old_stars
+    return deltas
+
+async def apply_rating(session, product_id:int, old_stars:int|None, new_stars:int):
+    #old_stars is None for a first rating
+    deltas=rating_deltas(old_stars, new_stars)
+    changed={key:delta for key, delta in deltas.items() if delta}
+    if not changed:
+        #the same stars again
+        return
+    if session.bind.dialect.name=='postgresql':
+        query=pg_insert(ProductRatingStats).values(product_id=product_id, **deltas)
+        await session.execute(query.on_conflict_do_update(
+            index_elements=['product_id'],
+            set_={**{key:getattr(ProductRatingStats, key)+getattr(query.excluded, key) for key in changed}, 'updated_at':func.now()}
+        ))
+        return
+    result=await session.execute(update(ProductRatingStats).filter(ProductRatingStats.product_id==product_id).values(
+        {getattr(ProductRatingStats, key):getattr(ProductRatingStats, key)+delta for key, delta in changed.items()}
+    ).execution_options(synchronize_session=False))
+    if result.rowcount==0:
+        await session.execute(insert(ProductRatingStats).values(product_id=product_id, **deltas))
+
+def stats_average(stats_row):
+    return stats_row.ratings_sum/stats_row.ratings_count if stats_row and stats_row.ratings_count else 0.0
+
+async def get_rating_stats(session, product_id:int):
+    stats_row=(await session.execute(select(ProductRatingStats).filter(ProductRatingStats.product_id==product_id))).scalars().first()
+    return {
+        'average_stars':stats_average(stats_row),
+        'total_stars':stats_row.ratings_count if stats_row else 0,
+        'stars_histogram':{str(number):getattr(stats_row, column.key) if stats_row else 0 for number, column in enumerate(HISTOGRAM_COLUMNS)}
+    }
+
+class RatingStatsReconciler:
+    def __init__(self, interval_seconds:float, batch_size:int, full_every_runs:int):
+        self.interval_seconds=interval_seconds
+        self.batch_size=batch_size
+        self.full_every_runs=full_every_runs
+        self._task=None
+        #lower bound of the next incremental pass, None until a pass succeeded
+        self.changed_since=None
+        self.runs=0
+        self.errors=0
+        self.stats_repaired=0
+        self.products_published=0
+        self.last_run_at=None
+        self.last_run_seconds=0.0
+        self.last_run_full=False
+        self.last_run_products=0
+
+    async def _insert_missing_stats(self, session, missing:list):
+        #a rating can insert the row between the select above and this insert, its row is kept and the next pass,
+        #which sees its updated_at, recomputes it
+        if session.bind.dialect.name=='postgresql':
+            result=await session.execute(pg_insert(ProductRatingStats).values(missing).on_conflict_do_nothing(index_elements=['product_id']))
+        else:
+            result=await session.execute(insert(ProductRatingStats).values(missing))
+        self.stats_repaired+=result.rowcount
+        return {stats_row.product_id:stats_row for stats_row in (await session.execute(select(ProductRatingStats).filter(
+            ProductRatingStats.product_id.in_([values['product_id'] for values in missing])
+        ).order_by(ProductRatingStats.product_id).with_for_update())).scalars().all()}
+
+    async def _reconcile_batch(self, session, product_ids:list):
+        #the stats rows are locked before stars is read, a rating either committed before (and is counted) or waits
+        stats_rows={stats_row.product_id:stats_row for stats_row in (await session.execute(select(ProductRatingStats).filter(
+            ProductRatingStats.product_id.in_(product_ids)
+        ).order_by(ProductRatingStats.product_id).with_for_update())).scalars().all()}
+        counted={row.product_id:row for row in (await session.execute(select(
+            Stars.product_id,
+            func.count().label('ratings_count'),
+            func.sum(Stars.stars_number).label('ratings_sum'),
+            *[func.sum(case((Stars.stars_number==number, 1), else_=0)).label(column.key) for number, column in enumerate(HISTOGRAM_COLUMNS)]
+        ).filter(Stars.product_id.in_(product_ids)).group_by(Stars.product_id))).all()}
+        missing=[]
+        for product_id in product_ids:
+            row=counted.get(product_id)
+            expected={key:int(getattr(row, key)) if row else 0 for key in STATS_COLUMNS}
+            stats_row=stats_rows.get(product_id)
+            if stats_row is None:
+                if row is not None:
+                    missing.append({'product_id':product_id, **expected})
+            elif any(getattr(stats_row, key)!=value for key, value in expected.items()):
+                for key, value in expected.items():
+                    setattr(stats_row, key, value)
+                self.stats_repaired+=1
+        await session.flush()
+        if missing:
+            stats_rows.update(await self._insert_missing_stats(session, missing))
+        products=(await session.execute(select(Products.id, Products.average_stars, Products.total_stars).filter(Products.id.in_(product_ids)))).all()
+        published=[]
+        for product in products:
+            stats_row=stats_rows.get(product.id)
+            average_stars=stats_average(stats_row)
+            total_stars=stats_row.ratings_count if stats_row else 0
+            if product.average_stars!=average_stars or product.total_stars!=total_stars:
+                published.append({'id':product.id, 'average_stars':average_stars, 'total_stars':total_stars})
+        if published:
+            #by primary key in id order, the same order checkout locks products in
+            await session.execute(update(Products), sorted(published, key=lambda values:values['id']))
+        self.products_published+=len(published)
+        return len(published)
+
+    def _products_to_reconcile(self, full:bool):
+        #the id column the pass walks in order and the query selecting its products
+        if full:
+            return Products.id, select(Products.id)
+        return ProductRatingStats.product_id, select(ProductRatingStats.product_id).filter(ProductRatingStats.updated_at>=self.changed_since)
+
+    async def run_once(self):
+        started=time.perf_counter()
+        started_at=datetime.now(timezone.utc)
+        full=self.changed_since is None or (self.full_every_runs>0 and self.runs%self.full_every_runs==0)
+        id_column, products_query=self._products_to_reconcile(full)
+        last_id=0
+        published=0
+        reconciled=0
+        while True:
+            async with SessionLocal() as session:
+                product_ids=(await session.execute(products_query.filter(id_column>last_id).order_by(id_column).limit(self.batch_size))).scalars().all()
+                if not product_ids:
+                    break
+                published+=await self._reconcile_batch(session, product_ids)
+                await session.commit()
+            reconciled+=len(product_ids)
+            last_id=product_ids[-1]
+            if len(product_ids)<self.batch_size:
+                break
+        self.changed_since=started_at-timedelta(seconds=self.interval_seconds)
+        self.last_run_full=full
+        self.last_run_products=reconciled
+        if published:
+            from routers.products import invalidate_product_cache
+            await invalidate_product_cache()
+        self.runs+=1
+        self.last_run_at=datetime.now(timezone.utc)
+        self.last_run_seconds=round(time.perf_counter()-started, 6)
+
+    async def run_forever(self):
+        while True:
+            try:
+                await self.run_once()
+            except SQLAlchemyError as e:
+                self.errors+=1
+                logger.warning('Rating stats reconciliation failed: %s', e)
+            await asyncio.sleep(self.interval_seconds)
+
+    def start(self):
+        if self._task is None:
+            self._task=asyncio.create_task(self.run_forever(), name='rating-stats-reconciler')
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task=None
+
+    def stats(self):
+        return {
+            'running':self._task is not None and not self._task.done(),
+            'interval_seconds':self.interval_seconds,
+            'batch_size':self.batch_size,
+            'full_every_runs':self.full_every_runs,
+            'runs':self.runs,
+            'errors':self.errors,
+            'stats_repaired':self.stats_repaired,
+            'products_published':self.products_published,
+            'last_run_at':self.last_run_at.isoformat() if self.last_run_at else None,
+            'last_run_seconds':self.last_run_seconds,
+            'last_run_full':self.last_run_full,
+            'last_run_products':self.last_run_products
+        }
+
+rating_stats_reconciler=RatingStatsReconciler(RATING_STATS_RECONCILE_INTERVAL_SECONDS, RATING_STATS_RECONCILE_BATCH_SIZE, RATING_STATS_RECONCILE_FULL_EVERY_RUNS)
+
+async def main():
+    try:
+        await rating_stats_reconciler.run_forever()
+    finally:
+        await engine.dispose()
+        stop_logging()
+
+if __name__=='__main__':
+    setup_logging()
+    asyncio.run(main())
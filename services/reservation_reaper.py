@@ -0,0 +1,164 @@
+import asyncio
+import logging
+import time
+from datetime import datetime, timezone
+from sqlalchemy import select, update, delete, func, literal_column
+from sqlalchemy.exc import SQLAlchemyError
+from database import SessionLocal, engine
+from logs import setup_logging, stop_logging
+from models.reservations import Reservations
+from models.payments import CheckOutSessions
+from services.inventory import move_reserved_stock
+from config import RESERVATION_REAPER_INTERVAL_SECONDS, RESERVATION_REAPER_BATCH_SIZE
+
+logger=logging.getLogger(__name__)
+
+#RESERVATION REAPER
+#a reservation keeps its units in reserve_stock until the stripe webhook releases it, and that webhook may never come.
+#every pass expires the active checkout sessions past expires_at and releases their reservations, then releases the
+#pending reservations past expires_at and expires their checkout sessions. Rows are taken in batches of batch_size with
+#FOR UPDATE SKIP LOCKED and each batch is its own transaction, so several api workers and the standalone process
+#(python -m services.reservation_reaper) can run it at once without taking the same rows or waiting on each other.
+#statuses are compared with literals so prepared (generic) plans can still use the partial expires_at indexes.
+
+PENDING=literal_column("'pending'")
+ACTIVE=literal_column("'active'")
+
+class ReservationReaper:
+    def __init__(self, interval_seconds:float, batch_size:int):
+        self.interval_seconds=interval_seconds
+        self.batch_size=batch_size
+        self._task=None
+        self.runs=0
+        self.errors=0
+        self.reservations_released=0
+        self.units_released=0
+        self.checkout_sessions_expired=0
+        self.last_batch_size=0
+        self.last_run_at=None
+        self.last_run_seconds=0.0
+        self.lag_seconds=0.0
+
+    async def _release_reservations(self, session, reservation_filter):
+        reservations=(await session.execute(select(Reservations.id, Reservations.product_id, Reservations.units, Reservations.checkout_session_id).filter(
+            Reservations.status==PENDING,
+            reservation_filter
+        ).order_by(Reservations.id).limit(self.batch_size).with_for_update(skip_locked=True))).all()
+        if not reservations:
+            return reservations
+        units_by_product={}
+        for reservation in reservations:
+            units_by_product[reservation.product_id]=units_by_product.get(reservation.product_id, 0)+reservation.units
+        await move_reserved_stock(session, units_by_product, reserve=False)
+        await session.execute(delete(Reservations).filter(Reservations.id.in_([reservation.id for reservation in reservations])).execution_options(synchronize_session=False))
+        self.reservations_released+=len(reservations)
+        self.units_released+=sum(units_by_product.values())
+        return reservations
+
+    async def _expire_checkout_sessions(self, session, checkout_session_ids):
+        #a checkout session locked by a webhook fulfilling it is skipped, waiting for it while holding its reservations
+        #would deadlock with the webhook (checkout session first, then reservations). The webhook expires it itself
+        checkout_session_ids=(await session.execute(select(CheckOutSessions.id).filter(
+            CheckOutSessions.id.in_(checkout_session_ids),
+            CheckOutSessions.status==ACTIVE
+        ).order_by(CheckOutSessions.id).with_for_update(skip_locked=True))).scalars().all()
+        if not checkout_session_ids:
+            return
+        result=await session.execute(update(CheckOutSessions).filter(
+            CheckOutSessions.id.in_(checkout_session_ids)
+        ).values({'status':'expired'}).execution_options(synchronize_session=False))
+        self.checkout_sessions_expired+=result.rowcount
+
+    async def _expired_checkout_sessions_batch(self, now:datetime):
+        async with SessionLocal() as session:
+            checkout_session_ids=(await session.execute(select(CheckOutSessions.id).filter(
+                CheckOutSessions.status==ACTIVE,
+                CheckOutSessions.expires_at<now
+            ).order_by(CheckOutSessions.id).limit(self.batch_size).with_for_update(skip_locked=True))).scalars().all()
+            if checkout_session_ids:
+                #reservations locked by a webhook or past the batch are released once their own expires_at passes
+                await self._release_reservations(session, Reservations.checkout_session_id.in_(checkout_session_ids))
+                await self._expire_checkout_sessions(session, checkout_session_ids)
+                await session.commit()
+            return len(checkout_session_ids)
+
+    async def _expired_reservations_batch(self, now:datetime):
+        async with SessionLocal() as session:
+            reservations=await self._release_reservations(session, Reservations.expires_at<now)
+            if reservations:
+                await self._expire_checkout_sessions(session, {reservation.checkout_session_id for reservation in reservations})
+                await session.commit()
+            return len(reservations)
+
+    async def run_once(self):
+        started=time.perf_counter()
+        now=datetime.now(timezone.utc)
+        async with SessionLocal() as session:
+            oldest_expired=(await session.execute(select(func.min(Reservations.expires_at)).filter(
+                Reservations.status==PENDING,
+                Reservations.expires_at<now
+            ))).scalar()
+        #how long the oldest expired reservation has been waiting to be released
+        self.lag_seconds=round((now.replace(tzinfo=None)-oldest_expired).total_seconds(), 3) if oldest_expired else 0.0
+        self.last_batch_size=0
+        for run_batch in (self._expired_checkout_sessions_batch, self._expired_reservations_batch):
+            while True:
+                batch_size=await run_batch(now)
+                self.last_batch_size=max(self.last_batch_size, batch_size)
+                if batch_size<self.batch_size:
+                    break
+        self.runs+=1
+        self.last_run_at=now
+        self.last_run_seconds=round(time.perf_counter()-started, 6)
+
+    async def run_forever(self):
+        while True:
+            try:
+                await self.run_once()
+            except SQLAlchemyError as e:
+                #a deadlock or a lost connection, the rows are still there for the next pass
+                self.errors+=1
+                logger.warning('Reservation reaper pass failed: %s', e)
+            await asyncio.sleep(self.interval_seconds)
+
+    def start(self):
+        if self._task is None:
+            self._task=asyncio.create_task(self.run_forever(), name='reservation-reaper')
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task=None
+
+    def stats(self):
+        return {
+            'running':self._task is not None and not self._task.done(),
+            'interval_seconds':self.interval_seconds,
+            'batch_size':self.batch_size,
+            'runs':self.runs,
+            'errors':self.errors,
+            'reservations_released':self.reservations_released,
+            'units_released':self.units_released,
+            'checkout_sessions_expired':self.checkout_sessions_expired,
+            'last_batch_size':self.last_batch_size,
+            'last_run_at':self.last_run_at.isoformat() if self.last_run_at else None,
+            'last_run_seconds':self.last_run_seconds,
+            'lag_seconds':self.lag_seconds
+        }
+
+reservation_reaper=ReservationReaper(RESERVATION_REAPER_INTERVAL_SECONDS, RESERVATION_REAPER_BATCH_SIZE)
+
+async def main():
+    try:
+        await reservation_reaper.run_forever()
+    finally:
+        await engine.dispose()
+        stop_logging()
+
+if __name__=='__main__':
+    setup_logging()
+    asyncio.run(main())
@@ -0,0 +1,76 @@
+import re
+import asyncio
+from bisect import bisect_left
+from sqlalchemy import Double, case, cast, func, literal_column, select
+from models.products import Products, search_document
+
+#PRODUCT SEARCH
+#postgres: weighted tsvector over title and description backed by the ix_products_search_document GIN index,
+#prefix matching (shoe -> shoes) and ts_rank_cd relevance.
+#other dialects (sqlite test setups): an in-process inverted index with the same AND/prefix semantics.
+
+TOKEN_PATTERN=re.compile(r'\w+', re.UNICODE)
+
+def tokenize(text:str):
+    return TOKEN_PATTERN.findall(text.lower()) if text else []
+
+class ProductSearchIndex:
+    def __init__(self):
+        self._lock=asyncio.Lock()
+        self._postings={}
+        self._tokens=[]
+        self._dirty=True
+
+    def invalidate(self):
+        self._dirty=True
+
+    async def _build(self, session):
+        postings={}
+        rows=(await session.execute(select(Products.id, Products.title, Products.description))).all()
+        for product_id, title, description in rows:
+            for weight, text in ((2, title), (1, description)):
+                for token in tokenize(text):
+                    product_postings=postings.setdefault(token, {})
+                    product_postings[product_id]=product_postings.get(product_id, 0)+weight
+        self._postings=postings
+        self._tokens=sorted(postings)
+        self._dirty=False
+
+    def _prefix_matches(self, prefix:str):
+        position=bisect_left(self._tokens, prefix)
+        while position<len(self._tokens) and self._tokens[position].startswith(prefix):
+            yield self._postings[self._tokens[position]]
+            position+=1
+
+    async def search(self, session, term:str):
+        async with self._lock:
+            if self._dirty:
+                await self._build(session)
+            scores=None
+            for token in tokenize(term):
+                token_scores={}
+                for product_postings in self._prefix_matches(token):
+                    for product_id, weight in product_postings.items():
+                        token_scores[product_id]=token_scores.get(product_id, 0)+weight
+                if scores is None:
+                    scores=token_scores
+                else:
+                    scores={product_id:score+token_scores[product_id] for product_id, score in scores.items() if product_id in token_scores}
+            return scores or {}
+
+product_search_index=ProductSearchIndex()
+
+async def apply_product_search(session, query, term:str):
+    #returns the filtered query and a relevance expression usable in ORDER BY (None when there is nothing to rank)
+    tokens=tokenize(term)
+    if not tokens:
+        return query.filter(Products.title.ilike(f"%{term}%")), None
+    if session.bind.dialect.name=='postgresql':
+        tsquery=func.to_tsquery(literal_column("'simple'"), ' & '.join(f'{token}:*' for token in tokens))
+        document=search_document(Products.title, Products.description)
+        #ts_rank_cd returns real, cast so the rank stored in a cursor compares exactly on the next page
+        return query.filter(document.op('@@')(tsquery)), cast(func.ts_rank_cd(document, tsquery), Double)
+    scores=await product_search_index.search(session, term)
+    if not scores:
+        return query.filter(Products.id.in_([])), None
+    return query.filter(Products.id.in_(scores)), case(scores, value=Products.id, else_=0)
@@ -0,0 +1,34 @@
+import httpx
+import stripe
+from config import STRIPE_SECRET_KEY, STRIPE_API_BASE, STRIPE_TIMEOUT_SECONDS, STRIPE_CONNECT_TIMEOUT_SECONDS, STRIPE_MAX_NETWORK_RETRIES
+
+#STRIPE GATEWAY
+#every stripe api call goes through this module. It uses the SDK's async methods on one shared httpx.AsyncClient,
+#so calls do not block the event loop and reuse keep-alive connections. The SDK retries network errors, 409, 429
+#and retryable 5xx responses with exponential backoff and jitter. Retried POSTs reuse one auto-generated
+#idempotency key, so a retried create never runs twice on stripe. Webhook signature checks stay local
+#(stripe.Webhook) and do not use this module.
+
+stripe_http_client=stripe.HTTPXClient(timeout=httpx.Timeout(STRIPE_TIMEOUT_SECONDS, connect=STRIPE_CONNECT_TIMEOUT_SECONDS))
+
+stripe_client=stripe.StripeClient(
+    STRIPE_SECRET_KEY,
+    http_client=stripe_http_client,
+    max_network_retries=STRIPE_MAX_NETWORK_RETRIES,
+    base_addresses={'api':STRIPE_API_BASE} if STRIPE_API_BASE else {}
+)
+
+async def create_customer(email:str, name:str):
+    return await stripe_client.customers.create_async(params={'email':email, 'name':name})
+
+async def create_checkout_session(params:dict):
+    return await stripe_client.checkout.sessions.create_async(params=params)
+
+async def retrieve_payment_intent(payment_intent_id:str):
+    return await stripe_client.payment_intents.retrieve_async(payment_intent_id)
+
+async def list_checkout_sessions(payment_intent_id:str):
+    return await stripe_client.checkout.sessions.list_async(params={'payment_intent':payment_intent_id})
+
+async def close_stripe_client():
+    await stripe_http_client.close_async()
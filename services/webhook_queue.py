@@ -0,0 +1,231 @@
+import asyncio
+import logging
+import random
+import time
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import select, update, insert, func, and_, or_, exists
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import aliased
+from database import SessionLocal, engine
+from logs import setup_logging, stop_logging, correlation_id
+from models.webhook_events import WebhookEvents, WebhookEventStatus
+from config import WEBHOOK_CONSUMERS, WEBHOOK_POLL_SECONDS, WEBHOOK_LEASE_SECONDS, WEBHOOK_MAX_ATTEMPTS, WEBHOOK_RETRY_BASE_SECONDS, WEBHOOK_RETRY_MAX_SECONDS
+
+logger=logging.getLogger(__name__)
+
+#STRIPE WEBHOOK QUEUE
+#the webhook route only verifies the signature, stores the event (once per stripe event id) and answers 200, the
+#events are processed here by a pool of consumer tasks. A consumer claims one event with FOR UPDATE SKIP LOCKED and
+#leases it for lease_seconds, if the consumer dies the event is claimed again once the lease runs out.
+#events with the same ordering key (the payment intent, shared by the checkout session, its charge and its intent
+#events) are processed one at a time in stripe creation order: an event is only claimed when no earlier event with
+#its key is still pending or processing. A failed event is retried with exponential backoff and jitter and marked
+#dead after max_attempts, a dead event no longer holds back the later events of its key.
+#delivery is at least once, the handlers must be idempotent.
+
+UNFINISHED_STATUSES=(WebhookEventStatus.pending, WebhookEventStatus.processing)
+
+def event_ordering_key(event:dict):
+    data_object=event['data']['object']
+    if event['type'].startswith('payment_intent.'):
+        return data_object['id']
+    return data_object.get('payment_intent') or data_object['id']
+
+async def enqueue_event(session, event:dict):
+    #returns False when the event was already stored (a stripe redelivery)
+    values={
+        'event_id':event['id'],
+        'event_type':event['type'],
+        'ordering_key':event_ordering_key(event),
+        'event_created_at':datetime.fromtimestamp(event['created'], timezone.utc),
+        'payload':event,
+        'status':WebhookEventStatus.pending,
+        'attempts':0
+    }
+    if session.bind.dialect.name=='postgresql':
+        result=await session.execute(pg_insert(WebhookEvents).values(values).on_conflict_do_nothing(index_elements=['event_id']).returning(WebhookEvents.id))
+        inserted=result.scalar() is not None
+    else:
+        inserted=(await session.execute(select(WebhookEvents.id).filter(WebhookEvents.event_id==event['id']))).first() is None
+        if inserted:
+            await session.execute(insert(WebhookEvents).values(values))
+    await session.commit()
+    return inserted
+
+class WebhookQueue:
+    def __init__(self, consumers:int, poll_seconds:float, lease_seconds:float, max_attempts:int, retry_base_seconds:float, retry_max_seconds:float):
+        self.consumers=consumers
+        self.poll_seconds=poll_seconds
+        self.lease_seconds=lease_seconds
+        self.max_attempts=max_attempts
+        self.retry_base_seconds=retry_base_seconds
+        self.retry_max_seconds=retry_max_seconds
+        self._tasks=[]
+        self._wakeup=asyncio.Event()
+        self.processing=0
+        self.processed=0
+        self.retried=0
+        self.dead_lettered=0
+        self.lost_leases=0
+        self.errors=0
+        self.last_error=None
+        self.process_seconds_total=0.0
+
+    def notify(self):
+        #wakes the local consumers after an enqueue instead of waiting for the next poll
+        self._wakeup.set()
+
+    def retry_delay(self, attempts:int):
+        delay=min(self.retry_max_seconds, self.retry_base_seconds*2**(attempts-1))
+        return delay*random.uniform(0.5, 1.0)
+
+    async def _claim(self):
+        now=datetime.now(timezone.utc)
+        earlier=aliased(WebhookEvents)
+        async with SessionLocal() as session:
+            event_db=(await session.execute(select(WebhookEvents).filter(
+                or_(
+                    WebhookEvents.status==WebhookEventStatus.pending,
+                    and_(WebhookEvents.status==WebhookEventStatus.processing, WebhookEvents.locked_until<now)
+                ),
+                WebhookEvents.next_attempt_at<=now,
+                ~exists().where(
+                    earlier.ordering_key==WebhookEvents.ordering_key,
+                    earlier.status.in_(UNFINISHED_STATUSES),
+                    or_(
+                        earlier.event_created_at<WebhookEvents.event_created_at,
+                        and_(earlier.event_created_at==WebhookEvents.event_created_at, earlier.id<WebhookEvents.id)
+                    )
+                )
+            ).order_by(WebhookEvents.next_attempt_at, WebhookEvents.id).limit(1).with_for_update(skip_locked=True, of=WebhookEvents))).scalars().first()
+            if event_db is None:
+                return None
+            event_db.status=WebhookEventStatus.processing
+            event_db.attempts+=1
+            event_db.locked_until=now+timedelta(seconds=self.lease_seconds)
+            await session.commit()
+            return event_db
+
+    async def _finish(self, event_db, values:dict):
+        #only while the lease is still ours, another consumer may have claimed the event after it ran out
+        async with SessionLocal() as session:
+            result=await session.execute(update(WebhookEvents).filter(
+                WebhookEvents.id==event_db.id,
+                WebhookEvents.status==WebhookEventStatus.processing,
+                WebhookEvents.locked_until==event_db.locked_until
+            ).values(values).execution_options(synchronize_session=False))
+            await session.commit()
+        if result.rowcount==0:
+            self.lost_leases+=1
+            logger.warning('Webhook event lease lost', extra={'event_id':event_db.event_id, 'event_type':event_db.event_type})
+        return result.rowcount>0
+
+    async def _process(self, event_db, handler):
+        started=time.perf_counter()
+        self.processing+=1
+        #everything the handler logs carries the stripe event id
+        token=correlation_id.set(event_db.event_id)
+        try:
+            async with SessionLocal() as session:
+                await handler(event_db.payload, session)
+        except Exception as e:
+            self.last_error=f'{event_db.event_id}: {e!r}'
+            if event_db.attempts>=self.max_attempts:
+                if await self._finish(event_db, {'status':WebhookEventStatus.dead, 'locked_until':None, 'last_error':repr(e)}):
+                    self.dead_lettered+=1
+                    logger.error('Webhook event dead-lettered', extra={'event_id':event_db.event_id, 'event_type':event_db.event_type, 'attempts':event_db.attempts, 'error':repr(e)})
+            else:
+                next_attempt_at=datetime.now(timezone.utc)+timedelta(seconds=self.retry_delay(event_db.attempts))
+                if await self._finish(event_db, {'status':WebhookEventStatus.pending, 'locked_until':None, 'next_attempt_at':next_attempt_at, 'last_error':repr(e)}):
+                    self.retried+=1
+                    logger.warning('Webhook event failed, retrying', extra={'event_id':event_db.event_id, 'event_type':event_db.event_type, 'attempts':event_db.attempts, 'next_attempt_at':next_attempt_at, 'error':repr(e)})
+        else:
+            if await self._finish(event_db, {'status':WebhookEventStatus.processed, 'locked_until':None, 'last_error':None, 'processed_at':func.now()}):
+                self.processed+=1
+        finally:
+            correlation_id.reset(token)
+            self.processing-=1
+            self.process_seconds_total+=time.perf_counter()-started
+
+    async def _consume(self, handler):
+        while True:
+            try:
+                event_db=await self._claim()
+            except SQLAlchemyError as e:
+                self.errors+=1
+                logger.warning('Claiming a webhook event failed: %s', e)
+                event_db=None
+            if event_db is not None:
+                try:
+                    await self._process(event_db, handler)
+                except SQLAlchemyError as e:
+                    #the outcome could not be stored, the event is claimed again when its lease runs out
+                    self.errors+=1
+                    logger.warning('Finishing the webhook event failed', extra={'event_id':event_db.event_id, 'error':str(e)})
+                continue
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_seconds)
+            except asyncio.TimeoutError:
+                pass
+
+    def start(self, handler):
+        if not self._tasks:
+            self._tasks=[asyncio.create_task(self._consume(handler), name=f'webhook-consumer-{number}') for number in range(self.consumers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks=[]
+
+    async def depth(self):
+        async with SessionLocal() as session:
+            rows=(await session.execute(select(WebhookEvents.status, func.count(), func.min(WebhookEvents.created_at)).group_by(WebhookEvents.status))).all()
+        now=datetime.now(timezone.utc).replace(tzinfo=None)
+        depth={status.value:{'events':0, 'oldest_seconds':0.0} for status in WebhookEventStatus}
+        for status, count, oldest in rows:
+            depth[status.value]={'events':count, 'oldest_seconds':round((now-oldest).total_seconds(), 3) if oldest else 0.0}
+        return depth
+
+    async def requeue(self, event_id:str):
+        #gives a dead event a new round of attempts
+        async with SessionLocal() as session:
+            result=await session.execute(update(WebhookEvents).filter(
+                WebhookEvents.event_id==event_id,
+                WebhookEvents.status==WebhookEventStatus.dead
+            ).values({'status':WebhookEventStatus.pending, 'attempts':0, 'next_attempt_at':func.now()}).execution_options(synchronize_session=False))
+            await session.commit()
+        self.notify()
+        return result.rowcount>0
+
+    def stats(self):
+        finished=self.processed+self.retried+self.dead_lettered
+        return {
+            'consumers':len(self._tasks),
+            'processing':self.processing,
+            'processed':self.processed,
+            'retried':self.retried,
+            'dead_lettered':self.dead_lettered,
+            'lost_leases':self.lost_leases,
+            'errors':self.errors,
+            'last_error':self.last_error,
+            'process_seconds_avg':round(self.process_seconds_total/finished, 6) if finished else 0.0
+        }
+
+webhook_queue=WebhookQueue(WEBHOOK_CONSUMERS, WEBHOOK_POLL_SECONDS, WEBHOOK_LEASE_SECONDS, WEBHOOK_MAX_ATTEMPTS, WEBHOOK_RETRY_BASE_SECONDS, WEBHOOK_RETRY_MAX_SECONDS)
+
+async def main():
+    from routers.cart_and_payment import process_stripe_event
+    webhook_queue.consumers=max(1, webhook_queue.consumers)
+    webhook_queue.start(process_stripe_event)
+    try:
+        await asyncio.gather(*webhook_queue._tasks)
+    finally:
+        await engine.dispose()
+        stop_logging()
+
+if __name__=='__main__':
+    setup_logging()
+    asyncio.run(main())
@@ -0,0 +1,123 @@
+import os
+import socket
+import sqlite3
+import tempfile
+import threading
+import time
+import pytest
+
+#TEST SETTINGS
+#the app reads its settings when it is imported: a sqlite database in a temporary directory, migrated and given the
+#first admin before the app starts, the fake stripe server on a free local port, and no background reaper or
+#reconciler.
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+TEST_DIRECTORY=tempfile.mkdtemp(prefix='shop-tests-')
+PRIMARY_DATABASE=os.path.join(TEST_DIRECTORY, 'primary.db')
+STRIPE_PORT=free_port()
+WEBHOOK_SECRET='whsec_test'
+ADMIN_PASSWORD='Admin123!'
+
+os.environ.update({
+    'DATABASE_URL':f'sqlite:///{PRIMARY_DATABASE}',
+    'STRIPE_API_BASE':f'http://127.0.0.1:{STRIPE_PORT}',
+    'STRIPE_SECRET_KEY':'sk_test_fake',
+    'STRIPE_WEBHOOK_SECRET':WEBHOOK_SECRET,
+    'STRIPE_MAX_NETWORK_RETRIES':'0',
+    'CURRENCY':'usd',
+    'SUCCESS_URL':'https://shop.test/success',
+    'CANCEL_URL':'https://shop.test/cancel',
+    'CSRF_SECRET_KEY':'c'*32,
+    'SECRET_KEY':'s'*32,
+    'ACCESS_TOKEN_EXPIRE_MINUTES':'30',
+    'REFRESH_TOKEN_EXPIRE_DAYS':'7',
+    'CREATE_RESERVATION_EXPIRATION_TIME':'15',
+    'CHECKOUT_PAYMENT_EXPIRATION_TIME':'30',
+    'CHECKOUT_SESSION_EXPIRATION_TIME':'30',
+    'ORIGIN_1':'https://shop.test',
+    'ORIGIN_2':'https://admin.shop.test',
+    'ALLOWED_HOST_1':'testserver',
+    'ALLOWED_HOST_2':'shop.test',
+    'RESERVATION_REAPER_ENABLED':'false',
+    'RATING_STATS_RECONCILE_ENABLED':'false',
+    #sqlite has no row locks to skip, one consumer claims the queued events
+    'WEBHOOK_CONSUMERS':'1',
+    'WEBHOOK_POLL_SECONDS':'0.05',
+    'WEBHOOK_RETRY_BASE_SECONDS':'0.1',
+    'LOG_LEVEL':'WARNING',
+    'LOG_FORMAT':'text',
+})
+
+def wait_until(condition, timeout:float=10.0):
+    deadline=time.monotonic()+timeout
+    while time.monotonic()<deadline:
+        result=condition()
+        if result:
+            return result
+        time.sleep(0.05)
+    raise AssertionError('The condition was not met in time')
+
+def query(sql:str, parameters=()):
+    #assertions read the database directly, outside the app's engine
+    with sqlite3.connect(PRIMARY_DATABASE) as connection:
+        return connection.execute(sql, parameters).fetchall()
+
+@pytest.fixture(scope='session')
+def stripe_server():
+    import uvicorn
+    from services import fake_stripe
+    server=uvicorn.Server(uvicorn.Config(fake_stripe.app, host='127.0.0.1', port=STRIPE_PORT, log_level='warning'))
+    thread=threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    wait_until(lambda:server.started)
+    yield fake_stripe
+    server.should_exit=True
+    thread.join(timeout=5)
+
+@pytest.fixture(scope='session')
+def database():
+    from alembic import command
+    from migrations.schema import alembic_config
+    from services.passwords import hash_password_sync
+    command.upgrade(alembic_config(), 'head')
+    with sqlite3.connect(PRIMARY_DATABASE) as connection:
+        connection.execute(
+            "INSERT INTO users (username, hashed_password, email, name, lastname, disabled, verified, role, stripe_id, phone_number) "
+            "VALUES ('first_admin', ?, 'admin@example.com', 'first_admin', 'first_admin', 0, 1, 'admin', 'No id', '+12015550123')",
+            (hash_password_sync(ADMIN_PASSWORD),)
+        )
+    return PRIMARY_DATABASE
+
+@pytest.fixture(scope='session')
+def app_client(stripe_server, database):
+    from fastapi.testclient import TestClient
+    import main
+    #https, the session cookies are secure
+    with TestClient(main.app, base_url='https://testserver') as client:
+        yield client
+
+def login(client, username:str, password:str):
+    response=client.post('/users/token', data={'username':username, 'password':password})
+    assert response.status_code==200, response.text
+    return {'X-CSRF-Token':response.json()['csrf_token']}
+
+@pytest.fixture(scope='module')
+def admin(app_client):
+    #logs the shared client in as the admin and returns the csrf header
+    return login(app_client, 'first_admin', ADMIN_PASSWORD)
+
+@pytest.fixture(scope='module')
+def create_product(app_client, admin):
+    def create(title:str, category:str, price:str='10.00', stock:int=5, weight:float|None=None):
+        response=app_client.post('/products/create_product', headers=admin, json={
+            'title':title, 'description':f'{title} description', 'price':price, 'stock':stock, 'category':category,
+            'discount_percentage':'0', 'weight':weight, 'images':[{'image_url':f'https://img.shop.test/{title}', 'is_main':True}],
+            'status':'active', 'taxcode':'txcd_99999999'
+        })
+        assert response.status_code==201, response.text
+        return query('SELECT id FROM products WHERE title=?', (title,))[0][0]
+    return create
@@ -0,0 +1,72 @@
+import json
+import time
+import pytest
+from tests.conftest import WEBHOOK_SECRET, login, query, wait_until
+
+#CHECKOUT AND WEBHOOK: checkout session against services/fake_stripe.py, a signed checkout.session.completed event
+#through the webhook queue, and the fulfilled order. Redeliveries of the same event are deduped.
+
+@pytest.fixture(scope='module')
+def checkout(app_client, stripe_server, create_product):
+    product_id=create_product('checkout-product', 'checkout', price='12.00', stock=4)
+    response=app_client.post('/users/signup', json={
+        'username':'buyer', 'password':'Passw0rd!', 'email':'buyer@example.com', 'name':'Buyer', 'lastname':'Test',
+        'phone_number':'2015550124', 'phone_number_region':'US'
+    })
+    assert response.status_code==200, response.text
+    headers=login(app_client, 'buyer', 'Passw0rd!')
+    response=app_client.post('/payment/add_cart_product', headers=headers, json={'product_id':product_id, 'units':2})
+    assert response.status_code==200, response.text
+    response=app_client.post('/payment/create_checkout_session', headers=headers)
+    assert response.status_code==200, response.text
+    session_id=query('SELECT session_id FROM checkoutsessions ORDER BY id DESC LIMIT 1')[0][0]
+    return {'product_id':product_id, 'session':stripe_server.state['checkout_sessions'][session_id]}
+
+def completed_event(checkout_session:dict, event_id:str):
+    address={'line1':'1 Main St', 'line2':None, 'city':'Springfield', 'state':'IL', 'country':'US', 'postal_code':'62701'}
+    return {'id':event_id, 'object':'event', 'created':int(time.time()), 'type':'checkout.session.completed', 'data':{'object':{**checkout_session, 'customer_details':{'address':address}}}}
+
+def post_event(client, stripe_server, event:dict):
+    payload=json.dumps(event).encode()
+    return client.post('/payment/webhook/stripe', content=payload, headers={'stripe-signature':stripe_server.sign_payload(payload, WEBHOOK_SECRET), 'content-type':'application/json'})
+
+def processed(event_id:str):
+    rows=query('SELECT status FROM webhook_events WHERE event_id=?', (event_id,))
+    return rows and rows[0][0] in ('processed', 'dead') and rows[0][0]
+
+def test_checkout_session_reserves_the_stock(checkout):
+    assert query('SELECT units FROM reservations WHERE product_id=?', (checkout['product_id'],))==[(2,)]
+    assert checkout['session']['amount_total']==2400
+
+def test_completed_event_fulfills_the_checkout(app_client, stripe_server, checkout):
+    response=post_event(app_client, stripe_server, completed_event(checkout['session'], 'evt_checkout_1'))
+    assert response.status_code==200, response.text
+    assert wait_until(lambda:processed('evt_checkout_1'))=='processed'
+    orders=query('SELECT orders.id, orders.total_amount FROM orders JOIN checkoutsessions ON checkoutsessions.id=orders.checkout_session_id WHERE checkoutsessions.session_id=?', (checkout['session']['id'],))
+    assert len(orders)==1 and orders[0][1]==2400
+    assert query('SELECT product_id, units FROM order_items WHERE order_id=?', (orders[0][0],))==[(checkout['product_id'], 2)]
+    assert query('SELECT stock FROM products WHERE id=?', (checkout['product_id'],))==[(2,)]
+    assert query('SELECT COUNT(*) FROM reservations WHERE product_id=?', (checkout['product_id'],))==[(0,)]
+    assert query('SELECT COUNT(*) FROM cart WHERE product_id=?', (checkout['product_id'],))==[(0,)]
+
+def test_redelivered_event_is_deduped(app_client, stripe_server, checkout):
+    event=completed_event(checkout['session'], 'evt_checkout_1')
+    for _ in range(2):
+        response=post_event(app_client, stripe_server, event)
+        assert response.status_code==200, response.text
+    assert query('SELECT COUNT(*) FROM webhook_events WHERE event_id=?', ('evt_checkout_1',))==[(1,)]
+    assert query('SELECT COUNT(*) FROM processed_stripe_events WHERE event_id=?', ('evt_checkout_1',))==[(1,)]
+
+def test_new_event_for_a_fulfilled_session_creates_no_order(app_client, stripe_server, checkout):
+    #stripe can send the same completion under another event id, the order is keyed by the checkout session
+    response=post_event(app_client, stripe_server, completed_event(checkout['session'], 'evt_checkout_2'))
+    assert response.status_code==200, response.text
+    assert wait_until(lambda:processed('evt_checkout_2'))=='processed'
+    assert query('SELECT COUNT(*) FROM orders JOIN checkoutsessions ON checkoutsessions.id=orders.checkout_session_id WHERE checkoutsessions.session_id=?', (checkout['session']['id'],))==[(1,)]
+    assert query('SELECT stock FROM products WHERE id=?', (checkout['product_id'],))==[(2,)]
+
+def test_event_with_a_bad_signature_is_rejected(app_client, checkout):
+    payload=json.dumps(completed_event(checkout['session'], 'evt_checkout_3')).encode()
+    response=app_client.post('/payment/webhook/stripe', content=payload, headers={'stripe-signature':'t=1,v1=bad', 'content-type':'application/json'})
+    assert response.status_code==400
+    assert query('SELECT COUNT(*) FROM webhook_events WHERE event_id=?', ('evt_checkout_3',))==[(0,)]
@@ -0,0 +1,70 @@
+import pytest
+
+#PAGINATION: the cursor walks of /products/get_products_search against the order each sort promises.
+#NULL sort values come last ascending and first descending, ties are broken by the product id in the sort direction.
+
+CATEGORY='pagination'
+
+@pytest.fixture(scope='module')
+def products(app_client, create_product):
+    weights=[2.0, None, 1.0, 2.0, None, 3.0, 1.0]
+    prices=['5.00', '7.50', '5.00', '1.25', '9.00', '7.50', '3.00']
+    return [
+        {'id':create_product(f'paginated-{index}', CATEGORY, price=price, weight=weight), 'weight':weight, 'price':float(price)}
+        for index, (weight, price) in enumerate(zip(weights, prices))
+    ]
+
+def walk(client, sort_by:str, limit:int):
+    pages, cursor=[], ''
+    while cursor is not None:
+        response=client.post('/products/get_products_search', params={'limit':limit, 'cursor':cursor}, json={'category':CATEGORY, 'sort_by':sort_by})
+        assert response.status_code==200, response.text
+        body=response.json()
+        assert len(body['products'])<=limit
+        pages.append([product['id'] for product in body['products']])
+        cursor=body['next_cursor']
+    return pages
+
+def expected_order(products, field:str, ascending:bool):
+    values=[product for product in products if product[field] is not None]
+    nulls=[product for product in products if product[field] is None]
+    values.sort(key=lambda product:(product[field], product['id']), reverse=not ascending)
+    nulls.sort(key=lambda product:product['id'], reverse=not ascending)
+    ordered=values+nulls if ascending else nulls+values
+    return [product['id'] for product in ordered]
+
+@pytest.mark.parametrize('sort_by', ['weight_asc', 'weight_desc', 'price_asc', 'price_desc'])
+@pytest.mark.parametrize('limit', [1, 2, 3, 10])
+def test_cursor_walk_matches_the_sort_order(app_client, products, sort_by, limit):
+    field, direction=sort_by.rsplit('_', 1)
+    pages=walk(app_client, sort_by, limit)
+    walked=[product_id for page in pages for product_id in page]
+    assert walked==expected_order(products, field, direction=='asc')
+    assert len(walked)==len(set(walked))
+
+def test_null_segment_boundary_round_trips(app_client, products):
+    #pages of 2 over 2 NULL weights and 5 values: the NULL segment starts in the middle of the third page ascending
+    pages=walk(app_client, 'weight_asc', 2)
+    null_ids={product['id'] for product in products if product['weight'] is None}
+    assert set(pages[-1])<=null_ids
+    assert pages[2][0] not in null_ids and pages[2][1] in null_ids
+    #and it is the first segment descending
+    pages=walk(app_client, 'weight_desc', 2)
+    assert set(pages[0])==null_ids
+
+def test_cursor_of_another_sort_is_rejected(app_client, products):
+    response=app_client.post('/products/get_products_search', params={'limit':2, 'cursor':''}, json={'category':CATEGORY, 'sort_by':'weight_asc'})
+    cursor=response.json()['next_cursor']
+    response=app_client.post('/products/get_products_search', params={'limit':2, 'cursor':cursor}, json={'category':CATEGORY, 'sort_by':'price_asc'})
+    assert response.status_code==400
+
+def test_invalid_cursor_is_rejected(app_client, products):
+    response=app_client.post('/products/get_products_search', params={'limit':2, 'cursor':'not-a-cursor'}, json={'category':CATEGORY, 'sort_by':'weight_asc'})
+    assert response.status_code==400
+
+def test_offset_mode_is_kept_without_a_cursor(app_client, products):
+    response=app_client.post('/products/get_products_search', params={'limit':3, 'page':2}, json={'category':CATEGORY, 'sort_by':'price_asc'})
+    assert response.status_code==200
+    body=response.json()
+    assert body['next_cursor'] is None
+    assert len(body['products'])==3
@@ -0,0 +1,72 @@
+import os
+import sqlite3
+import httpx
+import pytest
+from tests.conftest import ADMIN_PASSWORD, PRIMARY_DATABASE, TEST_DIRECTORY, query
+
+#READ REPLICA ROUTING with two local databases: the replica is a copy of the primary taken before the write, so a
+#read shows which database answered it. Reads of a client that just wrote stay on the primary (read_primary_until).
+
+@pytest.fixture
+def replica(request, app_client, create_product, monkeypatch):
+    import database
+    import dependencies.database
+    from sqlalchemy.ext.asyncio import async_sessionmaker
+    product_id=create_product(request.node.name, 'replica', price='20.00')
+    replica_path=os.path.join(TEST_DIRECTORY, 'replica.db')
+    with sqlite3.connect(PRIMARY_DATABASE) as primary, sqlite3.connect(replica_path) as copy:
+        primary.backup(copy)
+    replica_engine, replica_pool_metrics=database.create_database_engine(f'sqlite+aiosqlite:///{replica_path}')
+    replica_session=async_sessionmaker(bind=replica_engine, autoflush=False, expire_on_commit=False)
+    monkeypatch.setattr(database, 'replica_engine', replica_engine)
+    monkeypatch.setattr(database, 'replica_pool_metrics', replica_pool_metrics)
+    monkeypatch.setattr(database, 'ReplicaSessionLocal', replica_session)
+    monkeypatch.setattr(dependencies.database, 'ReplicaSessionLocal', replica_session)
+    monkeypatch.setattr(database, 'replica_state', {'lag_seconds':None, 'checked_at':0.0})
+    yield product_id
+    app_client.portal.call(replica_engine.dispose)
+
+def routed_client():
+    #main.py adds the middleware only when REPLICA_DATABASE_URL is set at startup
+    import main
+    from dependencies.database import ReadAfterWriteMiddleware
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=ReadAfterWriteMiddleware(main.app)), base_url='https://testserver')
+
+async def read_price(client, product_id:int):
+    from cache import catalog_cache
+    #the catalog cache would answer before either database
+    catalog_cache.clear_nowait()
+    response=await client.get(f'/products/get_product/{product_id}')
+    assert response.status_code==200, response.text
+    return response.json()['product']['price']
+
+def test_anonymous_reads_go_to_the_replica(app_client, replica):
+    query('UPDATE products SET price=21 WHERE id=?', (replica,))
+    async def scenario():
+        async with routed_client() as anonymous:
+            return await read_price(anonymous, replica)
+    assert float(app_client.portal.call(scenario))==20.0
+
+def test_writer_reads_its_own_write_from_the_primary(app_client, replica):
+    async def scenario():
+        async with routed_client() as writer, routed_client() as anonymous:
+            response=await writer.post('/users/token', data={'username':'first_admin', 'password':ADMIN_PASSWORD})
+            headers={'X-CSRF-Token':response.json()['csrf_token']}
+            response=await writer.patch(f'/products/update_product/{replica}', headers=headers, json={'price':'25.00'})
+            assert response.status_code==200, response.text
+            assert 'read_primary_until' in response.cookies
+            return await read_price(writer, replica), await read_price(anonymous, replica)
+    writer_price, anonymous_price=app_client.portal.call(scenario)
+    assert float(writer_price)==25.0
+    assert float(anonymous_price)==20.0
+
+def test_lagging_replica_is_skipped(app_client, replica, monkeypatch):
+    import database
+    query('UPDATE products SET price=22 WHERE id=?', (replica,))
+    async def lagging():
+        return database.REPLICA_MAX_LAG_SECONDS+1
+    monkeypatch.setattr(database, 'replica_lag', lagging)
+    async def scenario():
+        async with routed_client() as anonymous:
+            return await read_price(anonymous, replica)
+    assert float(app_client.portal.call(scenario))==22.0
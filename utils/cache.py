@@ -0,0 +1,268 @@
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from utils.responses import dumps, loads
+
+logger=logging.getLogger(__name__)
+
+#CACHE BACKENDS
+#every backend exposes async get/set/delete/delete_namespace/clear and stats/start/stop, request handlers await them
+#so a redis round trip never blocks the event loop.
+#keys are tuples whose first item is a namespace ('get_product', product_id), so a whole namespace can be dropped at once.
+#values must be serializable by utils.responses.dumps (what the responses accept) and are not copied, callers must not mutate what they store or get back.
+
+#bounded LRU + TTL cache local to the process
+class TTLCache:
+    def __init__(self, max_entries:int, max_bytes:int, ttl_seconds:float):
+        self.max_entries=max_entries
+        self.max_bytes=max_bytes
+        self.ttl_seconds=ttl_seconds
+        self._entries=OrderedDict()
+        self._bytes=0
+        self._lock=threading.Lock()
+        self.hits=0
+        self.misses=0
+        self.evictions=0
+        self._invalidation_listeners=[]
+
+    def _remove(self, key):
+        expires_at, size, value=self._entries.pop(key)
+        self._bytes-=size
+
+    #the *_nowait methods are the synchronous versions, for the redis local copy and its invalidation thread
+    def get_nowait(self, key):
+        with self._lock:
+            entry=self._entries.get(key)
+            if entry is None:
+                self.misses+=1
+                return None
+            if entry[0]<=time.monotonic():
+                self._remove(key)
+                self.misses+=1
+                return None
+            self._entries.move_to_end(key)
+            self.hits+=1
+            return entry[2]
+
+    def set_nowait(self, key, value, ttl_seconds:float|None=None):
+        size=len(dumps(value))
+        if size>self.max_bytes:
+            return
+        expires_at=time.monotonic()+(ttl_seconds if ttl_seconds is not None else self.ttl_seconds)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key]=(expires_at, size, value)
+            self._bytes+=size
+            while len(self._entries)>self.max_entries or self._bytes>self.max_bytes:
+                oldest_key=next(iter(self._entries))
+                self._remove(oldest_key)
+                self.evictions+=1
+
+    def delete_nowait(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+    def delete_namespace_nowait(self, namespace:str):
+        with self._lock:
+            for key in [key for key in self._entries if key[0]==namespace]:
+                self._remove(key)
+        self._notify(namespace)
+
+    def clear_nowait(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes=0
+        self._notify(None)
+
+    #callback(namespace) runs after a namespace is dropped (None for a clear), also when the drop comes from another
+    #worker (redis backend, on the invalidation thread), so it must be quick and thread safe
+    def add_invalidation_listener(self, callback):
+        self._invalidation_listeners.append(callback)
+
+    def _notify(self, namespace:str|None):
+        for callback in self._invalidation_listeners:
+            callback(namespace)
+
+    async def get(self, key):
+        return self.get_nowait(key)
+
+    async def set(self, key, value, ttl_seconds:float|None=None):
+        self.set_nowait(key, value, ttl_seconds)
+
+    async def delete(self, key):
+        self.delete_nowait(key)
+
+    async def delete_namespace(self, namespace:str):
+        self.delete_namespace_nowait(namespace)
+
+    async def clear(self):
+        self.clear_nowait()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries':len(self._entries),
+                'bytes':self._bytes,
+                'hits':self.hits,
+                'misses':self.misses,
+                'evictions':self.evictions
+            }
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+#shared cache for multi-worker deployments: redis holds the entries for every worker and a short-lived local
+#TTLCache in front of it avoids a round trip for hot keys. Invalidations are broadcast over pub/sub so every
+#worker drops its local copy, the short local TTL bounds staleness if a message is ever missed.
+#redis errors never fail a request, they are counted and treated as a miss. Commands go through the redis.asyncio
+#client, the invalidation listener is a thread with its own blocking client.
+class RedisCache:
+    def __init__(self, name:str, client, pubsub_client, max_entries:int, max_bytes:int, ttl_seconds:float, local_ttl_seconds:float):
+        from redis.exceptions import RedisError
+        self._redis_error=RedisError
+        self.name=name
+        self.client=client
+        self.pubsub_client=pubsub_client
+        self.ttl_seconds=ttl_seconds
+        self.local=TTLCache(max_entries, max_bytes, min(local_ttl_seconds, ttl_seconds))
+        self.channel=f'cache:{name}:invalidate'
+        self.hits=0
+        self.misses=0
+        self.errors=0
+        self._listener=None
+        self._stopped=threading.Event()
+
+    def _key(self, key):
+        return f'cache:{self.name}:'+json.dumps(key, default=str, separators=(',', ':'))
+
+    def _namespace_key(self, namespace:str):
+        return f'cache:{self.name}:namespace:{namespace}'
+
+    def add_invalidation_listener(self, callback):
+        #the local copy is dropped on every invalidation, local or broadcast
+        self.local.add_invalidation_listener(callback)
+
+    def _error(self, operation:str, error):
+        self.errors+=1
+        logger.warning('Cache %s %s failed: %s', self.name, operation, error)
+
+    async def _publish(self, message:dict):
+        await self.client.publish(self.channel, json.dumps(message, default=str))
+
+    async def get(self, key):
+        value=self.local.get_nowait(key)
+        if value is not None:
+            return value
+        try:
+            raw=await self.client.get(self._key(key))
+        except self._redis_error as e:
+            self._error('get', e)
+            return None
+        if raw is None:
+            self.misses+=1
+            return None
+        self.hits+=1
+        value=loads(raw)
+        self.local.set_nowait(key, value)
+        return value
+
+    async def set(self, key, value, ttl_seconds:float|None=None):
+        ttl_seconds=ttl_seconds if ttl_seconds is not None else self.ttl_seconds
+        self.local.set_nowait(key, value, min(ttl_seconds, self.local.ttl_seconds))
+        redis_key=self._key(key)
+        namespace_key=self._namespace_key(key[0])
+        try:
+            async with self.client.pipeline(transaction=False) as pipe:
+                pipe.set(redis_key, dumps(value), ex=max(1, int(ttl_seconds)))
+                pipe.sadd(namespace_key, redis_key)
+                pipe.expire(namespace_key, max(1, int(ttl_seconds)))
+                await pipe.execute()
+        except self._redis_error as e:
+            self._error('set', e)
+
+    async def delete(self, key):
+        self.local.delete_nowait(key)
+        try:
+            await self.client.delete(self._key(key))
+            await self._publish({'op':'delete', 'key':key})
+        except self._redis_error as e:
+            self._error('delete', e)
+
+    async def delete_namespace(self, namespace:str):
+        self.local.delete_namespace_nowait(namespace)
+        namespace_key=self._namespace_key(namespace)
+        try:
+            redis_keys=await self.client.smembers(namespace_key)
+            async with self.client.pipeline(transaction=False) as pipe:
+                if redis_keys:
+                    #SREM only what was read, keys added meanwhile stay tracked for the next invalidation
+                    pipe.delete(*redis_keys)
+                    pipe.srem(namespace_key, *redis_keys)
+                pipe.publish(self.channel, json.dumps({'op':'namespace', 'namespace':namespace}))
+                await pipe.execute()
+        except self._redis_error as e:
+            self._error('delete_namespace', e)
+
+    async def clear(self):
+        self.local.clear_nowait()
+        try:
+            redis_keys=[redis_key async for redis_key in self.client.scan_iter(match=f'cache:{self.name}:*')]
+            if redis_keys:
+                await self.client.delete(*redis_keys)
+            await self._publish({'op':'clear'})
+        except self._redis_error as e:
+            self._error('clear', e)
+
+    def _apply(self, message:dict):
+        if message['op']=='delete':
+            self.local.delete_nowait(tuple(message['key']))
+        elif message['op']=='namespace':
+            self.local.delete_namespace_nowait(message['namespace'])
+        else:
+            self.local.clear_nowait()
+
+    def _listen(self):
+        while not self._stopped.is_set():
+            pubsub=None
+            try:
+                pubsub=self.pubsub_client.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self.channel)
+                #messages may have been missed while (re)connecting
+                self.local.clear_nowait()
+                while not self._stopped.is_set():
+                    message=pubsub.get_message(timeout=1.0)
+                    if message is not None:
+                        self._apply(json.loads(message['data']))
+            except self._redis_error as e:
+                self._error('subscribe', e)
+                self._stopped.wait(1.0)
+            finally:
+                if pubsub is not None:
+                    pubsub.close()
+
+    def start(self):
+        if self._listener is None:
+            self._stopped.clear()
+            self._listener=threading.Thread(target=self._listen, name=f'cache-{self.name}-invalidation', daemon=True)
+            self._listener.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._listener is not None:
+            self._listener.join(timeout=2.0)
+            self._listener=None
+
+    def stats(self):
+        return {
+            **self.local.stats(),
+            'remote_hits':self.hits,
+            'remote_misses':self.misses,
+            'errors':self.errors
+        }
@@ -0,0 +1,94 @@
+import base64
+import json
+from datetime import datetime
+from fastapi import HTTPException, status
+from sqlalchemy import and_, tuple_
+
+#KEYSET (CURSOR) PAGINATION
+#the cursor carries the sort key plus the (value, id) of the last row returned, so the next page starts with an
+#index range scan right after that row instead of reading and discarding OFFSET rows. NULL sort values go last ascending
+#and first descending, like the offset mode and the indexes.
+
+def encode_cursor(sort_key:str, value, row_id:int):
+    if isinstance(value, datetime):
+        value=value.isoformat()
+    elif value is not None and not isinstance(value, (int, float)):
+        value=str(value)
+    raw=json.dumps({'s':sort_key, 'v':value, 'id':row_id}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+def decode_cursor(cursor:str, sort_key:str, order_column=None):
+    try:
+        raw=base64.urlsafe_b64decode(cursor+'='*(-len(cursor)%4))
+        data=json.loads(raw)
+        if data['s']!=sort_key:
+            raise ValueError('The cursor belongs to another sort order')
+        value=data['v']
+        if value is not None and order_column is not None:
+            python_type=order_column.type.python_type
+            value=datetime.fromisoformat(value) if python_type is datetime else python_type(value)
+        return value, int(data['id'])
+    except (ValueError, KeyError, TypeError, NotImplementedError):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='Invalid cursor')
+
+async def fetch_rows(session, query):
+    #a single selected entity comes back as the objects themselves, several as rows
+    result=await session.execute(query)
+    if len(query.column_descriptions)==1:
+        return result.scalars().all()
+    return result.all()
+
+def keyset_segments(cursor_value, last_id, id_column, order_column, ascending:bool):
+    #(filter, order by) of each part of the ordering left after the cursor (last_id None for the first page).
+    #a nullable column is read as two index range scans, NULLs last ascending and first descending: the order a forward
+    #or a backward scan of a (column, id) index returns them in, so no OR is needed and no page sorts the whole table
+    id_order=id_column.asc() if ascending else id_column.desc()
+    value_order=[order_column.asc() if ascending else order_column.desc(), id_order] if order_column is not None else None
+    nullable=order_column is not None and getattr(order_column, 'nullable', True)
+    if last_id is None:
+        if not nullable:
+            return [(None, value_order or [id_order])]
+        values=(order_column.is_not(None), value_order)
+        nulls=(order_column.is_(None), [id_order])
+        return [values, nulls] if ascending else [nulls, values]
+    after_id=id_column>last_id if ascending else id_column<last_id
+    if order_column is None:
+        return [(after_id, [id_order])]
+    row_key=tuple_(order_column, id_column)
+    after_row=row_key>tuple_(cursor_value, last_id) if ascending else row_key<tuple_(cursor_value, last_id)
+    if not nullable:
+        return [(after_row, value_order)]
+    nulls=(order_column.is_(None), [id_order])
+    if cursor_value is None:
+        #the cursor is inside the NULLs
+        nulls_after=(and_(order_column.is_(None), after_id), [id_order])
+        return [nulls_after] if ascending else [nulls_after, (order_column.is_not(None), value_order)]
+    #the row comparison already leaves the NULLs out
+    return [(after_row, value_order), nulls] if ascending else [(after_row, value_order)]
+
+async def keyset_paginate(session, query, cursor:str, limit:int, sort_key:str, id_column, order_column=None, ascending:bool=True, row_values=None):
+    if row_values is None:
+        row_values=lambda row:(getattr(row, order_column.key) if order_column is not None else None, getattr(row, id_column.key))
+    cursor_value, last_id=decode_cursor(cursor, sort_key, order_column) if cursor else (None, None)
+    rows=[]
+    #the next segment is only read when the page is not full yet
+    for segment_filter, order_by in keyset_segments(cursor_value, last_id, id_column, order_column, ascending):
+        segment_query=query.filter(segment_filter) if segment_filter is not None else query
+        rows+=await fetch_rows(session, segment_query.order_by(*order_by).limit(limit+1-len(rows)))
+        if len(rows)>limit:
+            break
+    next_cursor=None
+    if len(rows)>limit:
+        rows=rows[:limit]
+        value, row_id=row_values(rows[-1])
+        next_cursor=encode_cursor(sort_key, value, row_id)
+    return rows, next_cursor
+
+async def paginate(session, query, page:int, limit:int, cursor:str|None, sort_key:str, id_column, order_column=None, ascending:bool=True, row_values=None):
+    #cursor=None keeps the classic page/limit behaviour, any other value (an empty string for the first page) switches to keyset mode
+    if cursor is not None:
+        return await keyset_paginate(session, query, cursor, limit, sort_key, id_column, order_column, ascending, row_values)
+    if order_column is not None:
+        query=query.order_by(order_column.asc() if ascending else order_column.desc())
+    offset=(page-1)*limit
+    return await fetch_rows(session, query.offset(offset).limit(limit)), None
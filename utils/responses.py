@@ -0,0 +1,30 @@
+from decimal import Decimal
+import orjson
+from fastapi.responses import JSONResponse
+from sqlalchemy.engine import Row, RowMapping
+
+#JSON RESPONSES
+#orjson writes datetimes (ISO 8601), enums, UUIDs and dataclasses natively, default() adds Decimal (as a string, so
+#prices keep their exact digits), SQLAlchemy rows and mappings (as objects keyed by column name or label) and sets.
+#routers return column values and selected rows as they come from the database instead of converting every field.
+
+def json_default(value):
+    if isinstance(value, Decimal):
+        return str(value)
+    if isinstance(value, Row):
+        return value._asdict()
+    if isinstance(value, RowMapping):
+        return dict(value)
+    if isinstance(value, (set, frozenset)):
+        return list(value)
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+
+def dumps(content)->bytes:
+    return orjson.dumps(content, default=json_default, option=orjson.OPT_NON_STR_KEYS)
+
+def loads(raw):
+    return orjson.loads(raw)
+
+class ORJSONResponse(JSONResponse):
+    def render(self, content)->bytes:
+        return dumps(content)